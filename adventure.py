@@ -1,17 +1,80 @@
 # adventure.py
+import os
 import re
-import json
+import uuid
 from llm import (
     call_gpt,
-    DM_SYSTEM,
+    acall_gpt,
+    stream_gpt,
+    submit,
+    is_gpt_error,
     EVENT_SYSTEM,
     build_opening_scene_prompt,
+    build_node_round_prompt,
     parse_action,
     build_event_prompt
 )
 from utils import extract_json
-from world import enrich_npc_personality
-import random
+from llm_log import log_debug
+from prompt_budget import PromptAssembler
+from adventure_store import record_round
+from clue_index import record_clues, already_told
+from world_tick import tick, chapter_for, session_seed, NODE_ROUND_LIMIT
+
+# 每累计多少回合未压缩的历史，就在后台把它折叠进滚动摘要
+SUMMARY_EVERY = int(os.getenv("ADVENTURE_SUMMARY_EVERY", "5"))
+# 节点回合 prompt 里附带的最近回合数（再按 token 预算裁剪）
+NODE_ROUND_RECENT = 3
+
+ROLLING_SUMMARY_SYSTEM = "You are an expert RPG chronicler who keeps a compact running recap of an adventure."
+
+
+def _history_lines(entries):
+    return "".join([f"Player: {h['player']}\nDM: {h['dm']}\n\n" for h in entries])
+
+
+def history_with_summary(state):
+    """
+    滚动摘要 + 尚未折叠进摘要的最近回合。
+    长度只取决于摘要大小和 SUMMARY_EVERY，与冒险总回合数无关
+    """
+    history = state["history"]
+    summary = state.get("summary", "")
+    upto = state.get("summary_upto", 0)
+    tail = _history_lines(history[upto:])
+    if not summary:
+        return tail
+    return f"Story so far: {summary}\n\n{tail}"
+
+
+def build_fold_prompt(previous, entries, lang_ui):
+    """
+    滚动摘要的 prompt：说明放 system（稳定前缀），已有摘要 + 新回合放 user。
+    新回合必须全部折叠进摘要，所以两个 section 都完整保留
+    """
+    pa = PromptAssembler()
+    pa.static(ROLLING_SUMMARY_SYSTEM)
+    if lang_ui == "中文":
+        pa.static("用户会给出冒险到目前为止的摘要，以及之后新发生的几个回合。"
+                  "请输出更新后的完整摘要（不超过 200 字），保留关键情节、线索、角色关系与未解决的冲突。")
+        pa.section("已有摘要", previous or "（无）", required=True)
+        pa.section("新回合", _history_lines(entries), required=True)
+    else:
+        pa.static("The user gives you the recap of the adventure so far and the rounds that happened since. "
+                  "Write the updated full recap (at most 150 words), keeping key plot points, clues, "
+                  "character relationships and unresolved conflicts.")
+        pa.section("Recap so far", previous or "(none)", required=True)
+        pa.section("New rounds", _history_lines(entries), required=True)
+    system_prompt, user_prompt, _ = pa.build()
+    return system_prompt, user_prompt
+
+
+async def _fold_summary(previous, entries, lang_ui):
+    """把新回合折叠进已有摘要，返回新的摘要文本（失败返回 GPTError）"""
+    system_prompt, prompt = build_fold_prompt(previous, entries, lang_ui)
+    return await acall_gpt(system_prompt, prompt, temperature=0.3, max_tokens=400,
+                           site="summary.rolling")
+
 
 # 管理冒险状态（history / round / options）
 class AdventureManager:
@@ -19,11 +82,17 @@ class AdventureManager:
         self.world_obj = world_obj
         self.lang_ui = lang_ui
 
-        # ---------- NPC 性格扩展（只执行一次） ----------
-        for npc in self.world_obj.get("characters", []):
-            enrich_npc_personality(npc)
+        # NPC 性格在生成世界 / 打开世界时已经扩展好，这里只是现有状态的视图
 
         self.state = session_state["adventure"]
+        # 会话 id 在第一回合前就确定（record_round 用它建会话记录）；
+        # 会话种子由世界种子 + 会话 id 推出，并随回合日志保存，用于重放
+        self.state.setdefault("session_id", uuid.uuid4().hex)
+        if "rng_seed" not in self.state:
+            self.state["rng_seed"] = session_seed(self.world_obj.get("rng_seed"), self.state["session_id"])
+        # 上一次后台摘要如果已经完成，先收进 state
+        self._collect_summary()
+
         # ---------- 节点故事引擎初始化 ----------
         adv = self.world_obj.get("adventure_state", {})
         if "current_node" not in adv:
@@ -41,16 +110,45 @@ class AdventureManager:
 
     def recent_history_text(self, n=3, full=False):
         """
-        返回最近 n 回合 或 全部历史
+        返回最近 n 回合；full=True 时返回 滚动摘要 + 未折叠的最近回合
         """
-        history = self.state["history"]
-        
         if full:
-            selected = history
-        else:
-            selected = history[-n:]
+            return history_with_summary(self.state)
+        return _history_lines(self.state["history"][-n:])
+
+    # ----------- 滚动摘要（后台增量更新） -----------
+
+    def _collect_summary(self):
+        job = self.state.get("_summary_job")
+        if job is None or not job.done():
+            return
+        self.state.pop("_summary_job", None)
+        upto = self.state.pop("_summary_job_upto", 0)
+        try:
+            summary = job.result()
+        except Exception:
+            return
+        if is_gpt_error(summary) or not summary:
+            return      # 失败就保持旧摘要，下次回合再试
+        self.state["summary"] = summary.strip()
+        self.state["summary_upto"] = upto
+
+    def _maybe_refresh_summary(self):
+        """未折叠的回合达到 SUMMARY_EVERY 时，在 LLM 事件循环上后台更新摘要（不阻塞本回合）"""
+        self._collect_summary()
+        if "_summary_job" in self.state:
+            return
+
+        history = self.state["history"]
+        upto = self.state.get("summary_upto", 0)
+        if len(history) - upto < SUMMARY_EVERY:
+            return
 
-        return "".join([f"Player: {h['player']}\nDM: {h['dm']}\n\n" for h in selected])
+        entries = history[upto:]
+        self.state["_summary_job_upto"] = len(history)
+        self.state["_summary_job"] = submit(
+            _fold_summary(self.state.get("summary", ""), entries, self.lang_ui)
+        )
     
     def _to_number(self, x):
         if isinstance(x, (int, float)):
@@ -69,9 +167,27 @@ class AdventureManager:
 
     # 开始冒险 → 生成开场剧情
     def start_adventure(self):
-        prompt = build_opening_scene_prompt(self.world_obj, self.lang_ui)
-        dm_resp = call_gpt(DM_SYSTEM, prompt, max_tokens=1000)
-
+        system_prompt, prompt = build_opening_scene_prompt(self.world_obj, self.lang_ui)
+        dm_resp = call_gpt(system_prompt, prompt, max_tokens=1000, cache=True, site="opening_scene")
+        if is_gpt_error(dm_resp):
+            self.state["last_error"] = dm_resp
+            return
+        self._finish_opening(dm_resp)
+
+    def stream_start_adventure(self):
+        """start_adventure 的流式版本：逐段 yield 开场文本，流结束后写入 history / options"""
+        system_prompt, prompt = build_opening_scene_prompt(self.world_obj, self.lang_ui)
+        parts = []
+        for tok in stream_gpt(system_prompt, prompt, max_tokens=1000, cache=True, site="opening_scene"):
+            if is_gpt_error(tok):
+                self.state["last_error"] = tok
+                return
+            parts.append(tok)
+            yield tok
+        self._finish_opening("".join(parts).strip())
+
+    def _finish_opening(self, dm_resp):
+        self.state.pop("last_error", None)
         options = self.extract_options(dm_resp)
         if not options:
             if self.lang_ui == "中文":
@@ -82,6 +198,8 @@ class AdventureManager:
         self.state["history"].append({"player": "(start)", "dm": dm_resp})
         self.state["options"] = options
         self.state["round"] += 1
+        record_round(self.state, self.world_obj, self.lang_ui)
+        self._maybe_refresh_summary()
 
     def apply_event(self, world_obj, event):
         """
@@ -113,65 +231,33 @@ class AdventureManager:
         return world_obj
 
     # ----------- 正常/最终回合 -----------
-    def render_node_round(self, node_summary, player_action):
-        prompt = f"""
-        你是这个故事的叙述者。根据以下信息写出【本回合发生的事件】，共 3~4 句。
-
-        规则：
-        - 本回合必须体现玩家刚才的动作所带来的影响
-        - 必须推动故事朝节点摘要方向推进，但不能重复上回合文字
-        - 必须加入新的细节：线索 / 新角色出现 / 冲突 / 环境变化（二选一）
-        - 保持语言自然，不要模板化，不要重复相同句式
-
-        节点摘要（剧情方向）：
-        {node_summary}
-
-        玩家动作（必须融入叙述）：
-        {player_action}
-        """
+    def _node_round_prompt(self, node_summary, player_action):
+        """(system, user)：规则是稳定前缀，最近回合 / 主线 / NPC 按 token 预算裁剪"""
+        return build_node_round_prompt(self.world_obj, node_summary, player_action, self.lang_ui,
+                                       recent=self.state["history"][-NODE_ROUND_RECENT:])
 
-        dm_text = call_gpt(DM_SYSTEM, prompt, max_tokens=250)
+    def render_node_round(self, node_summary, player_action):
+        system_prompt, prompt = self._node_round_prompt(node_summary, player_action)
+        dm_text = call_gpt(system_prompt, prompt, max_tokens=250, site="node_round")
         return dm_text
 
+    def stream_node_round(self, node_summary, player_action):
+        system_prompt, prompt = self._node_round_prompt(node_summary, player_action)
+        yield from stream_gpt(system_prompt, prompt, max_tokens=250, site="node_round")
 
 
 
-    # ---------- 世界状态自动呼吸 ----------
-    def update_world_state(self):
-        ws = self.world_obj.get("world_state", {})
-
-        # 轻微波动：让世界“活着”
-        for key in ["tension", "corruption", "magic_density", "radiation"]:
-            if key in ws and isinstance(ws[key], (int, float)):
-                ws[key] += random.randint(-2, 3)   # 小范围波动
-                ws[key] = max(0, min(100, ws[key]))
 
-        # 昼夜循环 0=白天 1=黄昏 2=夜晚
-        if "time_of_day" in ws:
-            ws["time_of_day"] = (ws["time_of_day"] + 1) % 3
-
-        # 天气系统（随机变化，低概率变化）
-        if "weather" in ws:
-            if random.random() < 0.2:  # 20% 概率改变
-                ws["weather"] = random.choice(["clear", "cloudy", "fog", "rain", "storm", "snow"])
-
-        # 写回
-        self.world_obj["world_state"] = ws
-    
-    # ---------- 主线剧情推进 ----------
-    def advance_story(self):
-        adv = self.world_obj.get("adventure_state", {})
-
-        # 如果已经触发了终章就不要再推进
-        if adv.get("final_triggered"):
-            return
-
-        # 每回合推进主线（3~8% 随机，避免跳太快）
-        increment = random.randint(3, 8)
-        adv["story_progress"] = min(100, adv.get("story_progress", 0) + increment)
-
-        # 写回
-        self.world_obj["adventure_state"] = adv
+    # ---------- 世界状态自动呼吸 + 主线推进 ----------
+    # 每个成功的回合结束后调用一次。随机性只来自会话种子 + 回合号（world_tick 里的纯函数），
+    # 从初始状态出发可以用 world_tick.replay 完整重放
+    def tick_world(self, round_no=None):
+        round_no = len(self.state["history"]) if round_no is None else round_no
+        ticked = tick({"world_state": self.world_obj.get("world_state", {}),
+                       "adventure_state": self.world_obj.get("adventure_state", {})},
+                      self.state["rng_seed"], round_no)
+        self.world_obj["world_state"] = ticked["world_state"]
+        self.world_obj["adventure_state"] = ticked["adventure_state"]
 
     def update_npc_by_player_action(self, parsed, world):
         target = parsed.get("target", "")
@@ -199,8 +285,6 @@ class AdventureManager:
     def control_information_layer(self, parsed, world):
         """控制 NPC 本回合允许透露的信息层级"""
 
-        memory = world.setdefault("memory", {})
-        info_history = memory.setdefault("info_given", [])
         progress = world["adventure_state"]["story_progress"]
         chapter = world["adventure_state"].get("chapter", 0)
         topic = parsed.get("topic", "")
@@ -211,7 +295,7 @@ class AdventureManager:
             return "no_information"
 
         # --- 若已给过同主题信息：仅提供更深细节，不重复 ---
-        if topic and any(topic in info for info in info_history):
+        if topic and already_told(world, topic):
             return "deepening"
 
         # --- 按章节决定最大信息深度 ---
@@ -232,37 +316,53 @@ class AdventureManager:
         return "shallow"
     
     def save_given_info(self, event, world):
-        text = event["dm_text"]
-        memory = world.setdefault("memory", {})
-        info_history = memory.setdefault("info_given", [])
+        # 用世界自己的线索词典（生成时建立）提取 NPC 给出的信息，并累计每个主题的深度
+        record_clues(world, event["dm_text"])
 
-        # 捕捉 NPC 提供的重要信息（简单关键词提取）
-        keywords = ["魔法阵", "失踪", "女巫", "黑暗力量", "仪式", "水晶"]
-
-        for kw in keywords:
-            if kw in text and kw not in info_history:
-                info_history.append(kw)
-
-    
     def get_chapter(self, progress):
-        if progress < 10:
-            return 0  # 序章
-        if progress < 30:
-            return 1  # 线索阶段
-        if progress < 60:
-            return 2  # 冲突阶段
-        if progress < 80:
-            return 3  # 危机逼近
-        if progress < 100:
-            return 4  # 终章前夕
-        return 5        # 最终章
+        # 0 序章 / 1 线索阶段 / 2 冲突阶段 / 3 危机逼近 / 4 终章前夕 / 5 最终章
+        return chapter_for(progress)
 
     def next_round(self, player_action):
+        current_node = self._enter_node(player_action)
+        dm_text = self.render_node_round(current_node["summary"], player_action)
+        if is_gpt_error(dm_text):
+            return self._fail_round(dm_text)
+        event = self._close_round(player_action, dm_text)
+        self.tick_world()
+        record_round(self.state, self.world_obj, self.lang_ui)
+        self._maybe_refresh_summary()
+        return event
+
+    def stream_next_round(self, player_action):
+        """next_round 的流式版本：逐段 yield DM 文本，流结束后再写 history / options"""
+        current_node = self._enter_node(player_action)
+        parts = []
+        for tok in self.stream_node_round(current_node["summary"], player_action):
+            if is_gpt_error(tok):
+                self._fail_round(tok)
+                return
+            parts.append(tok)
+            yield tok
+        self._close_round(player_action, "".join(parts).strip())
+        self.tick_world()
+        record_round(self.state, self.world_obj, self.lang_ui)
+        self._maybe_refresh_summary()
+
+    def _fail_round(self, error):
+        """
+        GPT 失败：错误不写进剧情 history，回合数与选项保持不变，
+        玩家可以直接重试同一选项
+        """
+        self.state["last_error"] = error
+        return {"dm_text": "", "options": self.state["options"], "error": error.kind}
+
+    def _enter_node(self, player_action):
+        """处理剧情节点跳转，返回本回合所在节点"""
 
         adv = self.world_obj["adventure_state"]
         nodes = self.world_obj.get("story_nodes", {})
         node_id = adv["current_node"]
-        node_round = adv["node_round_count"]
 
         current_node = nodes.get(node_id, None)
 
@@ -279,33 +379,32 @@ class AdventureManager:
                     break
 
         # 跳完节点后：更新 node_id / node_round / current_node
-        with open("gpt_log.txt", "a", encoding="utf-8") as f:
-            f.write("\n\n==================== node id ====================\n")
-            f.write(adv["current_node"] + "\n")
-            f.write("\n==================================================\n")
-            f.write(json.dumps(current_node, ensure_ascii=False, indent=2))
-            f.write("\n==================================================\n")
-            f.write(node_id + "\n")
-            f.write("\n==================================================\n")
-            f.write(json.dumps(nodes, ensure_ascii=False, indent=2))
-            f.write("\n==================================================\n")
+        # （完整 story_nodes 已在生成世界时记录一次，这里只记本回合节点）
+        log_debug("node_enter", from_node=node_id, to_node=adv["current_node"],
+                  node=nodes.get(adv["current_node"]))
+
+        return nodes[adv["current_node"]]
+
+    def _close_round(self, player_action, dm_text):
+        """根据节点回合数写入 history / options，返回本回合事件"""
+        self.state.pop("last_error", None)
+        self.save_given_info({"dm_text": dm_text}, self.world_obj)
 
+        adv = self.world_obj["adventure_state"]
+        nodes = self.world_obj.get("story_nodes", {})
         node_id = adv["current_node"]
         node_round = adv["node_round_count"]
         current_node = nodes[node_id]
 
-
         # 1) 是否到达最终章？
         if node_id == "finale":
-            dm_text = self.render_node_round(current_node["summary"], player_action)
             self.state["history"].append({"player": player_action, "dm": dm_text})
             self.state["options"] = []
             return {"dm_text": dm_text, "options": []}
 
-        # 2) 每个节点允许 2~4 回合（可调）
-        if node_round < 2:
+        # 2) 每个节点先走 NODE_ROUND_LIMIT 个普通回合（与 pacing_sim 共用同一常量）
+        if node_round < NODE_ROUND_LIMIT:
             # 普通回合（GPT 生成内部选项）
-            dm_text = self.render_node_round(current_node["summary"], player_action)
 
             # 简单内部选项（不跳节点）
             options = [
@@ -321,11 +420,8 @@ class AdventureManager:
             self.world_obj["adventure_state"] = adv
             return {"dm_text": dm_text, "options": options}
 
-        # 3) 第 3 回合：给剧情节点选项（决定跳转）
+        # 3) 普通回合用完：给剧情节点选项（决定跳转）
         else:
-            dm_text = self.render_node_round(current_node["summary"], player_action)
-
-
             story_options = current_node["options"]  # 固定剧情跳转
             options_texts = [opt["text"] for opt in story_options]
 
@@ -338,7 +434,3 @@ class AdventureManager:
             self.world_obj["adventure_state"] = adv
 
             return {"dm_text": dm_text, "options": options_texts}
-    
-
-
-
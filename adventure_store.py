@@ -0,0 +1,133 @@
+# adventure_store.py
+import json
+import time
+import uuid
+import hashlib
+
+from db import unit_of_work, AdventureSession, AdventureRound
+
+# world_obj 里冒险过程中会被修改的部分；每回合只记录其中发生变化的键
+MUTABLE_WORLD_KEYS = ("adventure_state", "world_state", "player_stats", "inventory", "characters", "memory")
+# 冒险 state 里需要持久化的键（下划线开头的后台任务等运行时对象不落盘）
+# rng_seed 只在第一行出现一次，之后的世界演化都可以由它重放
+SUMMARY_KEYS = ("summary", "summary_upto", "rng_seed")
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def _digest(value):
+    return hashlib.blake2b(_dumps(value).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _snapshot(world_obj, state):
+    """每个键只保留一个短摘要：session_state 里不再常驻整份世界的 JSON 副本"""
+    snap = {k: _digest(world_obj.get(k)) for k in MUTABLE_WORLD_KEYS if k in world_obj}
+    snap.update({k: _digest(state.get(k)) for k in SUMMARY_KEYS if k in state})
+    return snap
+
+
+# ---------------------------
+# 写：每回合追加一行
+# ---------------------------
+def record_round(state, world_obj, lang_ui):
+    """
+    把刚结束的回合追加到 adventure_rounds。
+    state 没有 world_id（世界还没存进数据库）时不做任何事。
+    第一次调用时创建 adventure_sessions 记录，并以当时的 world_obj 作为增量基准。
+    会话记录已被删除（同名世界被重新生成）时不再写入，返回 None
+    """
+    world_id = state.get("world_id")
+    if world_id is None or not state.get("history"):
+        return None
+
+    now = time.time()
+    # 先读后写：IMMEDIATE 事务开始即拿写锁，多进程同时写时排队而不是报 locked
+    with unit_of_work(write=True) as session:
+        # 会话 id 可能已由 AdventureManager 预先分配；还没持久化过才建会话记录
+        session_id = state.get("session_id") or uuid.uuid4().hex
+        persisted = state.get("_persisted")
+        if persisted is None:
+            session.add(AdventureSession(id=session_id, world_id=world_id, lang_ui=lang_ui,
+                                         rounds=0, created_at=now, updated_at=now))
+            session.flush()
+            persisted = _snapshot(world_obj, {})
+
+        last = state["history"][-1]
+        payload = {"player": last["player"], "dm": last["dm"],
+                   "options": state.get("options", []), "round": state.get("round", 0)}
+
+        # 只写相对上一次持久化发生变化的部分
+        current = _snapshot(world_obj, state)
+        world_patch, summary_patch = {}, {}
+        for key, digest in current.items():
+            if persisted.get(key) == digest:
+                continue
+            if key in MUTABLE_WORLD_KEYS:
+                world_patch[key] = world_obj.get(key)
+            else:
+                summary_patch[key] = state.get(key)
+        if world_patch:
+            payload["world"] = world_patch
+        payload.update(summary_patch)
+
+        seq = len(state["history"])
+        updated = (session.query(AdventureSession).filter_by(id=session_id)
+                   .update({"rounds": seq, "updated_at": now}, synchronize_session=False))
+        if not updated:
+            return None
+        session.add(AdventureRound(session_id=session_id, seq=seq, created_at=now,
+                                   payload=json.dumps(payload, ensure_ascii=False)))
+    # 提交成功后才更新 state：写入失败时，本回合的 world 变化会并入下一行增量
+    state["session_id"] = session_id
+    state["_persisted"] = {**persisted, **current}
+    return session_id
+
+
+# ---------------------------
+# 读：会话列表与恢复
+# ---------------------------
+def list_sessions(session, world_id, limit=20):
+    """某个世界最近的冒险会话（只读会话表，不读回合日志）"""
+    return (session.query(AdventureSession)
+            .filter_by(world_id=world_id)
+            .order_by(AdventureSession.updated_at.desc())
+            .limit(limit).all())
+
+
+def get_session(session, session_id):
+    return session.get(AdventureSession, session_id)
+
+
+def iter_rounds(session, session_id, after=0):
+    """按顺序逐行读取回合日志（流式，不一次性载入）"""
+    query = (session.query(AdventureRound.seq, AdventureRound.payload)
+             .filter(AdventureRound.session_id == session_id, AdventureRound.seq > after)
+             .order_by(AdventureRound.seq))
+    for seq, payload in query.yield_per(200):
+        yield seq, json.loads(payload)
+
+
+def resume(session, session_id, world_obj):
+    """
+    从回合日志重建冒险：就地把各回合的增量应用到 world_obj（世界模板），
+    返回新的冒险 state（history / round / options / summary ...）
+    """
+    meta = get_session(session, session_id)
+    if meta is None:
+        return None
+
+    state = {"history": [], "round": 0, "options": [],
+             "world_id": meta.world_id, "session_id": session_id}
+    for _, payload in iter_rounds(session, session_id):
+        state["history"].append({"player": payload["player"], "dm": payload["dm"]})
+        state["options"] = payload.get("options", [])
+        state["round"] = payload.get("round", state["round"])
+        for key in SUMMARY_KEYS:
+            if key in payload:
+                state[key] = payload[key]
+        world_obj.update(payload.get("world", {}))
+
+    state["_persisted"] = _snapshot(world_obj, state)
+    return state
@@ -1,6 +1,5 @@
 # app.py
 import os
-import json
 import time
 from PIL import Image
 import re
@@ -8,12 +7,15 @@ import re
 import streamlit as st
 from ui.right_panel import render_right_panel
 
-from db import SessionLocal, World, init_db
-from llm import call_gpt
+from db import World, unit_of_work, init_db, list_worlds, count_worlds
+from world_repo import WorldRepository
+from world_cache import world_cache, open_world
+from adventure_store import list_sessions, get_session, resume
+from llm import call_gpt, is_gpt_error, build_recap_prompt
 from world import generate_world, save_world_to_db
 from text import TEXT, PDF_LABELS
-from pdf_export import generate_pdf
-from adventure import AdventureManager
+from pdf_jobs import pdf_jobs
+from adventure import AdventureManager, history_with_summary
 
 # ---------- 冒险状态初始化 ----------
 if "adventure" not in st.session_state:
@@ -27,6 +29,9 @@ if "adventure" not in st.session_state:
 # ---------- 数据库设置 ----------
 init_db()
 
+# 世界列表每页显示多少个
+WORLD_PAGE_SIZE = 50
+
 # ---------- 页面设置 ----------
 st.set_page_config(page_title="WorldWeaver MVP", layout="wide")
 
@@ -60,11 +65,18 @@ with col_right:
         else:
             with st.spinner(TEXT["generate_world_spinner"][lang_ui]):
                 with st.spinner(TEXT["generate_world_spinner"][lang_ui]):
-                    world_obj = generate_world(idea, world_name, lang_ui)
-                    save_world_to_db(world_name, world_obj)
+                    stage_timings = {}
+                    world_obj = generate_world(idea, world_name, lang_ui, timings=stage_timings)
+                    if world_obj:
+                        save_world_to_db(world_name, world_obj)
+                        world_cache.invalidate(world_name)
 
-                st.success("世界已生成（同名已覆盖）！" if lang_ui == "中文" 
-                        else "World generated (existing world overwritten)!")
+                if world_obj:
+                    st.success("世界已生成（同名已覆盖）！" if lang_ui == "中文" 
+                            else "World generated (existing world overwritten)!")
+                    st.caption(" · ".join(f"{k} {v:.1f}s" for k, v in stage_timings.items()))
+                else:
+                    st.error(TEXT["generate_world_failed"][lang_ui])
 
 
 # ---------- 主区域：标题 & 简介 ----------
@@ -76,12 +88,44 @@ with col_main:
     # ---------- 2) 世界选择与展示 ----------
     st.header(TEXT["section_world"][lang_ui])
 
-    session = SessionLocal()
-    worlds = session.query(World).all()
-    world_names = [w.name for w in worlds]
+    # 每次数据库访问都用短的 unit_of_work，不在整个脚本（含 LLM 调用）期间占着连接
+
+    # 刷新页面后按 URL 里的 ?session= 从回合日志恢复冒险
+    resume_id = st.query_params.get("session")
+    if resume_id and st.session_state.adventure.get("session_id") != resume_id:
+        world_obj = None
+        with unit_of_work() as session:
+            meta = get_session(session, resume_id)
+            world_row = session.get(World, meta.world_id) if meta else None
+            if world_row is not None:
+                world_obj = open_world(world_row.id, world_row.name, world_row.created_at)
+            if world_obj is not None:
+                st.session_state.adventure = resume(session, resume_id, world_obj)
+                st.session_state.world_obj = world_obj
+                st.session_state.last_world = world_row.name
+        if world_obj is None:
+            del st.query_params["session"]
+
+    # 只查元数据（id / name / created_at），世界 JSON 在选中时按主键读取
+    world_prefix = st.text_input(TEXT["search_world"][lang_ui], value="").strip()
+    with unit_of_work() as session:
+        total_worlds = count_worlds(session, prefix=world_prefix)
+    total_pages = max(1, (total_worlds + WORLD_PAGE_SIZE - 1) // WORLD_PAGE_SIZE)
+    page = 1
+    if total_pages > 1:
+        page = st.number_input(TEXT["world_page"][lang_ui], min_value=1, max_value=total_pages, value=1)
+
+    with unit_of_work() as session:
+        worlds = list_worlds(session, offset=(page - 1) * WORLD_PAGE_SIZE, limit=WORLD_PAGE_SIZE,
+                             prefix=world_prefix)
+    world_meta = {w.name: w for w in worlds}
+    world_ids = {w.name: w.id for w in worlds}
+    world_names = list(world_ids)
 
     new_world_label = TEXT["new_world_label"][lang_ui]
-    sel = st.selectbox(TEXT["choose_world"][lang_ui], [new_world_label] + world_names)
+    last_world = st.session_state.get("last_world")
+    sel = st.selectbox(TEXT["choose_world"][lang_ui], [new_world_label] + world_names,
+                       index=1 + world_names.index(last_world) if last_world in world_names else 0)
 
 
     # --------- 世界选择逻辑（最终正确版本） ---------
@@ -90,19 +134,21 @@ with col_main:
     if sel and sel != new_world_label:
         # 如果这是第一次选择 或 切换世界
         if st.session_state.get("last_world") != sel:
-            # 从数据库读取一次
-            for w in worlds:
-                if w.name == sel:
-                    st.session_state.world_obj = json.loads(w.data)
-                    break
+            # 模板来自进程级缓存（多个会话共享），这里只拿到本会话的可变视图
+            meta = world_meta[sel]
+            st.session_state.world_obj = open_world(meta.id, meta.name, meta.created_at)
 
             # 重置冒险状态
             st.session_state.adventure = {
                 "history": [],
                 "round": 0,
-                "options": []
+                "options": [],
+                "world_id": world_ids[sel]   # 有 world_id 才会把回合写进 adventure_rounds
             }
             st.session_state.last_world = sel
+            st.session_state.pop("pdf_job", None)
+            if "session" in st.query_params:
+                del st.query_params["session"]
 
     # 如果界面需要 world_obj 就从 session_state 拿
     world_obj = st.session_state.world_obj
@@ -113,10 +159,9 @@ with col_main:
 
         # 删除世界按钮
         if st.button("删除这个世界" if lang_ui == "中文" else "Delete this world"):
-            session = SessionLocal()
-            session.query(World).filter_by(name=sel).delete()
-            session.commit()
-            session.close()
+            with unit_of_work(write=True) as session:
+                WorldRepository(session).delete(world_ids[sel])
+            world_cache.invalidate(sel)
             st.success("已删除。" if lang_ui == "中文" else "Deleted.")
             st.rerun()
 
@@ -145,6 +190,21 @@ with col_main:
         st.markdown("---")
         st.subheader(TEXT["section_adventure"][lang_ui])
 
+        # 还没开始时，可以从这个世界之前的冒险继续
+        if st.session_state.adventure["round"] == 0 and sel in world_ids:
+            with unit_of_work() as session:
+                past = list_sessions(session, world_ids[sel])
+            if past:
+                labels = {
+                    f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(p.updated_at))} · "
+                    f"{p.rounds} {TEXT['session_rounds'][lang_ui]}": p.id
+                    for p in past
+                }
+                picked = st.selectbox(TEXT["resume_session"][lang_ui], list(labels))
+                if st.button(TEXT["resume_button"][lang_ui]):
+                    st.query_params["session"] = labels[picked]
+                    st.rerun()
+
 
         # ---- 构造 recent history（给 DM prompt 使用） ----
         history = st.session_state.adventure["history"]
@@ -154,11 +214,21 @@ with col_main:
         # 取最近三回合历史文本
         history_text = adv.recent_history_text(n=3)
 
+        # 上一次 GPT 调用失败（超时 / 熔断等）→ 提示玩家重试
+        last_error = st.session_state.adventure.pop("last_error", None)
+        if last_error:
+            st.error(last_error)
+
         # 冒险入口 / 回合逻辑
         # 第一次点击生成开场剧情
         if st.session_state.adventure["round"] == 0:
             if st.button(TEXT["start_adventure"][lang_ui]):
-                adv.start_adventure()
+                # 流式输出开场：边生成边显示，结束后写入 history
+                st.markdown(f"**{TEXT['round_label'][lang_ui]} 1**")
+                st.write_stream(adv.stream_start_adventure())
+                # 会话 id 开场前就分配了，只有写进了数据库（有 world_id）才放进 URL
+                if st.session_state.adventure.get("world_id") and st.session_state.adventure.get("session_id"):
+                    st.query_params["session"] = st.session_state.adventure["session_id"]
                 st.rerun()
 
         # 展示最近的冒险历史
@@ -181,13 +251,19 @@ with col_main:
                 st.write(f"{TEXT['dm_label'][lang_ui]}：", it["dm"])
                 st.markdown("---")
 
+        # 新回合的流式输出位置（紧跟在历史记录之后）
+        live_box = st.container()
+
         # 显示当前选项按钮
         if st.session_state.adventure["options"]:
             # ---------- 显示按钮 ----------
             st.write(TEXT["choose_action"][lang_ui])
             for opt in st.session_state.adventure["options"]:
                 if st.button(opt):
-                    event = adv.next_round(opt)
+                    with live_box:
+                        st.markdown(f"**{TEXT['round_label'][lang_ui]} {total_rounds + 1}**")
+                        st.write(f"{TEXT['player_label'][lang_ui]}：", opt)
+                        st.write_stream(adv.stream_next_round(opt))
 
                     st.session_state.adventure["history"] = adv.state["history"]
                     st.session_state.adventure["options"] = adv.state["options"]
@@ -208,39 +284,62 @@ with col_main:
             msg = "还没有任何冒险记录可以总结。" if lang_ui == "中文" else "There is no adventure history to summarize yet."
             st.warning(msg)
         else:
-            history_text = "\n".join([f"Player: {h['player']}\nDM: {h['dm']}" for h in st.session_state.adventure["history"]])
-            if lang_ui == "中文":
-                summary_prompt = f"请总结以下冒险为一段叙述风格的冒险回顾，突出情节要点和关键角色：\n\n{history_text}"
-            else:
-                summary_prompt = f"Summarize the following adventure as a narrative recap, highlighting key plot points and important characters:\n\n{history_text}"
+            # 滚动摘要 + 最近回合：长短冒险的总结成本一样
+            history_text = history_with_summary(st.session_state.adventure)
+            recap_system, summary_prompt = build_recap_prompt(history_text, lang_ui)
 
             with st.spinner(TEXT["summary_spinner"][lang_ui]):
                 summary = call_gpt(
-                    "You are an expert RPG chronicler who writes evocative summaries.",
+                    recap_system,
                     summary_prompt,
-                    max_tokens=1200
+                    max_tokens=1200,
+                    cache=True,
+                    site="summary"
                 )
-            st.text_area(TEXT["summary_box_label"][lang_ui], value=summary, height=200)
+            if is_gpt_error(summary):
+                st.error(summary)
+            else:
+                st.text_area(TEXT["summary_box_label"][lang_ui], value=summary, height=200)
 
 
-    # PDF 画册导出
+    # PDF 画册导出：后台进程池排版，这里只提交任务并轮询进度（页面不会卡住）
     if st.button(TEXT["generate_pdf"][lang_ui]):
         if not world_obj:
             st.warning(TEXT["no_world_for_export"][lang_ui])
         else:
-            buffer = generate_pdf(
+            st.session_state.pdf_job = pdf_jobs.submit(
                 world_obj,
                 st.session_state.adventure["history"],
                 PDF_LABELS,
-                lang_ui
+                lang_ui,
+                recap=st.session_state.adventure.get("summary"),
+                session_id=st.session_state.adventure.get("session_id")
             )
 
-            st.download_button(
-                TEXT["download_pdf"][lang_ui],
-                data=buffer,
-                file_name=f"{world_obj.get('title','world')}_book.pdf",
-                mime="application/pdf"
-            )
+    pdf_job = st.session_state.get("pdf_job")
+    if pdf_job and world_obj:
+        running = pdf_jobs.status(pdf_job)["state"] == "running"
+
+        # 生成中每 0.5 秒只重跑这一小块；完成后整页重跑一次，停止轮询
+        @st.fragment(run_every=0.5 if running else None)
+        def pdf_job_panel():
+            status = pdf_jobs.status(pdf_job)
+            if status["state"] == "running":
+                st.progress(status["progress"], text=TEXT["pdf_rendering"][lang_ui])
+            elif running:
+                st.rerun()
+            elif status["state"] == "done":
+                # 点击时才从磁盘读出 PDF（result 读完即关闭文件），重跑页面时不读入内存
+                st.download_button(
+                    TEXT["download_pdf"][lang_ui],
+                    data=lambda: pdf_jobs.result(pdf_job) or b"",
+                    file_name=f"{world_obj.get('title','world')}_book.pdf",
+                    mime="application/pdf"
+                )
+            elif status["state"] == "error":
+                st.error(f"{TEXT['pdf_failed'][lang_ui]} {status.get('error', '')}")
+
+        pdf_job_panel()
 
 # ---------- 侧边栏：属性和物品栏 ----------
 with st.sidebar:
@@ -284,5 +383,3 @@ with st.sidebar:
 
         # 原生 Streamlit 进度条
         st.progress(progress / 100)
-
-session.close()
@@ -0,0 +1,178 @@
+# archetypes.py
+import re
+
+from pattern_match import PatternMatcher
+
+# ---------------------------
+# 原型规则表（中英双语）
+# ---------------------------
+# keywords : 在哪个字段（role / desc）里匹配哪些关键词；英文按整词匹配，* 结尾表示词干
+# traits   : 命中后追加的性格（按语言）
+# speech   : 命中后建议的说话风格（取得分最高的原型）
+# weight   : 权重；role 命中按 weight 计分，desc 命中按一半计分
+# 新增原型只需要加一行，匹配仍然是对 role / desc 各扫描一遍
+ARCHETYPES = [
+    {
+        "id": "warrior",
+        "keywords": {
+            "role": ["战士", "斗士", "护卫", "勇士", "骑士", "佣兵",
+                     "warrior", "fighter", "guard", "soldier", "knight", "champion", "mercenary"],
+        },
+        "traits": {"zh": ["勇猛", "直接"], "en": ["brave", "blunt"]},
+        "speech": {"zh": "声音洪亮，直截了当", "en": "loud and straight to the point"},
+        "weight": 3,
+    },
+    {
+        "id": "rogue",
+        "keywords": {
+            "role": ["刺客", "影", "潜行", "追踪", "盗贼",
+                     "assassin", "rogue", "thief", "spy", "tracker", "stalker", "shadow"],
+        },
+        "traits": {"zh": ["冷静", "隐秘"], "en": ["calm", "secretive"]},
+        "speech": {"zh": "低声、短句、不愿多说", "en": "quiet, clipped sentences, says little"},
+        "weight": 3,
+    },
+    {
+        "id": "mage",
+        "keywords": {
+            "role": ["法师", "巫师", "魔法", "术士",
+                     "mage", "wizard", "sorcer*", "magic*", "warlock", "witch", "arcan*"],
+        },
+        "traits": {"zh": ["理性", "神秘"], "en": ["rational", "mysterious"]},
+        "speech": {"zh": "语气平淡，带讲解性质", "en": "even tone, tends to explain"},
+        "weight": 3,
+    },
+    {
+        "id": "merchant",
+        "keywords": {
+            "role": ["商人", "交易", "经纪", "掮客",
+                     "merchant", "trader", "broker", "dealer", "peddler", "shopkeeper", "vendor"],
+        },
+        "traits": {"zh": ["圆滑", "机敏"], "en": ["smooth", "shrewd"]},
+        "speech": {"zh": "客套、谨慎、观察对方反应", "en": "polite, careful, watches your reaction"},
+        "weight": 3,
+    },
+    {
+        "id": "leader",
+        "keywords": {
+            "role": ["领袖", "国王", "指挥", "将军", "首领", "女王",
+                     "leader", "king", "queen", "commander", "general", "chief", "captain", "lord"],
+        },
+        "traits": {"zh": ["权威", "果断"], "en": ["authoritative", "decisive"]},
+        "speech": {"zh": "稳重、有命令感", "en": "measured and commanding"},
+        "weight": 3,
+    },
+    {
+        "id": "dark",
+        "keywords": {
+            "desc": ["阴影", "黑暗", "shadow", "dark"],
+        },
+        "traits": {"zh": ["神秘", "危险"], "en": ["mysterious", "dangerous"]},
+        "weight": 2,
+    },
+    {
+        "id": "kind",
+        "keywords": {
+            "desc": ["善良", "kind", "gentle", "benevolent", "compassion*"],
+        },
+        "traits": {"zh": ["温和"], "en": ["gentle"]},
+        "weight": 2,
+    },
+    {
+        "id": "angry",
+        "keywords": {
+            "desc": ["愤怒", "暴躁", "angry", "furious", "hot-tempered", "irritable", "wrath"],
+        },
+        "traits": {"zh": ["冲动"], "en": ["impulsive"]},
+        "weight": 2,
+    },
+]
+
+# 互斥性格：同时出现时只保留得分高的一方（GPT 给的 base_traits 永远优先）
+TRAIT_CONFLICTS = [
+    ("冲动", "冷静"), ("直接", "隐秘"), ("直接", "圆滑"), ("温和", "危险"),
+    ("impulsive", "calm"), ("blunt", "secretive"), ("blunt", "smooth"), ("gentle", "dangerous"),
+]
+
+FIELD_FACTOR = {"role": 1.0, "desc": 0.5}
+MAX_TRAITS = 6
+FALLBACK_TRAIT = {"zh": "中性", "en": "neutral"}
+FALLBACK_SPEECH = {"zh": "正常语速、普通语气", "en": "normal pace, plain tone"}
+
+_CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+
+
+def detect_lang(*texts):
+    return "zh" if any(_CJK.search(t or "") for t in texts) else "en"
+
+
+class ArchetypeEngine:
+    """把规则表编译成一个自动机；payload = (原型下标, 字段)"""
+
+    def __init__(self, archetypes=ARCHETYPES, conflicts=TRAIT_CONFLICTS):
+        self.archetypes = archetypes
+        self.matcher = PatternMatcher()
+        for idx, arch in enumerate(archetypes):
+            for field, words in arch["keywords"].items():
+                for word in words:
+                    self.matcher.add(word, (idx, field))
+        self.matcher.compile()
+
+        self.conflicts = {}
+        for a, b in conflicts:
+            self.conflicts.setdefault(a, set()).add(b)
+            self.conflicts.setdefault(b, set()).add(a)
+
+    def score(self, role, desc):
+        """{原型下标: 得分}；同一原型在同一字段的每次命中都会累加"""
+        scores = {}
+        for field, text in (("role", role), ("desc", desc)):
+            for _, _, (idx, hit_field) in self.matcher.iter_matches(text):
+                if hit_field != field:
+                    continue
+                arch = self.archetypes[idx]
+                scores[idx] = scores.get(idx, 0.0) + arch.get("weight", 1) * FIELD_FACTOR[field]
+        return scores
+
+    def personality(self, npc, lang=None):
+        role = npc.get("role", "") or ""
+        desc = npc.get("desc") or npc.get("short_desc") or ""     # 生成器给的是 short_desc
+        lang = lang or detect_lang(role, desc, npc.get("name", ""))
+
+        scores = self.score(role, desc)
+        ranked = sorted(scores, key=lambda i: (-scores[i], i))
+
+        # 性格得分：base_traits 最高，其次按原型得分
+        trait_score = {}
+        for t in npc.get("base_traits", []) or []:
+            trait_score.setdefault(t, float("inf"))
+        for idx in ranked:
+            for t in self.archetypes[idx]["traits"].get(lang, []):
+                trait_score[t] = max(trait_score.get(t, 0.0), scores[idx])
+
+        traits = []
+        for t in sorted(trait_score, key=lambda t: -trait_score[t]):
+            if self.conflicts.get(t, set()) & set(traits):
+                continue
+            traits.append(t)
+        traits = traits[:MAX_TRAITS]
+        if len(traits) < 2:
+            traits.append(FALLBACK_TRAIT[lang])
+
+        speech_style = npc.get("speech_style", "")
+        if not speech_style:
+            for idx in ranked:
+                speech = self.archetypes[idx].get("speech")
+                if speech:
+                    speech_style = speech[lang]
+                    break
+
+        return {
+            "traits": traits,
+            "speech_style": speech_style or FALLBACK_SPEECH[lang],
+            "archetypes": [self.archetypes[i]["id"] for i in ranked],
+        }
+
+
+# 进程级单例：规则表只编译一次
+engine = ArchetypeEngine()
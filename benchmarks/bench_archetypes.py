@@ -0,0 +1,131 @@
+# benchmarks/bench_archetypes.py
+"""
+NPC 原型匹配：旧的逐条 any(key in role ...) 规则链 vs 编译后的多模式自动机。
+第二部分人为扩充原型数量，观察两者随规则数的增长。
+
+    python benchmarks/bench_archetypes.py --npcs 2000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archetypes import ARCHETYPES, ArchetypeEngine
+
+
+def legacy_enrich(npc):
+    """改造前 world.enrich_npc_personality 的原样拷贝（只认中文关键词）"""
+    role = npc.get("role", "")
+    desc = npc.get("desc", "")
+    traits = npc.get("base_traits", [])[:]
+    speech_style = npc.get("speech_style", "")
+
+    if any(key in role for key in ["战士", "斗士", "护卫", "勇士"]):
+        traits += ["勇猛", "直接"]
+        speech_style = speech_style or "声音洪亮，直截了当"
+    if any(key in role for key in ["刺客", "影", "潜行", "追踪"]):
+        traits += ["冷静", "隐秘"]
+        speech_style = speech_style or "低声、短句、不愿多说"
+    if any(key in role for key in ["法师", "巫师", "魔法"]):
+        traits += ["理性", "神秘"]
+        speech_style = speech_style or "语气平淡，带讲解性质"
+    if any(key in role for key in ["商人", "交易", "经纪"]):
+        traits += ["圆滑", "机敏"]
+        speech_style = speech_style or "客套、谨慎、观察对方反应"
+    if any(key in role for key in ["领袖", "国王", "指挥", "将军"]):
+        traits += ["权威", "果断"]
+        speech_style = speech_style or "稳重、有命令感"
+    if "阴影" in desc or "黑暗" in desc:
+        traits += ["神秘", "危险"]
+    if "善良" in desc:
+        traits += ["温和"]
+    if "愤怒" in desc or "暴躁" in desc:
+        traits += ["冲动"]
+    if len(traits) < 2:
+        traits.append("中性")
+    return {"traits": list(set(traits)), "speech_style": speech_style or "正常语速、普通语气"}
+
+
+def legacy_scan(archetypes):
+    """把旧写法推广到任意规则表：每条规则一次 any(...) 扫描"""
+    def run(npc):
+        hits = []
+        for arch in archetypes:
+            for field, words in arch["keywords"].items():
+                text = npc.get(field, "")
+                if any(w in text for w in words):
+                    hits.append(arch["id"])
+        return hits
+    return run
+
+
+ROLES_ZH = ["王城护卫队长", "流浪商人", "黑塔法师", "暗影刺客", "边境将军", "酒馆老板", "农夫"]
+ROLES_EN = ["Captain of the city guard", "Travelling merchant", "Tower wizard", "Shadow assassin",
+            "Border general", "Tavern keeper", "Farmer"]
+DESCS_ZH = ["性格暴躁但内心善良", "总是躲在阴影里", "沉默寡言", "笑容和善"]
+DESCS_EN = ["Hot-tempered but kind at heart", "Always lurking in the dark", "Quiet", "Smiles a lot"]
+
+
+def make_npcs(n, seed=0):
+    rnd = random.Random(seed)
+    npcs = []
+    for i in range(n):
+        if i % 2:
+            npcs.append({"name": f"N{i}", "role": rnd.choice(ROLES_EN), "desc": rnd.choice(DESCS_EN)})
+        else:
+            npcs.append({"name": f"N{i}", "role": rnd.choice(ROLES_ZH), "desc": rnd.choice(DESCS_ZH)})
+    return npcs
+
+
+def synthetic_archetypes(count, seed=0):
+    rnd = random.Random(seed)
+    extra = []
+    for i in range(count):
+        words = ["".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(5, 9)))
+                 for _ in range(4)]
+        extra.append({"id": f"x{i}", "keywords": {"role": words}, "traits": {"zh": [], "en": []}, "weight": 1})
+    return ARCHETYPES + extra
+
+
+def timed(fn, items, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(items) * 1e6      # 微秒 / NPC
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--npcs", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    npcs = make_npcs(args.npcs)
+    engine = ArchetypeEngine()
+    matched_legacy = sum(1 for n in npcs if legacy_enrich(n)["traits"] != ["中性"])
+    matched_new = sum(1 for n in npcs if engine.personality(n)["archetypes"])
+    print(f"{args.npcs} NPCs (half English)")
+    print(f"  legacy enrich : {timed(legacy_enrich, npcs, args.repeat):7.2f} us/npc, "
+          f"matched {matched_legacy}")
+    print(f"  archetype eng : {timed(engine.personality, npcs, args.repeat):7.2f} us/npc, "
+          f"matched {matched_new}")
+
+    print("\nscaling with rule count (match only)")
+    print(f"  {'archetypes':>10}  {'legacy us':>10}  {'automaton us':>12}")
+    for extra in (0, 100, 1000):
+        table = synthetic_archetypes(extra)
+        eng = ArchetypeEngine(table)
+        legacy = legacy_scan(table)
+        t_legacy = timed(legacy, npcs, args.repeat)
+        t_new = timed(lambda n: eng.score(n.get("role", ""), n.get("desc", "")), npcs, args.repeat)
+        print(f"  {len(table):>10}  {t_legacy:>10.2f}  {t_new:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# benchmarks/bench_db_concurrency.py
+"""
+多个 Streamlit 会话同时读写 worlds.db 的压测：
+每个线程循环执行「追加一回合 + 读取世界」，对比不同存储 profile 的吞吐、延迟与锁错误。
+
+    python benchmarks/bench_db_concurrency.py --threads 8 --ops 200
+    python benchmarks/bench_db_concurrency.py --profiles wal legacy --write-ratio 0.5
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from db import Base, ENGINE_PROFILES, AdventureSession, AdventureRound, make_engine, unit_of_work, list_worlds
+from world_repo import WorldRepository
+
+
+def _sample_world(n_chars=12, n_nodes=8):
+    return {
+        "title": "Bench",
+        "summary": "x" * 400,
+        "locations": [{"name": f"L{i}", "description": "d" * 120} for i in range(10)],
+        "characters": [{"name": f"C{i}", "role": "r", "stats": {"trust": 0, "fear": 0, "health": 100}}
+                       for i in range(n_chars)],
+        "story_nodes": {f"N{i}": {"summary": "s" * 200, "options": [{"text": "go", "goto": f"N{i + 1}"}]}
+                        for i in range(n_nodes)},
+        "world_state": {"day": 1, "tension": 0},
+        "inventory": {"resources": {"gold": 10}, "items": [], "lore": []},
+    }
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_profile(profile, threads, ops, write_ratio, pool_size):
+    folder = tempfile.mkdtemp(prefix="ww_bench_")
+    engine = make_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}", profile=profile,
+                         pool_size=pool_size, max_overflow=0)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+
+    with unit_of_work(factory) as session:
+        world_id, _ = WorldRepository(session).save("bench", _sample_world())
+
+    writes, reads, errors = [], [], []
+    lock = threading.Lock()
+
+    def worker(idx):
+        rnd = random.Random(idx)
+        session_id = uuid.uuid4().hex
+        with unit_of_work(factory) as session:
+            session.add(AdventureSession(id=session_id, world_id=world_id, rounds=0,
+                                         created_at=time.time(), updated_at=time.time()))
+        seq = 0
+        for _ in range(ops):
+            is_write = rnd.random() < write_ratio
+            t0 = time.perf_counter()
+            try:
+                with unit_of_work(factory, write=is_write) as session:
+                    if is_write:
+                        seq += 1
+                        session.add(AdventureRound(session_id=session_id, seq=seq, created_at=time.time(),
+                                                   payload=json.dumps({"player": "a", "dm": "d" * 600})))
+                        (session.query(AdventureSession).filter_by(id=session_id)
+                         .update({"rounds": seq, "updated_at": time.time()}, synchronize_session=False))
+                    else:
+                        list_worlds(session, limit=50)
+                        WorldRepository(session).load(world_id)
+            except OperationalError as e:
+                with lock:
+                    errors.append(str(e.orig))
+                continue
+            elapsed = time.perf_counter() - t0
+            with lock:
+                (writes if is_write else reads).append(elapsed)
+
+    t_start = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - t_start
+    engine.dispose()
+
+    done = len(writes) + len(reads)
+    return {
+        "profile": profile,
+        "ops/s": round(done / wall, 1),
+        "write p50 ms": round(_percentile(writes, 0.5) * 1000, 1),
+        "write p95 ms": round(_percentile(writes, 0.95) * 1000, 1),
+        "read p50 ms": round(_percentile(reads, 0.5) * 1000, 1),
+        "read p95 ms": round(_percentile(reads, 0.95) * 1000, 1),
+        "lock errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=list(ENGINE_PROFILES), choices=list(ENGINE_PROFILES))
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=200, help="每个线程的操作数")
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    parser.add_argument("--pool-size", type=int, default=8)
+    args = parser.parse_args()
+
+    rows = [run_profile(p, args.threads, args.ops, args.write_ratio, args.pool_size) for p in args.profiles]
+    headers = list(rows[0])
+    widths = [max(len(h), *(len(str(r[h])) for r in rows)) for h in headers]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for r in rows:
+        print("  ".join(str(r[h]).ljust(w) for h, w in zip(headers, widths)))
+
+
+if __name__ == "__main__":
+    main()
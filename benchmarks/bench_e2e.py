@@ -0,0 +1,271 @@
+# benchmarks/bench_e2e.py
+"""
+端到端基准：按 app.py 的实际调用顺序，分阶段计时
+（世界生成及其各阶段 / 存库 / 列表与加载 / AdventureManager 构造 /
+开场 + N 个回合 / recent_history_text / 10、100、1000 回合的 PDF 导出），
+每个阶段记录耗时、tracemalloc 峰值内存与写盘字节数，并与基线 JSON 对比。
+
+LLM 默认走回放（LLM_PROVIDER=replay，见 llm_provider.py），不联网、不需要 key；
+数据库、日志、响应缓存都放在临时目录，不会碰到工作目录里的 worlds.db。
+
+    python benchmarks/bench_e2e.py                      # 跑一遍，有基线就对比
+    python benchmarks/bench_e2e.py --save-baseline      # 把本次结果存为基线
+    python benchmarks/bench_e2e.py --rounds 50 --pdf-rounds 10 100 1000 --latency 50-200
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+# 对比时低于这些绝对差值的变化视为噪声
+NOISE_FLOOR = {"wall_s": 0.002, "peak_kb": 64, "bytes_written": 4096}
+
+
+def _proc_written():
+    """本进程累计写出的字节数（Linux /proc/self/io 的 wchar），拿不到返回 None"""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _dir_size(path):
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                pass
+    return total
+
+
+class StageTimer:
+    """逐阶段记录 wall / 峰值内存 / 写盘字节（没有 /proc 时退回临时目录的增长量）"""
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.results = {}
+
+    def _written(self):
+        written = _proc_written()
+        return written if written is not None else _dir_size(self.work_dir)
+
+    def run(self, name, fn, repeat=1):
+        """执行 fn() repeat 次；wall 取平均值，返回最后一次的结果"""
+        tracemalloc.reset_peak()
+        mem0 = tracemalloc.get_traced_memory()[0]
+        w0 = self._written()
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            out = fn()
+        wall = (time.perf_counter() - t0) / repeat
+        self.results[name] = {
+            "wall_s": round(wall, 6),
+            "peak_kb": round((tracemalloc.get_traced_memory()[1] - mem0) / 1024, 1),
+            "bytes_written": max(0, self._written() - w0),
+        }
+        if repeat > 1:
+            self.results[name]["repeat"] = repeat
+        return out
+
+    def note(self, name, **fields):
+        self.results.setdefault(name, {}).update(fields)
+
+
+def _history(sample, rounds):
+    """用真实回合的文本循环拼出指定长度的 history"""
+    return [dict(sample[i % len(sample)]) for i in range(rounds)]
+
+
+def run_suite(args, work_dir):
+    # 环境变量要在导入 llm / db 之前设置
+    import world
+    from db import unit_of_work, init_db, list_worlds, count_worlds
+    from world_cache import world_cache, open_world
+    from adventure import AdventureManager
+    from pdf_export import generate_pdf
+    from text import PDF_LABELS
+
+    timer = StageTimer(work_dir)
+    lang_ui = args.lang
+    world_name = "bench_world"
+
+    timer.run("init_db", init_db)
+
+    # ---- 世界生成（各阶段耗时来自 generate_world 自己的 timings） ----
+    timings = {}
+    world_obj = timer.run("generate_world",
+                          lambda: world.generate_world(args.idea, world_name, lang_ui, timings))
+    if world_obj is None:
+        raise SystemExit("generate_world 返回 None：检查 LLM_PROVIDER / 回放库")
+    for stage, seconds in timings.items():
+        if stage != "total":
+            timer.note(f"generate_world.{stage}", wall_s=seconds)
+
+    timer.run("save_world_to_db", lambda: world.save_world_to_db(world_name, world_obj))
+
+    # ---- 列表与加载（与 app.py 相同：count + 分页元数据，再按主键打开） ----
+    def list_page():
+        with unit_of_work() as session:
+            count_worlds(session)
+            return list_worlds(session, offset=0, limit=20)
+
+    worlds = timer.run("list_worlds", list_page, repeat=args.repeat)
+    meta = next(w for w in worlds if w.name == world_name)
+
+    def open_cold():
+        world_cache.invalidate(world_name)
+        return open_world(meta.id, meta.name, meta.created_at)
+
+    timer.run("open_world.cold", open_cold, repeat=args.repeat)
+    world_obj = timer.run("open_world.warm", lambda: open_world(meta.id, meta.name, meta.created_at),
+                          repeat=args.repeat)
+
+    # ---- 冒险 ----
+    session_state = {"adventure": {"history": [], "round": 0, "options": [], "world_id": meta.id}}
+    # Streamlit 每次 rerun 都会重新构造 AdventureManager
+    adv = timer.run("adventure_manager_init",
+                    lambda: AdventureManager(world_obj, lang_ui, session_state), repeat=args.repeat)
+    timer.run("start_adventure", adv.start_adventure)
+    state = session_state["adventure"]
+
+    def play():
+        for _ in range(args.rounds):
+            action = state["options"][0] if state["options"] else "继续"
+            adv.next_round(action)
+
+    timer.run(f"next_round.x{args.rounds}", play)
+    timer.note(f"next_round.x{args.rounds}",
+               per_round_s=round(timer.results[f"next_round.x{args.rounds}"]["wall_s"] / max(1, args.rounds), 6))
+    timer.run("recent_history_text", lambda: adv.recent_history_text(n=3), repeat=args.repeat)
+    timer.run("recent_history_text.full", lambda: adv.recent_history_text(full=True), repeat=args.repeat)
+
+    # ---- PDF 导出 ----
+    sample = state["history"][1:] or state["history"]
+    for n in args.pdf_rounds:
+        history = _history(sample, n)
+        buf = timer.run(f"generate_pdf.{n}",
+                        lambda: generate_pdf(world_obj, history, PDF_LABELS, lang_ui, recap=state.get("summary")))
+        timer.note(f"generate_pdf.{n}", pdf_bytes=len(buf.getvalue()))
+
+    return timer.results
+
+
+def compare(results, baseline, tolerance):
+    """返回 (表格行, 回归列表)；某项超过基线 (1 + tolerance) 倍且超过噪声下限算回归"""
+    rows, regressions = [], []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base:
+            rows.append((name, cur, None))
+            continue
+        deltas = {}
+        for metric, floor in NOISE_FLOOR.items():
+            if metric not in cur or metric not in base:
+                continue
+            old, new = base[metric], cur[metric]
+            ratio = new / old if old else (1.0 if new == old else float("inf"))
+            deltas[metric] = ratio
+            if new - old > floor and ratio > 1 + tolerance:
+                regressions.append(f"{name}.{metric}: {old} → {new} (x{ratio:.2f})")
+        rows.append((name, cur, deltas))
+    return rows, regressions
+
+
+def format_rows(rows):
+    lines = [f"{'stage':<28} {'wall ms':>10} {'peak KB':>10} {'written':>10}   vs baseline"]
+    for name, cur, deltas in rows:
+        wall = cur.get("wall_s")
+        wall = f"{wall * 1000:10.2f}" if wall is not None else f"{'':>10}"
+        peak = f"{cur['peak_kb']:10.1f}" if "peak_kb" in cur else f"{'':>10}"
+        written = f"{cur['bytes_written']:10d}" if "bytes_written" in cur else f"{'':>10}"
+        vs = "" if deltas is None else " ".join(f"{m.split('_')[0]} x{r:.2f}" for m, r in deltas.items())
+        lines.append(f"{name:<28} {wall} {peak} {written}   {vs}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20, help="next_round 回合数")
+    parser.add_argument("--pdf-rounds", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=20, help="轻量阶段的重复次数（取平均）")
+    parser.add_argument("--idea", default="猫猫世界")
+    parser.add_argument("--lang", default="中文")
+    parser.add_argument("--provider", default="replay", help="LLM_PROVIDER（live 会真的调用 OpenAI）")
+    parser.add_argument("--latency", default="0", help="回放延迟，见 LLM_REPLAY_LATENCY")
+    parser.add_argument("--replay-db", default=os.getenv("LLM_REPLAY_PATH", "llm_replay.db"),
+                        help="回放库（python llm_provider.py import gpt_log.txt 生成；没有时用假数据）")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="相对基线允许的变慢 / 变大比例")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--json", help="把本次结果另存为 JSON")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="worldweaver-bench-")
+    os.environ["LLM_PROVIDER"] = args.provider
+    os.environ["LLM_REPLAY_LATENCY"] = args.latency
+    os.environ["LLM_REPLAY_PATH"] = os.path.abspath(args.replay_db)
+    os.environ["WORLDWEAVER_DB_URL"] = f"sqlite:///{os.path.join(work_dir, 'worlds.db')}"
+    os.environ["LLM_CACHE_PATH"] = os.path.join(work_dir, "llm_cache.db")
+    os.environ["LLM_LOG_PATH"] = os.path.join(work_dir, "logs", "llm_trace.jsonl")
+
+    tracemalloc.start()
+    try:
+        results = run_suite(args, work_dir)
+    finally:
+        tracemalloc.stop()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "provider": args.provider,
+            "latency": args.latency,
+            "rounds": args.rounds,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "stages": results,
+    }
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f).get("stages", {})
+
+    rows, regressions = compare(results, baseline, args.tolerance)
+    print(format_rows(rows))
+    if baseline:
+        print(f"\nbaseline: {args.baseline}")
+        print("\n".join(f"  REGRESSION {r}" for r in regressions) or "  no regressions")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nsaved baseline to {args.baseline}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
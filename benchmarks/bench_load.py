@@ -0,0 +1,369 @@
+# benchmarks/bench_load.py
+"""
+多玩家并发压测（容量规划用）：
+几百个独立玩家各自 open_world → AdventureManager → start_adventure → N 次 next_round，
+LLM 走回放 provider 并注入延迟（见 llm_provider.py），数据库在临时目录。
+
+报告：吞吐（回合/秒）、回合延迟 p50/p95/p99、每个会话的内存、
+每回合耗时拆分（LLM / 写库 / 其余）、错误数，以及采样得到的争用热点
+（线程此刻停在哪一行：锁等待、SQLite、信号量排队 ...）。
+
+    python benchmarks/bench_load.py --players 200 --rounds 10 --latency 200-800
+    python benchmarks/bench_load.py --mode processes --procs 4 --players 400 --max-in-flight 32
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORLD_NAME = "load_world"
+PERCENTILES = (50, 95, 99)
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[idx]
+
+
+def _rss_bytes():
+    """当前进程常驻内存；没有 /proc 时退回 ru_maxrss（峰值）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _fingerprint(obj):
+    return hashlib.sha256(json.dumps(obj, ensure_ascii=False, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# ---------------------------
+# 争用热点：定时采样所有工作线程的调用栈
+# ---------------------------
+class StackSampler(threading.Thread):
+    """
+    每 interval 秒看一眼所有线程停在哪里，按「项目里最内层的一行 → 实际阻塞的库函数」计数。
+    计数多的位置 = 大量玩家线程同时卡住的地方
+    """
+
+    def __init__(self, thread_prefix, interval=0.01):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.thread_prefix = thread_prefix
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if not names.get(ident, "").startswith(self.thread_prefix):
+                    continue
+                where = self._where(frame)
+                if where:       # 空闲的线程池线程不计
+                    self.counts[where] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _where(frame):
+        stack = traceback.extract_stack(frame)
+        leaf = stack[-1]
+        ours = [f for f in stack if f.filename.startswith(ROOT) and "benchmarks" not in f.filename]
+        if not ours:
+            return None
+        at = f"{os.path.basename(ours[-1].filename)}:{ours[-1].lineno} {ours[-1].name}"
+        return f"{at}  →  {os.path.basename(leaf.filename)}:{leaf.name}"
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+# ---------------------------
+# 每回合耗时拆分：包一层计时（只在压测进程里替换 adventure 模块里的引用）
+# ---------------------------
+_phase = threading.local()
+
+
+def _timed(fn, key):
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            acc = getattr(_phase, "acc", None)
+            if acc is not None:
+                acc[key] = acc.get(key, 0.0) + time.perf_counter() - t0
+    return wrapper
+
+
+def _instrument():
+    import adventure
+    adventure.call_gpt = _timed(adventure.call_gpt, "llm")
+    adventure.stream_gpt = _timed(adventure.stream_gpt, "llm")
+    adventure.record_round = _timed(adventure.record_round, "db")
+
+
+# ---------------------------
+# 单个玩家
+# ---------------------------
+def play(player_id, meta, rounds, lang_ui):
+    from adventure import AdventureManager
+    from world_cache import open_world, approx_size
+
+    out = {"turns": [], "start": None, "errors": 0, "exceptions": 0, "phases": Counter(), "state_bytes": 0}
+    try:
+        world_obj = open_world(meta["id"], meta["name"], meta["created_at"])
+        session_state = {"adventure": {"history": [], "round": 0, "options": [], "world_id": meta["id"]}}
+
+        _phase.acc = {}
+        t0 = time.perf_counter()
+        adv = AdventureManager(world_obj, lang_ui, session_state)
+        adv.start_adventure()
+        out["start"] = time.perf_counter() - t0
+        state = session_state["adventure"]
+        out["errors"] += bool(state.get("last_error"))
+
+        for _ in range(rounds):
+            _phase.acc = {}
+            action = state["options"][0] if state["options"] else "继续"
+            t0 = time.perf_counter()
+            event = adv.next_round(action)
+            out["turns"].append(time.perf_counter() - t0)
+            out["errors"] += bool(event and event.get("error"))
+            out["phases"].update(_phase.acc)
+
+        out["state_bytes"] = approx_size(world_obj) + approx_size(session_state)
+        out["rng_seed"] = state.get("rng_seed")
+    except Exception:
+        out["exceptions"] += 1
+        out["exception"] = traceback.format_exc(limit=5)
+    finally:
+        _phase.acc = None
+    return out
+
+
+def _exception_kind(tb):
+    """traceback 里最后一个异常行（类型 + 信息开头），用于归类"""
+    lines = [l for l in tb.strip().splitlines() if re.match(r"[\w.]+(Error|Exception)\b", l)]
+    return lines[-1][:120] if lines else "?"
+
+
+def run_players(player_ids, meta, args, thread_prefix="player"):
+    """在当前进程里用线程跑一批玩家，返回汇总（线程数 = 玩家数，对应每个 Streamlit 会话一个脚本线程）"""
+    _instrument()
+    from world_cache import world_cache, open_world
+
+    # 预热：模板进缓存，记录指纹，结束后检查没有被会话改写
+    open_world(meta["id"], meta["name"], meta["created_at"])
+    template = world_cache.get((meta["name"], meta["created_at"]), lambda: None)
+    before = _fingerprint(template)
+
+    sampler = StackSampler(thread_prefix, args.sample_interval) if args.sample_interval > 0 else None
+    rss0 = _rss_bytes()
+    t0 = time.perf_counter()
+    if sampler:
+        sampler.start()
+    with ThreadPoolExecutor(max_workers=len(player_ids), thread_name_prefix=thread_prefix) as pool:
+        results = list(pool.map(lambda pid: play(pid, meta, args.rounds, args.lang), player_ids))
+    wall = time.perf_counter() - t0
+    if sampler:
+        sampler.stop()
+
+    phases = Counter()
+    for r in results:
+        phases.update(r["phases"])
+    return {
+        "wall": wall,
+        "turns": [t for r in results for t in r["turns"]],
+        "starts": [r["start"] for r in results if r["start"] is not None],
+        "errors": sum(r["errors"] for r in results),
+        "exceptions": sum(r["exceptions"] for r in results),
+        "exception_kinds": dict(Counter(_exception_kind(r["exception"]) for r in results if "exception" in r)),
+        "tracebacks": [r["exception"] for r in results if "exception" in r][:1],
+        "phases": dict(phases),
+        "state_bytes": [r["state_bytes"] for r in results],
+        "rss_delta": max(0, _rss_bytes() - rss0),
+        "seeds": [r.get("rng_seed") for r in results],
+        "template_mutated": _fingerprint(template) != before,
+        "hotspots": dict(sampler.counts) if sampler else {},
+        "samples": sampler.samples if sampler else 0,
+    }
+
+
+def _process_entry(args_dict, meta, player_ids, proc_no):
+    args = argparse.Namespace(**args_dict)
+    return run_players(player_ids, meta, args, thread_prefix=f"p{proc_no}-player")
+
+
+# ---------------------------
+# 准备：临时目录里的数据库 + 一个世界
+# ---------------------------
+def setup_env(args, work_dir):
+    os.environ["LLM_PROVIDER"] = "replay"
+    os.environ["LLM_REPLAY_LATENCY"] = args.latency
+    os.environ["LLM_REPLAY_PATH"] = os.path.abspath(args.replay_db)
+    os.environ["LLM_MAX_IN_FLIGHT"] = str(args.max_in_flight)
+    os.environ["WORLDWEAVER_DB_URL"] = f"sqlite:///{os.path.join(work_dir, 'worlds.db')}"
+    os.environ["LLM_CACHE_PATH"] = os.path.join(work_dir, "llm_cache.db")
+    os.environ["LLM_LOG_PATH"] = os.path.join(work_dir, "logs", "llm_trace.jsonl")
+
+
+def prepare_world(args):
+    """生成并保存压测用的世界，返回 app.py 列表里拿到的那份元数据"""
+    import world
+    from db import init_db, unit_of_work, list_worlds
+
+    init_db()
+    world_obj = world.generate_world(args.idea, WORLD_NAME, args.lang)
+    if world_obj is None:
+        raise SystemExit("generate_world 返回 None：检查回放库")
+    world.save_world_to_db(WORLD_NAME, world_obj)
+    with unit_of_work() as session:
+        meta = next(w for w in list_worlds(session, prefix=WORLD_NAME) if w.name == WORLD_NAME)
+    return {"id": meta.id, "name": meta.name, "created_at": meta.created_at}
+
+
+# ---------------------------
+# 汇总
+# ---------------------------
+def summarize(parts, args, wall):
+    turns = sorted(t for p in parts for t in p["turns"])
+    starts = sorted(t for p in parts for t in p["starts"])
+    phases = Counter()
+    hotspots = Counter()
+    for p in parts:
+        phases.update(p["phases"])
+        hotspots.update(p["hotspots"])
+    state_bytes = [b for p in parts for b in p["state_bytes"]]
+    seeds = [s for p in parts for s in p["seeds"] if s is not None]
+    n_turns = len(turns)
+
+    def ms(v):
+        return round(v * 1000, 1)
+
+    return {
+        "mode": args.mode,
+        "players": args.players,
+        "rounds": args.rounds,
+        "latency": args.latency,
+        "max_in_flight": args.max_in_flight,
+        "procs": args.procs if args.mode == "processes" else 1,
+        "wall_s": round(wall, 2),
+        "throughput_turns_s": round(n_turns / wall, 1) if wall else 0.0,
+        "turn_ms": {f"p{p}": ms(_percentile(turns, p)) for p in PERCENTILES},
+        "start_ms": {f"p{p}": ms(_percentile(starts, p)) for p in PERCENTILES},
+        "turn_breakdown_ms": {k: ms(v / n_turns) for k, v in phases.items()} if n_turns else {},
+        "turn_other_ms": ms((sum(turns) - sum(phases.values())) / n_turns) if n_turns else 0.0,
+        "memory_per_session_kb": {
+            "rss": round(sum(p["rss_delta"] for p in parts) / max(1, args.players) / 1024, 1),
+            "state": round(sum(state_bytes) / max(1, len(state_bytes)) / 1024, 1),
+        },
+        "errors": sum(p["errors"] for p in parts),
+        "exceptions": sum(p["exceptions"] for p in parts),
+        "exception_kinds": dict(sum((Counter(p["exception_kinds"]) for p in parts), Counter())),
+        "tracebacks": [t for p in parts for t in p["tracebacks"]][:1],
+        "isolation": {
+            "template_mutated": any(p["template_mutated"] for p in parts),
+            "distinct_rng_seeds": len(set(seeds)),
+        },
+        "hotspots": [
+            {"where": where, "share": round(c / max(1, sum(hotspots.values())), 3)}
+            for where, c in hotspots.most_common(args.top)
+        ],
+    }
+
+
+def format_report(r, verbose=False):
+    lines = [
+        f"{r['mode']}: {r['players']} players x {r['rounds']} rounds, procs={r['procs']}, "
+        f"latency={r['latency']}ms, max_in_flight={r['max_in_flight']}",
+        f"  wall {r['wall_s']}s, throughput {r['throughput_turns_s']} turns/s",
+        "  turn latency   " + "  ".join(f"{k}={v}ms" for k, v in r["turn_ms"].items()),
+        "  start latency  " + "  ".join(f"{k}={v}ms" for k, v in r["start_ms"].items()),
+        "  per turn       " + "  ".join(f"{k}={v}ms" for k, v in r["turn_breakdown_ms"].items())
+        + f"  other={r['turn_other_ms']}ms",
+        f"  memory/session rss≈{r['memory_per_session_kb']['rss']}KB  "
+        f"state≈{r['memory_per_session_kb']['state']}KB",
+        f"  errors {r['errors']}  exceptions {r['exceptions']}  "
+        f"template mutated: {r['isolation']['template_mutated']}  "
+        f"distinct seeds: {r['isolation']['distinct_rng_seeds']}",
+    ]
+    if r["hotspots"]:
+        lines.append("  contention hotspots (share of sampled player-thread stacks):")
+        lines += [f"    {h['share']:6.1%}  {h['where']}" for h in r["hotspots"]]
+    for kind, count in r["exception_kinds"].items():
+        lines.append(f"  exception x{count}: {kind}")
+    if verbose:
+        for tb in r["tracebacks"]:
+            lines.append("  " + tb.replace("\n", "\n  "))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("threads", "processes"), default="threads")
+    parser.add_argument("--players", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--procs", type=int, default=os.cpu_count() or 2, help="processes 模式的进程数")
+    parser.add_argument("--latency", default="200-800", help="注入的 LLM 延迟（毫秒，见 LLM_REPLAY_LATENCY）")
+    parser.add_argument("--max-in-flight", type=int, default=int(os.getenv("LLM_MAX_IN_FLIGHT", "8")),
+                        help="每个进程同时在途的 LLM 请求上限（LLM_MAX_IN_FLIGHT）")
+    parser.add_argument("--replay-db", default=os.getenv("LLM_REPLAY_PATH", "llm_replay.db"))
+    parser.add_argument("--idea", default="猫猫世界")
+    parser.add_argument("--lang", default="中文")
+    parser.add_argument("--sample-interval", type=float, default=0.01, help="热点采样间隔（秒），0 关闭")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="把报告另存为 JSON")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    parser.add_argument("--verbose", action="store_true", help="打印第一个异常的完整 traceback")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="worldweaver-load-")
+    setup_env(args, work_dir)
+    try:
+        meta = prepare_world(args)
+        player_ids = list(range(args.players))
+        t0 = time.perf_counter()
+        if args.mode == "threads":
+            parts = [run_players(player_ids, meta, args)]
+        else:
+            # spawn：父进程已经有 LLM 事件循环线程，fork 不安全
+            ctx = multiprocessing.get_context("spawn")
+            chunks = [player_ids[i::args.procs] for i in range(args.procs)]
+            with ctx.Pool(args.procs) as pool:
+                parts = pool.starmap(_process_entry,
+                                     [(vars(args), meta, chunk, i) for i, chunk in enumerate(chunks) if chunk])
+        wall = time.perf_counter() - t0
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = summarize(parts, args, wall)
+    print(format_report(report, args.verbose))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
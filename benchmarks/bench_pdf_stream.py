@@ -0,0 +1,98 @@
+# benchmarks/bench_pdf_stream.py
+"""
+超长冒险记录的 PDF 导出：一次性构建 story + BytesIO（generate_pdf）
+vs 按需生成 flowable + SpooledTemporaryFile（stream_pdf）。
+记录耗时与 tracemalloc 峰值；--cap-mb 给流式模式设内存上限，超过则以非零状态退出。
+
+    python benchmarks/bench_pdf_stream.py --rounds 5000
+    python benchmarks/bench_pdf_stream.py --rounds 5000 --only stream --cap-mb 24
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_export import generate_pdf, stream_pdf, get_styles
+from text import PDF_LABELS
+
+DM_LINES_ZH = [
+    "雾气笼罩着小镇，远处传来钟声。",
+    "一个身影在巷口停下，似乎在等你开口。",
+    "石墙上留着新鲜的爪痕，空气里有焦糊味。",
+    "酒馆老板压低声音，说昨晚又有人失踪了。",
+]
+DM_LINES_EN = [
+    "Fog hangs over the town and a bell tolls in the distance.",
+    "A figure pauses at the mouth of the alley, waiting for you to speak.",
+    "Fresh claw marks score the stone wall; the air smells of smoke.",
+    "The innkeeper lowers his voice: someone else vanished last night.",
+]
+
+
+def iter_history(rounds, lang_ui, seed=0):
+    """合成冒险记录（生成器：本身不占与回合数成正比的内存）"""
+    rnd = random.Random(seed)
+    lines = DM_LINES_ZH if lang_ui == "中文" else DM_LINES_EN
+    for i in range(rounds):
+        dm = " ".join(rnd.choice(lines) for _ in range(rnd.randint(3, 5)))
+        yield {"player": f"#{i} " + rnd.choice(lines), "dm": dm + "\n\n1. A\n2. B\n3. C"}
+
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    size = fn()
+    wall = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return wall, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5000)
+    parser.add_argument("--lang", default="中文")
+    parser.add_argument("--only", choices=("eager", "stream"))
+    parser.add_argument("--cap-mb", type=float, help="流式模式的 tracemalloc 峰值上限（MB）")
+    args = parser.parse_args()
+
+    world_obj = {"title": "Bench", "summary": "A long campaign."}
+    get_styles()     # 字体注册不计入任一方
+
+    def eager():
+        # 与 app.py 原来的用法一致：history 整个在内存里
+        history = list(iter_history(args.rounds, args.lang))
+        return len(generate_pdf(world_obj, history, PDF_LABELS, args.lang).getvalue())
+
+    def stream():
+        out = stream_pdf(world_obj, iter_history(args.rounds, args.lang), PDF_LABELS, args.lang,
+                         total=args.rounds)
+        out.seek(0, os.SEEK_END)
+        size = out.tell()
+        out.close()
+        return size
+
+    print(f"{args.rounds} rounds ({args.lang})")
+    print(f"  {'mode':<8} {'wall s':>8} {'peak MB':>9} {'pdf MB':>8}")
+    results = {}
+    for name, fn in (("eager", eager), ("stream", stream)):
+        if args.only and name != args.only:
+            continue
+        wall, peak, size = measure(fn)
+        results[name] = peak
+        print(f"  {name:<8} {wall:8.2f} {peak / 2**20:9.1f} {size / 2**20:8.2f}")
+
+    if args.cap_mb is not None and "stream" in results:
+        peak_mb = results["stream"] / 2**20
+        if peak_mb > args.cap_mb:
+            print(f"FAIL: stream peak {peak_mb:.1f} MB > cap {args.cap_mb} MB")
+            sys.exit(1)
+        print(f"ok: stream peak {peak_mb:.1f} MB <= cap {args.cap_mb} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# clue_index.py
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from pattern_match import PatternMatcher
+
+# 索引结构有改动时加一，旧世界会在下次打开时重建
+CLUE_INDEX_VERSION = 1
+
+# 原来写死的几个通用母题，保留为所有世界都认识的线索
+COMMON_MOTIFS = ["魔法阵", "失踪", "女巫", "黑暗力量", "仪式", "水晶"]
+
+# 剧情节点里反复出现但没有信息量的叙述词
+_CJK_STOPWORDS = {
+    "玩家", "发现", "一个", "开始", "最终", "真相", "故事", "准备", "进入", "决战", "结局",
+    "继续", "神秘", "危机", "线索", "隐藏", "揭晓", "加深", "风险", "上升", "地点", "世界",
+    "他们", "我们", "自己", "这个", "那个", "之前", "之后", "必须", "正在", "已经", "终于",
+}
+_EN_TITLES = {"lord", "lady", "sir", "king", "queen", "captain", "the", "master", "old", "young", "dr"}
+_EN_STOPWORDS = _EN_TITLES | {"a", "an", "in", "at", "on", "after", "before", "when", "with", "finally",
+                              "player", "players", "you", "they", "their", "this", "that", "story"}
+# 虚词：和上面的叙述词一起作为切分点，n-gram 不跨过它们（避免“色水晶的”之类）
+_CJK_FUNCTION_CHARS = "的了在是和与把被从向着之就也都又将其这那并而及或于"
+
+_CJK_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+")
+_CJK_SPLIT = re.compile("|".join(sorted(_CJK_STOPWORDS, key=len, reverse=True))
+                        + f"|[{_CJK_FUNCTION_CHARS}]")
+_EN_PHRASE = re.compile(r"\b[A-Z][a-z]+(?:\s+(?:(?:of|the)\s+)*[A-Z][a-z]+)*")
+
+
+def _en_phrases(text):
+    """大写词组及其首尾都是大写词的子词组（"Allies of the Order of Dawn" → "Order of Dawn" ...）"""
+    for m in _EN_PHRASE.finditer(text):
+        words = m.group(0).split()
+        caps = [i for i, w in enumerate(words) if w[0].isupper()]
+        for i in caps:
+            for j in caps:
+                if j >= i:
+                    yield " ".join(words[i:j + 1])
+
+
+# ---------------------------
+# 生成时：从世界内容建立线索词典
+# ---------------------------
+def _aliases(label):
+    """名字本身 + 英文多词名字里有辨识度的单词（去掉头衔）"""
+    label = label.strip()
+    out = [label]
+    words = label.split()
+    if len(words) > 1 and label.isascii():
+        out += [w for w in words if len(w) >= 4 and w.lower() not in _EN_TITLES]
+    return [a for a in dict.fromkeys(out) if len(a) >= (3 if a.isascii() else 2)]
+
+
+def _named_entries(world_obj):
+    """世界里所有带 name / title 的条目：地点、角色，以及 base 数据里其他列表（势力、物品 ...）"""
+    skip = {"memory", "adventure_state", "story_nodes", "clue_index", "player_profile", "player_stats",
+            "companions"}
+    for key, value in world_obj.items():
+        if key in skip or not isinstance(value, list):
+            continue
+        kind = {"characters": "character", "locations": "location"}.get(key, key)
+        for item in value:
+            label = item.get("name") or item.get("title") if isinstance(item, dict) else None
+            if isinstance(label, str) and label.strip():
+                yield kind, label
+
+
+def _lore_entries(world_obj):
+    for item in world_obj.get("inventory", {}).get("lore", []) or []:
+        label = item if isinstance(item, str) else (item.get("name") or item.get("title"))
+        if isinstance(label, str) and label.strip():
+            yield "lore", label
+
+
+def _recurring_terms(texts, min_docs=2):
+    """
+    剧情节点里反复出现的专有名词：
+    中文取在至少 min_docs 个节点里出现的 2~4 字片段，英文取大写词组；只保留最长的
+    """
+    support = {}
+    for text in texts:
+        grams = set()
+        for run in _CJK_RUN.findall(text):
+            for piece in _CJK_SPLIT.split(run):
+                for n in (2, 3, 4):
+                    grams.update(piece[i:i + n] for i in range(len(piece) - n + 1))
+        for phrase in _en_phrases(text):
+            if phrase.lower() not in _EN_STOPWORDS:
+                grams.add(phrase)
+        for g in grams:
+            support[g] = support.get(g, 0) + 1
+
+    terms = [g for g, c in support.items() if c >= min_docs]
+    # 被更长且同样常见的片段包含的，丢掉（“魔法” vs “魔法阵”）
+    return [t for t in terms
+            if not any(t != o and t in o and support[o] >= support[t] for o in terms)]
+
+
+def build_clue_index(world_obj):
+    """返回可直接存进 world_obj["clue_index"] 的线索词典"""
+    topics = OrderedDict()
+
+    def add(kind, label):
+        label = label.strip()
+        topic_id = f"{kind}:{label}"
+        if topic_id not in topics and _aliases(label):
+            topics[topic_id] = {"id": topic_id, "label": label, "kind": kind, "aliases": _aliases(label)}
+
+    for kind, label in _named_entries(world_obj):
+        add(kind, label)
+    for kind, label in _lore_entries(world_obj):
+        add(kind, label)
+    summaries = [n.get("summary", "") for n in (world_obj.get("story_nodes") or {}).values()]
+    for term in _recurring_terms(summaries):
+        add("plot", term)
+    for motif in COMMON_MOTIFS:
+        add("motif", motif)
+
+    topics = list(topics.values())
+    raw = json.dumps(topics, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return {
+        "version": CLUE_INDEX_VERSION,
+        "key": hashlib.sha256(raw).hexdigest()[:16],
+        "topics": topics,
+    }
+
+
+def ensure_clue_index(world_obj):
+    """旧世界没有索引（或版本过旧）时补建，返回是否有改动"""
+    index = world_obj.get("clue_index")
+    if index and index.get("version") == CLUE_INDEX_VERSION:
+        return False
+    world_obj["clue_index"] = build_clue_index(world_obj)
+    return True
+
+
+# ---------------------------
+# 运行时：编译后的匹配器（按索引 key 缓存，多个会话共用）
+# ---------------------------
+_MATCHER_CACHE_SIZE = 64
+_matchers = OrderedDict()
+_matchers_lock = threading.Lock()
+
+
+def clue_matcher(index):
+    key = index["key"]
+    with _matchers_lock:
+        matcher = _matchers.get(key)
+        if matcher is not None:
+            _matchers.move_to_end(key)
+            return matcher
+
+    matcher = PatternMatcher()
+    for topic in index["topics"]:
+        for alias in topic["aliases"]:
+            matcher.add(alias, topic["id"])
+    matcher.compile()
+
+    with _matchers_lock:
+        _matchers[key] = matcher
+        while len(_matchers) > _MATCHER_CACHE_SIZE:
+            _matchers.popitem(last=False)
+    return matcher
+
+
+def find_topics(world_obj, text):
+    """文本里提到的线索主题 id（一次扫描，O(文本长度)）"""
+    index = world_obj.get("clue_index")
+    if not index or not text:
+        return []
+    return clue_matcher(index).find(text)
+
+
+def record_clues(world_obj, text):
+    """
+    把 DM 文本里出现的线索记进 memory：
+    - info_given：给过的线索名（有序、按显示名去重，prompt 里用来禁止重复）
+    - clue_depth：每个主题被提到的次数（信息深度）
+    返回本次新出现的主题 id
+    """
+    memory = world_obj.setdefault("memory", {})
+    info_given = memory.setdefault("info_given", [])
+    depth = memory.setdefault("clue_depth", {})
+
+    new = []
+    for topic_id in find_topics(world_obj, text):
+        if topic_id not in depth:
+            new.append(topic_id)
+            # id = "kind:label"；同名的角色 / 地点（character:X 与 location:X）只记一次
+            label = topic_id.split(":", 1)[1]
+            if label not in info_given:
+                info_given.append(label)
+        depth[topic_id] = depth.get(topic_id, 0) + 1
+    return new
+
+
+def already_told(world_obj, topic):
+    """玩家问到的主题是否已经给过信息（topic 为自由文本）"""
+    depth = world_obj.get("memory", {}).get("clue_depth", {})
+    hits = find_topics(world_obj, topic)
+    if hits:
+        return any(h in depth for h in hits)
+    # 索引里没有的主题：退回按线索名精确判断
+    return topic in world_obj.get("memory", {}).get("info_given", [])
@@ -1,23 +1,386 @@
 # db.py
-from sqlalchemy import create_engine, Column, Integer, String, Text, Float
-from sqlalchemy.orm import declarative_base, sessionmaker
+import os
+import sys
+import zlib
+from contextlib import contextmanager
+
+from sqlalchemy import (
+    create_engine, event, inspect, text,
+    Column, Integer, String, Text, Float, LargeBinary, ForeignKey, Index, UniqueConstraint,
+)
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import declarative_base, sessionmaker, deferred
+
+DB_PATH = os.getenv("WORLDWEAVER_DB_URL", "sqlite:///worlds.db")
+
+# ---------------------------
+# 存储引擎 profile（环境变量可覆盖）
+# ---------------------------
+# wal   : WAL 日志 + synchronous=NORMAL + busy_timeout，读写互不阻塞（默认）
+# legacy: SQLite 默认的回滚日志，写事务期间读也会被挡住（用于对比）
+ENGINE_PROFILES = {
+    "wal": {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout_ms": 5000},
+    "legacy": {"journal_mode": "DELETE", "synchronous": "FULL", "busy_timeout_ms": None},
+}
+DB_PROFILE = os.getenv("DB_PROFILE", "wal")
+DB_BUSY_TIMEOUT_MS = os.getenv("DB_BUSY_TIMEOUT_MS")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+
+def make_engine(url=DB_PATH, profile=DB_PROFILE, pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT):
+    """按 profile 创建引擎；每个新连接建立时执行一次 PRAGMA"""
+    settings = dict(ENGINE_PROFILES[profile])
+    if DB_BUSY_TIMEOUT_MS is not None:
+        settings["busy_timeout_ms"] = int(DB_BUSY_TIMEOUT_MS)
+
+    kwargs = {"connect_args": {"check_same_thread": False}}
+    if ":memory:" not in url and url != "sqlite://":
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow,
+                      pool_timeout=pool_timeout, pool_pre_ping=False)
+    new_engine = create_engine(url, **kwargs)
+
+    @event.listens_for(new_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        # SQLite 默认不执行外键约束（ON DELETE CASCADE 需要）
+        cur.execute("PRAGMA foreign_keys=ON")
+        cur.execute(f"PRAGMA journal_mode={settings['journal_mode']}")
+        cur.execute(f"PRAGMA synchronous={settings['synchronous']}")
+        if settings["busy_timeout_ms"] is not None:
+            cur.execute(f"PRAGMA busy_timeout={int(settings['busy_timeout_ms'])}")
+        cur.close()
+        # 关掉 pysqlite 自己的隐式 BEGIN，由下面的 begin 事件发，才能按需用 BEGIN IMMEDIATE
+        dbapi_conn.isolation_level = None
+
+    @event.listens_for(new_engine, "begin")
+    def _sqlite_begin(conn):
+        # 先读后写的事务用 IMMEDIATE：开始时就拿写锁（等待受 busy_timeout 约束），
+        # 避免 DEFERRED 事务中途升级写锁时直接报 database is locked
+        conn.exec_driver_sql(f"BEGIN {conn.get_execution_options().get('sqlite_begin', 'DEFERRED')}")
+
+    return new_engine
 
-DB_PATH = "sqlite:///worlds.db"
 
 Base = declarative_base()
-engine = create_engine(DB_PATH, connect_args={"check_same_thread": False})
+engine = make_engine()
+
+# expire_on_commit=False：unit_of_work 结束后读出来的对象仍可直接使用
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+
+@contextmanager
+def unit_of_work(session_factory=None, write=False):
+    """
+    一次业务操作一个短 session：正常结束 commit，出错 rollback，最后归还连接。
+    write=True：事务以 BEGIN IMMEDIATE 开始，用于先读后写的操作。
+    不要在 with 块里做 LLM 调用之类的长操作，以免长时间占用连接与写锁
+    """
+    session = (session_factory or SessionLocal)()
+    try:
+        if write:
+            session.connection(execution_options={"sqlite_begin": "IMMEDIATE"})
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+# ---------------------------
+# 存储编解码（写入时透明压缩，读取时解压）
+# ---------------------------
+# 存储格式：1 字节格式版本 + 内容
+#   0x00  原样 UTF-8（太短，压缩不划算）
+#   0x01  zlib 压缩的 UTF-8
+# 旧行是 TEXT，读出来是 str，原样返回，不需要先迁移
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+DB_CODEC_MIN_BYTES = int(os.getenv("DB_CODEC_MIN_BYTES", "128"))
+DB_CODEC_LEVEL = int(os.getenv("DB_CODEC_LEVEL", "6"))
+
+
+def encode_blob(text_value):
+    if text_value is None:
+        return None
+    raw = text_value.encode("utf-8")
+    if len(raw) >= DB_CODEC_MIN_BYTES:
+        packed = zlib.compress(raw, DB_CODEC_LEVEL)
+        if len(packed) < len(raw):
+            return bytes([CODEC_ZLIB]) + packed
+    return bytes([CODEC_RAW]) + raw
 
-SessionLocal = sessionmaker(bind=engine)
+
+def decode_blob(value):
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if not value:
+        return ""
+    version, body = value[0], value[1:]
+    if version == CODEC_ZLIB:
+        return zlib.decompress(body).decode("utf-8")
+    if version == CODEC_RAW:
+        return body.decode("utf-8")
+    raise ValueError(f"unknown storage codec version: {version}")
+
+
+class CompressedText(TypeDecorator):
+    """对 ORM 来说仍是 str；落盘为带版本字节的 BLOB"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return encode_blob(value)
+
+    def process_result_value(self, value, dialect):
+        return decode_blob(value)
+
+
+# schema_version：0 = 整个世界存成一个 JSON blob（旧格式）
+#                 1 = 规范化存储（下面各表 + data 里只剩其余字段）
+WORLD_SCHEMA_VERSION = 1
 
 
 class World(Base):
     __tablename__ = "worlds"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(200), unique=True)
-    data = Column(Text)       # JSON 字符串
+    # JSON 字符串；延迟加载，列表/元数据查询不会读这一列
+    data = deferred(Column(CompressedText))
     created_at = Column(Float)
+    schema_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class WorldLocation(Base):
+    __tablename__ = "world_locations"
+    id = Column(Integer, primary_key=True)
+    world_id = Column(Integer, ForeignKey("worlds.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    name = Column(String(200))
+    data = Column(CompressedText)  # 完整地点 JSON（description / tags / danger ...）
+    __table_args__ = (UniqueConstraint("world_id", "position"),)
+
+
+class WorldCharacter(Base):
+    __tablename__ = "world_characters"
+    id = Column(Integer, primary_key=True)
+    world_id = Column(Integer, ForeignKey("worlds.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    name = Column(String(200))
+    role = Column(String(200))
+    # 常变的数值单独成列，改一个 NPC 的 trust 只更新这一行的一列
+    trust = Column(Integer)
+    fear = Column(Integer)
+    health = Column(Integer)
+    data = Column(CompressedText)  # 其余字段 JSON（stats 里不含上面三项）
+    __table_args__ = (
+        UniqueConstraint("world_id", "position"),
+        Index("ix_world_characters_world_name", "world_id", "name"),
+    )
+
+
+class StoryNode(Base):
+    __tablename__ = "story_nodes"
+    id = Column(Integer, primary_key=True)
+    world_id = Column(Integer, ForeignKey("worlds.id", ondelete="CASCADE"), nullable=False, index=True)
+    node_key = Column(String(50), nullable=False)
+    position = Column(Integer, nullable=False)
+    summary = Column(CompressedText)
+    data = Column(CompressedText)  # summary / options 以外的字段 JSON
+    __table_args__ = (UniqueConstraint("world_id", "node_key"),)
+
+
+class StoryNodeOption(Base):
+    __tablename__ = "story_node_options"
+    id = Column(Integer, primary_key=True)
+    node_id = Column(Integer, ForeignKey("story_nodes.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    text = Column(Text)
+    goto = Column(String(50))
+    __table_args__ = (UniqueConstraint("node_id", "position"),)
+
+
+class WorldStateEntry(Base):
+    __tablename__ = "world_state"
+    world_id = Column(Integer, ForeignKey("worlds.id", ondelete="CASCADE"), primary_key=True)
+    key = Column(String(100), primary_key=True)
+    position = Column(Integer)  # 原始键顺序
+    value = Column(Text)       # JSON 值
+
+
+class InventoryEntry(Base):
+    __tablename__ = "inventory"
+    id = Column(Integer, primary_key=True)
+    world_id = Column(Integer, ForeignKey("worlds.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String(50), nullable=False)     # resources / items / lore ...
+    key = Column(String(200), nullable=False)     # dict 的 key，或 list 的下标
+    position = Column(Integer, nullable=False)
+    shape = Column(String(10), nullable=False)    # dict / list
+    data = Column(Text)                           # JSON 值
+    __table_args__ = (UniqueConstraint("world_id", "kind", "key"),)
+
+
+class AdventureSession(Base):
+    __tablename__ = "adventure_sessions"
+    id = Column(String(32), primary_key=True)                 # uuid hex，也用作 URL 参数
+    world_id = Column(Integer, ForeignKey("worlds.id", ondelete="CASCADE"), nullable=False, index=True)
+    lang_ui = Column(String(20))
+    rounds = Column(Integer, nullable=False, default=0)
+    created_at = Column(Float)
+    updated_at = Column(Float)
+
+
+class AdventureRound(Base):
+    # 只追加：每回合一行，记录本回合的 history / options 与 world_obj 的增量
+    __tablename__ = "adventure_rounds"
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String(32), ForeignKey("adventure_sessions.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(Integer, nullable=False)
+    created_at = Column(Float)
+    payload = Column(CompressedText)  # JSON
+    __table_args__ = (UniqueConstraint("session_id", "seq"),)
+
+
+def _migrate_columns():
+    # create_all 不会给已有表加列：旧库补上 schema_version / world_state.position
+    cols = {c["name"] for c in inspect(engine).get_columns("worlds")}
+    if "schema_version" not in cols:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE worlds ADD COLUMN schema_version INTEGER NOT NULL DEFAULT 0"))
+    cols = {c["name"] for c in inspect(engine).get_columns("world_state")}
+    if "position" not in cols:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE world_state ADD COLUMN position INTEGER"))
 
 
 # 初始化数据库（建表）
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _migrate_columns()
+
+
+# ---------------------------
+# 世界目录（只读元数据）
+# ---------------------------
+def _prefix_filter(query, prefix):
+    # 用范围条件代替 LIKE，可以直接走 name 上的唯一索引
+    if prefix:
+        query = query.filter(World.name >= prefix, World.name < prefix + "\U0010ffff")
+    return query
+
+
+def list_worlds(session, offset=0, limit=50, prefix=None):
+    """按名字分页列出世界，只返回 (id, name, created_at)，不读取 data"""
+    query = session.query(World.id, World.name, World.created_at)
+    query = _prefix_filter(query, prefix)
+    return query.order_by(World.name).offset(offset).limit(limit).all()
+
+
+def count_worlds(session, prefix=None):
+    return _prefix_filter(session.query(World.id), prefix).count()
+
+
+# ---------------------------
+# 编码迁移与压缩率统计
+# ---------------------------
+def _codec_columns():
+    """所有使用 CompressedText 的 (表名, 主键列, 列名)"""
+    out = []
+    for table in Base.metadata.sorted_tables:
+        pk = [c.name for c in table.primary_key.columns]
+        for col in table.columns:
+            if isinstance(col.type, CompressedText) and len(pk) == 1:
+                out.append((table.name, pk[0], col.name))
+    return out
+
+
+def _stored_size(value):
+    if value is None:
+        return 0
+    return len(value.encode("utf-8")) if isinstance(value, str) else len(value)
+
+
+def codec_stats(bind=None):
+    """每列：行数、未编码的旧行数、磁盘字节数、解压后字节数、压缩率"""
+    bind = bind or engine
+    stats = []
+    with bind.connect() as conn:
+        for table, _, column in _codec_columns():
+            rows = legacy = stored = logical = 0
+            for (value,) in conn.execute(text(f"SELECT {column} FROM {table}")):
+                if value is None:
+                    continue
+                rows += 1
+                legacy += isinstance(value, str)
+                stored += _stored_size(value)
+                logical += len(decode_blob(value).encode("utf-8"))
+            stats.append({
+                "column": f"{table}.{column}", "rows": rows, "legacy_rows": legacy,
+                "stored_bytes": stored, "logical_bytes": logical,
+                "ratio": round(logical / stored, 2) if stored else 0.0,
+            })
+    return stats
+
+
+def compress_existing(bind=None, batch_size=200):
+    """
+    一次性迁移：把旧的 TEXT 行和未压缩的长行按当前编码重写，返回重写的行数。
+    分批提交，避免长时间持有写锁
+    """
+    bind = bind or engine
+    rewritten = 0
+    for table, pk, column in _codec_columns():
+        with bind.connect() as conn:
+            pending = []
+            for key, value in conn.execute(text(f"SELECT {pk}, {column} FROM {table}")):
+                if value is None:
+                    continue
+                if isinstance(value, str) or encode_blob(decode_blob(value)) != bytes(value):
+                    pending.append((key, value))
+        for i in range(0, len(pending), batch_size):
+            with bind.begin() as conn:
+                for key, value in pending[i:i + batch_size]:
+                    conn.execute(text(f"UPDATE {table} SET {column} = :v WHERE {pk} = :k"),
+                                 {"v": encode_blob(decode_blob(value)), "k": key})
+            rewritten += len(pending[i:i + batch_size])
+    return rewritten
+
+
+def vacuum(bind=None):
+    """
+    重写后回收空间。VACUUM 不能在事务里执行，而 engine 的 begin 事件会给每个连接发 BEGIN，
+    所以直接用底层 DBAPI 连接（isolation_level=None，自动提交）
+    """
+    raw = (bind or engine).raw_connection()
+    try:
+        raw.driver_connection.execute("VACUUM")
+    finally:
+        raw.close()
+
+
+def _print_stats(stats):
+    headers = ["column", "rows", "legacy_rows", "stored_bytes", "logical_bytes", "ratio"]
+    widths = [max(len(h), *(len(str(r[h])) for r in stats)) for h in headers]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for r in stats:
+        print("  ".join(str(r[h]).ljust(w) for h, w in zip(headers, widths)))
+
+
+if __name__ == "__main__":
+    # python db.py compress     → 把已有数据按当前编码重写（可重复执行）
+    # python db.py codec-stats  → 查看各列压缩率
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "compress":
+        init_db()
+        print(f"rewrote {compress_existing()} value(s)")
+        _print_stats(codec_stats())
+        vacuum()
+    elif command == "codec-stats":
+        _print_stats(codec_stats())
+    else:
+        print("usage: python db.py compress | codec-stats")
@@ -1,9 +1,25 @@
 # llm.py
 import os
 import json
+import time
+import queue
+import asyncio
+import threading
 from dotenv import load_dotenv
-from openai import OpenAI
 from utils import extract_json
+from llm_cache import response_cache, make_cache_key
+from llm_resilience import (
+    is_gpt_error,
+    gpt_error,
+    classify_error,
+    call_with_policy,
+    retry_policy,
+    circuit_breaker,
+)
+from llm_log import log_llm_call
+from llm_metrics import record_llm_call, start_metrics_server
+from prompt_budget import PromptAssembler
+from llm_provider import LLM_PROVIDER, make_provider, needs_api_key
 try:
     import streamlit as st
 except ImportError:
@@ -11,44 +27,247 @@ except ImportError:
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
+# LLM_PROVIDER=replay 时完全离线，不需要 key
+if not OPENAI_API_KEY and needs_api_key(LLM_PROVIDER):
+    if st is None:
+        raise RuntimeError("请在项目根目录创建 .env 文件并写入 OPENAI_API_KEY=你的key（或设置 LLM_PROVIDER=replay）")
     st.error("请在项目根目录创建 .env 文件并写入 OPENAI_API_KEY=你的key")
     st.stop()
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+MODEL = "gpt-4o-mini"
+# 配置了 LLM_METRICS_PORT 时提供 /metrics 端点
+start_metrics_server()
+# 整个进程同时在途的 GPT 请求上限（所有 Streamlit session 共享）
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
 
 # ---------------------------
-# 统一的 GPT 调用函数
+# 进程级 LLM 事件循环
 # ---------------------------
-def call_gpt(system_prompt, user_prompt, temperature=0.8, max_tokens=1200):
+# 所有请求都在同一个后台事件循环上执行：
+# provider（AsyncOpenAI 客户端）和并发信号量都属于这个循环，
+# 因此无论从哪个线程 / 哪个事件循环调用，限流都是全进程统一的。
+# 请求本身交给 provider（live / record / replay，见 llm_provider.py）
+_loop = None
+_loop_lock = threading.Lock()
+_provider = None
+_limiter = None
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-loop", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def _async_resources():
+    # 只会在 LLM 事件循环线程里调用，不需要加锁
+    global _provider, _limiter
+    if _provider is None:
+        _provider = make_provider(LLM_PROVIDER, api_key=OPENAI_API_KEY, model=MODEL)
+        _limiter = asyncio.Semaphore(LLM_MAX_IN_FLIGHT)
+    return _provider, _limiter
+
+
+def submit(coro):
+    """把协程丢到 LLM 事件循环上执行，返回 concurrent.futures.Future（不阻塞）"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+
+def run_sync(coro, timeout=None):
+    """同步调用方使用：在 LLM 事件循环上执行协程并等待结果"""
+    return submit(coro).result(timeout)
+
+
+def _observe(site, system_prompt, user_prompt, output, latency,
+             usage=None, error=None, cached=False, stream=False):
+    """每次调用结束：写 trace 日志 + 记录调用点指标"""
+    log_llm_call(site, system_prompt, user_prompt, output, latency,
+                 usage=usage, error=error, cached=cached, stream=stream)
+    record_llm_call(site, latency, usage=usage, error=error, cached=cached)
+
+
+async def _acall_gpt(system_prompt, user_prompt, temperature, max_tokens, cache,
+                     timeout=None, site=None):
+    t0 = time.perf_counter()
+    cache_key = None
+    if cache and response_cache.enabled:
+        cache_key = make_cache_key(MODEL, system_prompt, user_prompt, temperature, max_tokens)
+        # 缓存的磁盘层是同步 sqlite3：放到线程里，不阻塞共享事件循环上的其他请求
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached is not None:
+            _observe(site, system_prompt, user_prompt, cached,
+                     time.perf_counter() - t0, cached=True)
+            return cached
+
+    provider, limiter = _async_resources()
+
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=temperature,
-            max_tokens=max_tokens,
+        # 超时 / 429 / 5xx 按策略重试；上游持续失败时熔断直接返回。
+        # 并发槽位由 call_with_policy 在每次尝试前获取：排队不计入单次尝试超时，也不触发熔断
+        out_text, usage = await call_with_policy(
+            lambda: provider.complete(system_prompt, user_prompt, temperature, max_tokens, site=site),
+            retry_policy, circuit_breaker, deadline=timeout, limiter=limiter
         )
-        out_text = completion.choices[0].message.content.strip()
+    except Exception as e:
+        err = gpt_error(e)
+        _observe(site, system_prompt, user_prompt, None, time.perf_counter() - t0, error=err)
+        return err
 
-        # ---- 写入 Log 文件 ----
-        with open("gpt_log.txt", "a", encoding="utf-8") as f:
-            f.write("\n\n==================== NEW CALL ====================\n")
-            f.write("=== SYSTEM PROMPT ===\n")
-            f.write(system_prompt + "\n\n")
-            f.write("=== USER PROMPT ===\n")
-            f.write(user_prompt + "\n\n")
-            f.write("=== GPT RAW OUTPUT ===\n")
-            f.write(out_text + "\n")
-            f.write("==================================================\n")
+    # ---- trace 日志（只入队，后台线程落盘）+ 调用点指标 ----
+    _observe(site, system_prompt, user_prompt, out_text, time.perf_counter() - t0, usage=usage)
 
+    if cache_key:
+        await asyncio.to_thread(response_cache.put, cache_key, out_text)
 
-        return completion.choices[0].message.content.strip()
+    return out_text
 
-    except Exception as e:
-        return f"(Error calling GPT: {e})"
+
+# ---------------------------
+# 统一的 GPT 调用函数
+# ---------------------------
+async def acall_gpt(system_prompt, user_prompt, temperature=0.8, max_tokens=1200, cache=False,
+                    timeout=None, site=None):
+    """
+    asyncio 版本的 call_gpt，可以在任意事件循环里 await。
+    日志与错误约定与 call_gpt 相同（出错返回 GPTError）
+    """
+    coro = _acall_gpt(system_prompt, user_prompt, temperature, max_tokens, cache, timeout, site)
+    loop = _get_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+def call_gpt(system_prompt, user_prompt, temperature=0.8, max_tokens=1200, cache=False,
+             timeout=None, site=None):
+    """
+    同步包装（现有调用方不变）：阻塞当前线程直到结果返回，
+    实际请求同样走进程级并发上限。
+    cache=True：该调用点开启响应缓存（相同 model/prompt/参数 直接复用）
+    只缓存成功结果，错误结果不会写入缓存
+    timeout：本次调用总时限（秒，含排队与重试），默认 LLM_DEADLINE
+    site：调用点标签（写入 trace 日志与调用点指标，例如 "world.base"、"node_round"）
+    失败时返回 GPTError（str 子类，文本为 "(Error calling GPT: ...)"），
+    调用方可用 is_gpt_error() 分支处理
+    """
+    return run_sync(_acall_gpt(system_prompt, user_prompt, temperature, max_tokens, cache,
+                               timeout, site))
+
+
+# ---------------------------
+# 流式输出（逐 token）
+# ---------------------------
+_STREAM_END = object()
+# 同步消费端在流的总时限之外额外多等的时间（正常情况下由 _astream_gpt 自己超时）
+STREAM_CONSUMER_GRACE = 5.0
+
+
+async def _astream_gpt(system_prompt, user_prompt, temperature, max_tokens, timeout=None, meta=None,
+                       site=None):
+    """
+    逐段 yield 文本；meta（dict）里写入最后一个 chunk 带回的 usage。
+    timeout 覆盖整个流（排队 + 建立连接 + 读完）；每个 chunk 还受单次尝试时限约束，
+    上游中途卡住时抛 asyncio.TimeoutError，不会无限等待
+    """
+    provider, limiter = _async_resources()
+    deadline = retry_policy.deadline if timeout is None else timeout
+    end = time.monotonic() + deadline
+
+    # 只在拿到流之前重试（退避期间不占并发槽位）；成功后槽位一直占用到流结束
+    stream = await call_with_policy(
+        lambda: provider.open_stream(system_prompt, user_prompt, temperature, max_tokens, site=site),
+        retry_policy, circuit_breaker, deadline=deadline, limiter=limiter, hold=True
+    )
+    chunks = provider.iter_stream(stream, meta, system_prompt=system_prompt,
+                                  user_prompt=user_prompt, site=site)
+    try:
+        while True:
+            remaining = end - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                delta = await asyncio.wait_for(chunks.__anext__(),
+                                               timeout=min(retry_policy.attempt_timeout, remaining))
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                # 流中途超时 / 断线同样说明上游有问题，计入熔断
+                if classify_error(e)[1]:
+                    circuit_breaker.record_failure()
+                raise
+            yield delta
+    finally:
+        limiter.release()
+        await chunks.aclose()
+        close = getattr(stream, "close", None)
+        if close is not None and asyncio.iscoroutinefunction(close):
+            await close()
+
+
+def stream_gpt(system_prompt, user_prompt, temperature=0.8, max_tokens=1200, cache=False,
+               timeout=None, site=None):
+    """
+    call_gpt 的流式版本：同步生成器，逐段 yield 文本。
+    - 拼接全部片段并 strip() 即等于 call_gpt 的返回值
+    - 出错时 yield 一个 GPTError，与 call_gpt 约定一致
+    - cache=True：命中缓存时一次性 yield 全文；流结束后写入缓存
+    - timeout：整个流的总时限（默认 LLM_DEADLINE）；超时同样 yield GPTError（kind=timeout）
+    """
+    t0 = time.perf_counter()
+    cache_key = None
+    if cache and response_cache.enabled:
+        cache_key = make_cache_key(MODEL, system_prompt, user_prompt, temperature, max_tokens)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            _observe(site, system_prompt, user_prompt, cached,
+                     time.perf_counter() - t0, cached=True, stream=True)
+            yield cached
+            return
+
+    q = queue.Queue()
+
+    async def pump():
+        parts = []
+        meta = {}
+        try:
+            async for tok in _astream_gpt(system_prompt, user_prompt, temperature, max_tokens,
+                                          timeout, meta, site):
+                parts.append(tok)
+                q.put(tok)
+        except Exception as e:
+            err = gpt_error(e)
+            _observe(site, system_prompt, user_prompt, "".join(parts),
+                     time.perf_counter() - t0, error=err, stream=True)
+            q.put(err)
+        else:
+            out_text = "".join(parts).strip()
+            _observe(site, system_prompt, user_prompt, out_text, time.perf_counter() - t0,
+                     usage=meta.get("usage"), stream=True)
+            if cache_key and out_text:
+                await asyncio.to_thread(response_cache.put, cache_key, out_text)
+        finally:
+            q.put(_STREAM_END)
+
+    fut = submit(pump())
+    # 兜底：事件循环那边没能按时结束时，调用线程也不会永远阻塞
+    end = time.monotonic() + (retry_policy.deadline if timeout is None else timeout) + STREAM_CONSUMER_GRACE
+    while True:
+        try:
+            tok = q.get(timeout=max(0.0, end - time.monotonic()))
+        except queue.Empty:
+            fut.cancel()
+            err = gpt_error(asyncio.TimeoutError())
+            _observe(site, system_prompt, user_prompt, None, time.perf_counter() - t0,
+                     error=err, stream=True)
+            yield err
+            return
+        if tok is _STREAM_END:
+            return
+        yield tok
 
 
 # ---------------------------
@@ -186,20 +405,7 @@ def build_world_prompt(idea, lang_ui):
         After the JSON, add a very short "notes" paragraph.
         """
 
-def build_opening_scene_prompt(world_obj, lang_ui):
-    return f"""
-        使用 {lang_ui}。
-
-        你必须根据这个世界的内容生成一个结构化的开场事件：
-        世界总结：
-        {json.dumps(world_obj["summary"], ensure_ascii=False)}
-
-        地点列表：
-        {json.dumps(world_obj["locations"], ensure_ascii=False)}
-
-        主要角色：
-        {json.dumps(world_obj["characters"], ensure_ascii=False)}
-
+OPENING_SCENE_RULES = """
         开场事件规则（务必严格遵守）：
         - 氛围：2~4 句
         - 内容必须发生在某个具体地点（地点名需点名）
@@ -218,215 +424,259 @@ def build_opening_scene_prompt(world_obj, lang_ui):
         3. 文本
     """
 
-def parse_action(action_text):
-    prompt = f"玩家行动：{action_text}\n请输出结构化行为 JSON："
-    raw = call_gpt(ACTION_PARSER_SYSTEM, prompt, max_tokens=200)
-    return extract_json(raw)
 
-def build_event_prompt(
-        world_obj,
-        player_action,
-        parsed_action,
-        lang_ui,
-        info_level,
-        chapter
-    ):
+def _npc_view(ch):
+    """给 prompt 用的精简 NPC 视图：只保留叙述需要的字段"""
+    personality = ch.get("personality", {})
+    return {
+        "name": ch.get("name", ""),
+        "role": ch.get("role", ""),
+        "desc": ch.get("short_desc") or ch.get("desc", ""),
+        "traits": personality.get("traits") or ch.get("base_traits", []),
+        "speech_style": personality.get("speech_style") or ch.get("speech_style", ""),
+    }
+
+
+def build_opening_scene_prompt(world_obj, lang_ui, token_budget=None):
     """
-    纯事件 Prompt 构造器
-    不依赖 AdventureManager，不使用 self
+    返回 (system_prompt, user_prompt)
+    静态规则放进 system（DM_SYSTEM + 开场规则），世界内容按 token 预算裁剪
     """
+    pa = PromptAssembler(token_budget)
+    pa.static(DM_SYSTEM)
+    pa.static(OPENING_SCENE_RULES)
+
+    pa.section("语言", f"使用 {lang_ui}。你必须根据这个世界的内容生成一个结构化的开场事件。", required=True)
+    pa.section("世界总结", world_obj.get("summary", ""), priority=0)
+    pa.section("地点列表", [
+        {"name": loc.get("name", ""), "description": loc.get("description", "")}
+        for loc in world_obj.get("locations", [])
+    ], priority=1)
+    pa.section("主要角色", [_npc_view(ch) for ch in world_obj.get("characters", [])], priority=1)
+    pa.section("初始钩子", world_obj.get("initial_hook", ""), priority=2)
+
+    system_prompt, user_prompt, _ = pa.build()
+    return system_prompt, user_prompt
+
+# 节点回合规则：放在 system 里，跨回合保持不变
+NODE_ROUND_RULES = """
+        你是这个故事的叙述者。根据用户消息里的信息写出【本回合发生的事件】，共 3~4 句。
 
-    parsed = json.loads(parsed_action)
+        规则：
+        - 本回合必须体现玩家刚才的动作所带来的影响
+        - 必须推动故事朝节点摘要方向推进，但不能重复上回合文字
+        - 必须加入新的细节：线索 / 新角色出现 / 冲突 / 环境变化（二选一）
+        - 保持语言自然，不要模板化，不要重复相同句式
+    """
 
-    action_type = parsed.get("action_type", "social")
-    target = parsed.get("target", "")
-    intent = parsed.get("intent", "")
-    topic = parsed.get("topic", "")
-    risk = parsed.get("risk", "low")
 
-    world_state = world_obj.get("world_state", {})
-    player_stats = world_obj.get("player_stats", {})
-    characters = world_obj.get("characters", [])
+def build_node_round_prompt(world_obj, node_summary, player_action, lang_ui, recent=None, token_budget=None):
+    """
+    返回 (system_prompt, user_prompt)
+    system：DM_SYSTEM + 节点回合规则（稳定前缀）
+    user：节点摘要、玩家动作必留；最近回合（最新在前）、主线、NPC 按 token 预算裁剪
+    recent：最近几回合的 history 条目（{"player", "dm"}），按时间顺序
+    """
+    pa = PromptAssembler(token_budget)
+    pa.static(DM_SYSTEM)
+    pa.static(NODE_ROUND_RULES)
 
-    story_beats = world_obj.get("story_beats", {})
+    pa.section("语言", f"使用 {lang_ui}。", required=True)
+    pa.section("节点摘要（剧情方向）", node_summary, required=True)
+    pa.section("玩家动作（必须融入叙述）", player_action, required=True)
+    pa.section("最近回合（最新在前，不得重复其中的文字）", [
+        {"player": h.get("player", ""), "dm": h.get("dm", "")} for h in reversed(recent or [])
+    ], priority=0)
+    pa.section("主线任务", world_obj.get("main_quest", ""), priority=1)
+    pa.section("主要角色", [_npc_view(ch) for ch in world_obj.get("characters", [])], priority=2)
 
-    # DM 输出必须严格遵守 action_type 的事件结构
-    ACTION_HARD_RULE = f"""
-        本回合事件类型是：{action_type}
-        你必须完全按照该事件类型进行叙述。不得偏离。
+    system_prompt, user_prompt, _ = pa.build()
+    return system_prompt, user_prompt
+
+
+RECAP_SYSTEM = "You are an expert RPG chronicler who writes evocative summaries."
+
+
+def build_recap_prompt(history_text, lang_ui):
+    """冒险回顾（侧边栏按钮）：说明放 system，冒险记录放 user；返回 (system_prompt, user_prompt)"""
+    pa = PromptAssembler()
+    pa.static(RECAP_SYSTEM)
+    if lang_ui == "中文":
+        pa.static("请把用户给出的冒险记录总结为一段叙述风格的冒险回顾，突出情节要点和关键角色。")
+    else:
+        pa.static("Summarize the adventure log the user gives you as a narrative recap, "
+                  "highlighting key plot points and important characters.")
+    # 滚动摘要 + 最近回合，长度本身已经有界，必须完整保留
+    pa.section("Adventure", history_text, required=True)
+    system_prompt, user_prompt, _ = pa.build()
+    return system_prompt, user_prompt
+
+
+def parse_action(action_text):
+    prompt = f"玩家行动：{action_text}\n请输出结构化行为 JSON："
+    raw = call_gpt(ACTION_PARSER_SYSTEM, prompt, max_tokens=200, cache=True, site="parse_action")
+    if is_gpt_error(raw):
+        return None
+    return extract_json(raw)
 
+# --------- 事件 prompt 的规则块（按 action_type / chapter 选用） ---------
+
+# DM 输出必须严格遵守 action_type 的事件结构
+ACTION_HARD_RULES = {
+    "combat": """
         【combat】
         - 必须出现敌人或威胁
         - 必须有攻击/闪避/受伤
         - 必须体现 risk（风险）高低
-        - 不得输出探索类线索，不得输出社交对话
-
+        - 不得输出探索类线索，不得输出社交对话""",
+    "exploration": """
         【exploration】
         - 必须出现调查行为
         - 必须发现“新的”线索（禁止重复 info_given）
         - 必须描述具体环境（地点结构/痕迹/声音）
-        - 不得输出战斗，不得出现深层秘密
-
+        - 不得输出战斗，不得出现深层秘密""",
+    "social": """
         【social】
         - 必须包含 NPC 对话（必须体现 speech_style）
         - 必须对应 target 的角色
         - 对话必须推动信息层级（shallow/medium/major）
-        - 不得创建新角色
-
+        - 不得创建新角色""",
+    "stealth": """
         【stealth】
         - 必须强调隐藏、侦察、紧张气氛
         - 必须有“被发现风险”
-        - 不得给主线信息
-
+        - 不得给主线信息""",
+    "item": """
         【item】
         - 必须描述一个具体物品
         - 必须提供关于物品的新用途或线索
-        - 不得写战斗或社交
-
+        - 不得写战斗或社交""",
+    "move": """
         【move】
         - 必须抵达一个具体地点
         - 必须描述抵达后的新状况
         - 必须提供新的行动方向
-        - 不得写战斗、不写深线索
-        """
-
-    # 事件类型模板：让 GPT 真的使用事件类型
-    EVENT_TYPE_GUIDE = f"""
-        事件类型说明（你必须严格遵守 action_type）：
+        - 不得写战斗、不写深线索""",
+}
 
-        1. combat（战斗事件）
+# 事件类型模板：让 GPT 真的使用事件类型
+EVENT_TYPE_GUIDES = {
+    "combat": """
+        combat（战斗事件）
         - 必须包含敌人、攻击、伤害、风险
         - 必须有至少一个战斗动作（攻击/格挡/躲闪）
-        - 必须根据 risk 输出合适的危险程度描述
-
-        2. exploration（探索事件）
+        - 必须根据 risk 输出合适的危险程度描述""",
+    "exploration": """
+        exploration（探索事件）
         - 必须包含观察、调查、线索、发现
         - 必须给出新的信息，不得重复旧信息
-        - 场景必须具体（地点结构、声音、痕迹）
-
-        3. social（社交事件）
+        - 场景必须具体（地点结构、声音、痕迹）""",
+    "social": """
+        social（社交事件）
         - 必须包含对话、回应、情绪变化
         - target 若存在 → 必须与该角色互动
-        - 必须推动剧情（不能只给氛围）
-
-        4. stealth（潜行事件）
+        - 必须推动剧情（不能只给氛围）""",
+    "stealth": """
+        stealth（潜行事件）
         - 必须出现潜伏、暗影、侦察、隐藏行为
-        - 必须强调风险与隐蔽性
-
-        5. item（物品事件）
+        - 必须强调风险与隐蔽性""",
+    "item": """
+        item（物品事件）
         - 必须描述物品的细节、用途或秘密
-        - 必须发现新的线索或产生新风险
-
-        6. move（移动事件）
+        - 必须发现新的线索或产生新风险""",
+    "move": """
+        move（移动事件）
         - 必须描述新地点或环境变化
-        - 必须给出抵达后的新状况与选择
-        """
-
-    # 强制章节驱动剧情节奏
-    CHAPTER_RULE = f"""
-        当前章节：{chapter}
-
-        你必须根据章节强制调整事件内容：
+        - 必须给出抵达后的新状况与选择""",
+}
 
+# 强制章节驱动剧情节奏
+CHAPTER_RULES = {
+    0: """
         0（序章）：
         - 只能给浅层信息
         - 冲突必须很轻
         - 不能出现重大秘密
         - 不得出现强敌
 
+        主要任务：建立气氛、背景、初始冲突
+        - 禁止透露任何核心秘密
+        - 引导玩家认识角色与环境
+        - 事件动作应该轻量（不激烈）""",
+    1: """
         1（线索阶段）：
         - exploration 必须给 medium 信息
         - social 必须给模糊但推进剧情的回答
         - move 必须引导到“关键地点”
 
+        推进：
+        - 可以给浅层线索
+        - 允许轻微冲突
+        - NPC 回答必须含糊、保留
+        - 不要透露幕后真相""",
+    2: """
         2（冲突阶段）：
         - exploration 必须给重大线索（major）
         - 环境必须危险化（更紧张）
         - social 必须体现情绪变化 trust/fear
 
+        重要：
+        - 事件必须出现转折点或危险升级
+        - 线索必须变得重要
+        - NPC 关系必须有变化（trust/fear生效）
+        - 环境也应变得紧张""",
+    3: """
         3（危机逼近）：
         - 必须出现紧迫感
         - 事件必须暗示终局
         - exploration 必须给关键信息碎片
         - social 必须出现 NPC 的恐惧或犹豫
 
+        重大阶段：
+        - 必须出现“大事件预兆”
+        - 氛围明显变强
+        - 玩家每个选择都显得重要
+        - 可以揭示部分大秘密，但必须保留最终答案""",
+    4: """
         4（终章前夕）：
         - 必须出现核心秘密的 80% 线索
         - 气氛必须紧绷
         - 事件必须感觉到“马上要决战”
 
+        高潮前紧张：
+        - 必须出现“逼近真相”的直接证据或关键事件
+        - 冲突到达最高点
+        - NPC 会表现出强烈情绪变化
+        - 除非必要，禁止收尾事件""",
+    5: """
         5（最终章）：
-        - 不再使用本事件模板
-        - 最终章由终章 prompt 生成
-        """
-    return f"""
-        你是这个世界的 DM。你的事件必须遵守以下内容：
-        ==================== 必须使用的语言 ====================
-        {lang_ui}
-
-        ==================== 玩家行为（解析后，必须使用） ====================
-        action_type: {action_type}
-        target: {target}
-        intent: {intent}
-        topic: {topic}
-        risk: {risk}
-        完整解析：{parsed_action}
-
-        ==================== 当前章节的故事骨架（必须使用） ====================
-        story_beats:
-        {json.dumps(story_beats, ensure_ascii=False)}
-
-        在本章节，你必须参考以下 beats：
-
-        若 chapter == 0：使用 story_beats["setup"]
-        若 chapter == 1：使用 story_beats["first_clue"]
-        若 chapter == 2：使用 story_beats["midpoint_twist"]
-        若 chapter == 3：使用 story_beats["escalation"]
-        若 chapter == 4：使用 story_beats["pre_final"]
+        - 必须揭示全部真相
+        - 结局必须完整
+        - options 留空""",
+}
 
-        规则：
-        - 你必须引用该章节 beats 里的至少 1 个字段
+# 章节 → 使用的 story_beats 字段
+CHAPTER_BEATS = {0: "setup", 1: "first_clue", 2: "midpoint_twist", 3: "escalation", 4: "pre_final"}
+
+# 与回合无关的事件规则：放在 system 里，跨回合保持不变
+EVENT_COMMON_RULES = """
+        你是这个世界的 DM。你的事件必须遵守以下内容。
+
+        ==================== 故事骨架规则 ====================
+        - 你必须引用本章节 beats 里的至少 1 个字段
         - 你必须推动剧情向 beats 指向的方向前进
         - 事件必须体现 beats 的剧情意义（例如：冲突升级、时间压力、接近真相）
         - 禁止跳章节使用未来 beats
         - 禁止泄露 finale 的 true_cause（最终真相）
 
-        ==================== ACTION 类型硬规则 ====================
-        {ACTION_HARD_RULE}
-
-        ==================== 事件类型模板 ====================
-        {EVENT_TYPE_GUIDE}
-
-        ==================== 章节规则（必须遵守） ====================
-        {CHAPTER_RULE}
-
-        ==================== 世界状态（必须影响气氛） ====================
-        {json.dumps(world_state, ensure_ascii=False)}
-
-        ==================== 玩家状态 ====================
-        {json.dumps(player_stats, ensure_ascii=False)}
-
-        ==================== NPC 性格约束（必须遵守） ====================
-        每个 NPC 的个性如下，所有行为必须符合这些 personality：
-        {json.dumps(characters, ensure_ascii=False)}
-
-        NPC 规则：
+        ==================== NPC 规则 ====================
         - traits 决定情绪底色（例如 冷静/冲动/神秘）
         - speech_style 决定说话方式（例如 短句/粗声/戏弄）
         - DM 在写 NPC 对话或动作时必须体现这些风格
         - DM 不得改变 NPC 性格，不得混淆不同角色的说话方式
 
-        ==================== 玩家原始输入 ====================
-        "{player_action}"
-
-        ==================== 信息层级（你必须遵守） ====================
-        本回合信息等级：{info_level}
-
-        ==================== 已知信息（禁止重复） ====================
-        这些线索已经给过，禁止重复解释：
-        {world_obj["memory"]["info_given"]}
-
-        信息规则：
+        ==================== 信息规则 ====================
+        已知信息（info_given）里的线索已经给过，禁止重复解释。
         - shallow：只能给非常浅的线索，不得给任何关键秘密
         - medium：可以透露中等线索，但不得泄露最终真相
         - major：可以透露重大信息或剧情节点，但必须保留关键部分
@@ -434,48 +684,8 @@ def build_event_prompt(
         - reveal：主线已接近终点，可以揭露最重要的秘密
         - no_information：本回合不应提供剧情信息（例如战斗/移动/潜行）
 
-        ==================== 当前剧情章节：{chapter} ====================
-        请严格按照该章节规则生成事件：
-
-        # 0：序章（世界开场）
-        - 主要任务：建立气氛、背景、初始冲突
-        - 禁止透露任何核心秘密
-        - 引导玩家认识角色与环境
-        - 事件动作应该轻量（不激烈）
-
-        # 1：线索阶段（推进）
-        - 可以给浅层线索
-        - 允许轻微冲突
-        - NPC 回答必须含糊、保留
-        - 不要透露幕后真相
-
-        # 2：冲突阶段（重要）
-        - 事件必须出现转折点或危险升级
-        - 线索必须变得重要
-        - NPC 关系必须有变化（trust/fear生效）
-        - 环境也应变得紧张
-
-        # 3：危机逼近（重大阶段）
-        - 必须出现“大事件预兆”
-        - 氛围明显变强
-        - 玩家每个选择都显得重要
-        - 可以揭示部分大秘密，但必须保留最终答案
-
-        # 4：终章前夕（高潮前紧张）
-        - 必须出现“逼近真相”的直接证据或关键事件
-        - 冲突到达最高点
-        - NPC 会表现出强烈情绪变化
-        - 除非必要，禁止收尾事件
-
-        # 5：最终章
-        - 必须揭示全部真相
-        - 结局必须完整
-        - options 留空
-
         ==================== 事件类型与章节协同（必须遵守） ====================
-
-        在本章节内，事件类型（{action_type}）必须服从章节目标。
-        例如：
+        事件类型必须服从章节目标。例如：
         - 序章的 combat 是小规模冲突
         - 冲突阶段的 exploration 要给出节点级线索
         - 危机逼近阶段的 social 必须带重大情绪变化
@@ -483,18 +693,103 @@ def build_event_prompt(
 
         ==================== 严格输出 JSON（不要旁白，不要解释） ====================
         结构如下：
-        {{
+        {
         "dm_text": "2~4句，必须体现 action_type 对事件的真实影响。",
         "options": ["基于 action_type 的行动选择"],
         "health_change": 整数,
-        "world_state_change": {{}},
-        "player_change": {{}},
+        "world_state_change": {},
+        "player_change": {},
         "npc_change": []
-        }}
+        }
 
         严格要求：
         - 不得输出与 action_type 无关的事件内容。
         - dm_text 必须体现玩家意图（intent）与目标（target）。
         - 不得重复旧信息（尤其是 topic 相关）。
         - options 必须与 action_type 对应。
-        """
\ No newline at end of file
+        """
+
+
+def build_event_prompt(
+        world_obj,
+        player_action,
+        parsed_action,
+        lang_ui,
+        info_level,
+        chapter,
+        token_budget=None
+    ):
+    """
+    纯事件 Prompt 构造器
+    不依赖 AdventureManager，不使用 self
+
+    返回 (system_prompt, user_prompt)：
+    - system：EVENT_SYSTEM + 通用规则（稳定前缀）+ 仅本回合 action_type / chapter 的规则块
+    - user：动态内容，按 token_budget（默认 PROMPT_TOKEN_BUDGET）和优先级裁剪
+    """
+
+    parsed = json.loads(parsed_action)
+
+    action_type = parsed.get("action_type", "social")
+    if action_type not in ACTION_HARD_RULES:
+        action_type = "social"
+    target = parsed.get("target", "")
+    intent = parsed.get("intent", "")
+    topic = parsed.get("topic", "")
+    risk = parsed.get("risk", "low")
+    chapter = max(0, min(5, int(chapter)))
+
+    world_state = world_obj.get("world_state", {})
+    player_stats = world_obj.get("player_stats", {})
+    characters = world_obj.get("characters", [])
+    story_beats = world_obj.get("story_beats", {})
+    info_given = world_obj.get("memory", {}).get("info_given", [])
+
+    pa = PromptAssembler(token_budget)
+
+    # ---- 静态部分（system） ----
+    pa.static(EVENT_SYSTEM)
+    pa.static(EVENT_COMMON_RULES)
+    pa.static(f"""
+        ==================== 本回合规则 ====================
+        本回合事件类型是：{action_type}
+        你必须完全按照该事件类型进行叙述。不得偏离。
+        {ACTION_HARD_RULES[action_type]}
+
+        事件类型说明：
+        {EVENT_TYPE_GUIDES[action_type]}
+
+        当前章节：{chapter}
+        你必须根据章节强制调整事件内容：
+        {CHAPTER_RULES[chapter]}
+        """)
+
+    # ---- 动态部分（user，按预算裁剪） ----
+    pa.section("必须使用的语言", lang_ui, required=True)
+    pa.section("玩家行为（解析后，必须使用）", (
+        f"action_type: {action_type}\n"
+        f"target: {target}\n"
+        f"intent: {intent}\n"
+        f"topic: {topic}\n"
+        f"risk: {risk}"
+    ), required=True)
+    pa.section("玩家原始输入", f'"{player_action}"', required=True)
+    pa.section("信息层级（你必须遵守）", f"本回合信息等级：{info_level}", required=True)
+
+    beat_key = CHAPTER_BEATS.get(chapter)
+    if beat_key and beat_key in story_beats:
+        pa.section(f"当前章节的故事骨架（story_beats[\"{beat_key}\"]）", story_beats[beat_key], priority=0)
+
+    # 最近给过的线索最重要，排在前面；旧存档里可能有重复的显示名
+    pa.section("已知信息（禁止重复）", list(dict.fromkeys(reversed(info_given))), priority=1)
+
+    # target 对应的 NPC 排在最前，预算不足时先丢其他 NPC
+    npcs = [_npc_view(ch) for ch in characters]
+    npcs.sort(key=lambda ch: ch["name"] != target)
+    pa.section("NPC 性格约束（必须遵守）", npcs, priority=2)
+
+    pa.section("世界状态（必须影响气氛）", world_state, priority=3)
+    pa.section("玩家状态", player_stats, priority=3)
+
+    system_prompt, user_prompt, _ = pa.build()
+    return system_prompt, user_prompt
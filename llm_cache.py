@@ -0,0 +1,212 @@
+# llm_cache.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# ---------------------------
+# 配置（环境变量可覆盖）
+# ---------------------------
+# LLM_CACHE=0 可整体关闭缓存；各调用点仍需 call_gpt(..., cache=True) 显式开启
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+# 与 worlds.db 放在同一目录
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))     # 秒
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "256"))
+LLM_CACHE_DISK_ITEMS = int(os.getenv("LLM_CACHE_DISK_ITEMS", "5000"))
+
+
+def make_cache_key(model, system_prompt, user_prompt, temperature, max_tokens):
+    """model + prompts + 采样参数 → 稳定的 sha256 key"""
+    raw = json.dumps(
+        [model, system_prompt, user_prompt, float(temperature), int(max_tokens)],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    两级响应缓存：
+    - 内存 LRU（OrderedDict）
+    - SQLite 磁盘层（按 last_used 淘汰）
+    两级都带 TTL；线程安全（Streamlit 多 session 共用一个进程）
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL,
+                 memory_items=LLM_CACHE_MEMORY_ITEMS, disk_items=LLM_CACHE_DISK_ITEMS,
+                 enabled=LLM_CACHE_ENABLED):
+        self.path = path
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.enabled = enabled
+
+        self._memory = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._puts_since_evict = 0
+
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "puts": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+    # ----------- 磁盘层 -----------
+
+    def _db(self):
+        # 第一次用到时才建库，避免 import 时产生文件
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_llm_cache_last_used ON llm_cache (last_used)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _evict_disk(self):
+        db = self._db()
+        now = time.time()
+        cur = db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+        self.counters["expired"] += cur.rowcount
+
+        count = db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        overflow = count - self.disk_items
+        if overflow > 0:
+            db.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY last_used ASC LIMIT ?
+                )
+                """,
+                (overflow,)
+            )
+            self.counters["evictions"] += overflow
+        db.commit()
+
+    # ----------- 内存层 -----------
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    # ----------- 对外接口 -----------
+
+    def get(self, key):
+        """命中返回缓存文本，否则返回 None"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item:
+                expires_at, value = item
+                if expires_at >= now:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self.counters["expired"] += 1
+
+            db = self._db()
+            row = db.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[1] >= now:
+                db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+                db.commit()
+                self._remember(key, row[1], row[0])
+                self.counters["disk_hits"] += 1
+                return row[0]
+
+            if row:
+                db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                db.commit()
+                self.counters["expired"] += 1
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, value, ttl=None):
+        if not self.enabled:
+            return
+
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, expires_at, value)
+
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, now, expires_at, now)
+            )
+            db.commit()
+            self.counters["puts"] += 1
+
+            # 摊销淘汰：每 50 次写入检查一次磁盘容量
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= 50:
+                self._puts_since_evict = 0
+                self._evict_disk()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._db()
+            db.execute("DELETE FROM llm_cache")
+            db.commit()
+
+    def stats(self):
+        """命中/未命中计数 + 两级当前大小"""
+        with self._lock:
+            out = dict(self.counters)
+            out["memory_size"] = len(self._memory)
+            out["disk_size"] = self._db().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+        lookups = out["memory_hits"] + out["disk_hits"] + out["misses"]
+        out["hit_rate"] = round((out["memory_hits"] + out["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return out
+
+
+# 进程级单例，call_gpt 使用
+response_cache = ResponseCache()
+
+
+if __name__ == "__main__":
+    # python llm_cache.py [stats|clear|evict]
+    import sys
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if cmd == "clear":
+        response_cache.clear()
+        print("cache cleared")
+    elif cmd == "evict":
+        with response_cache._lock:
+            response_cache._evict_disk()
+        print(json.dumps(response_cache.stats(), indent=2))
+    else:
+        print(json.dumps(response_cache.stats(), indent=2))
@@ -0,0 +1,168 @@
+# llm_log.py
+import os
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import hashlib
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# ---------------------------
+# 配置（环境变量可覆盖）
+# ---------------------------
+# off   : 不记录
+# basic : 只记元数据（调用点、耗时、token、prompt hash、输出长度、错误）
+# full  : basic + 完整 prompt 与输出（默认，相当于原来的 gpt_log.txt）
+# debug : full + 调试转储（story_nodes、节点跳转等）
+LLM_LOG_LEVEL = os.getenv("LLM_LOG_LEVEL", "full").lower()
+LLM_LOG_PATH = os.getenv("LLM_LOG_PATH", os.path.join("logs", "llm_trace.jsonl"))
+LLM_LOG_MAX_BYTES = int(os.getenv("LLM_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LLM_LOG_BACKUPS = int(os.getenv("LLM_LOG_BACKUPS", "10"))
+LLM_LOG_ROTATE_SECONDS = int(os.getenv("LLM_LOG_ROTATE_SECONDS", str(24 * 3600)))
+
+_LEVELS = {"off": 0, "basic": 1, "full": 2, "debug": 3}
+_verbosity = _LEVELS.get(LLM_LOG_LEVEL, _LEVELS["full"])
+
+
+def set_verbosity(level):
+    """运行时调整：off / basic / full / debug"""
+    global _verbosity
+    _verbosity = _LEVELS[level]
+
+
+def enabled(level="basic"):
+    return _verbosity >= _LEVELS[level]
+
+
+def prompt_hash(system_prompt, user_prompt):
+    raw = (system_prompt + "\x00" + user_prompt).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+# ---------------------------
+# 按大小 / 时间轮转并 gzip 压缩的文件 handler
+# ---------------------------
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """超过 max_bytes 或距上次轮转超过 rotate_seconds 时轮转，旧文件压缩为 .N.gz"""
+
+    def __init__(self, filename, max_bytes, backup_count, rotate_seconds):
+        folder = os.path.dirname(filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count,
+                         encoding="utf-8", delay=True)
+        self.rotate_seconds = rotate_seconds
+        self._rollover_at = time.time() + rotate_seconds if rotate_seconds else None
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._gzip_rotate
+
+    @staticmethod
+    def _gzip_rotate(source, dest):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record):
+        if self._rollover_at and time.time() >= self._rollover_at:
+            # 空文件不轮转，只顺延计时
+            if not os.path.exists(self.baseFilename) or os.path.getsize(self.baseFilename) == 0:
+                self._rollover_at = time.time() + self.rotate_seconds
+                return False
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.rotate_seconds:
+            self._rollover_at = time.time() + self.rotate_seconds
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        out = {"ts": round(record.created, 3), "event": record.getMessage()}
+        out.update(getattr(record, "trace", {}))
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+# ---------------------------
+# 后台队列写入
+# ---------------------------
+# 请求路径只做 queue.put，真正的磁盘 I/O 在 QueueListener 线程里
+_logger = logging.getLogger("worldweaver.trace")
+_logger.setLevel(logging.INFO)
+_logger.propagate = False
+
+_listener = None
+_start_lock = threading.Lock()
+
+
+def _ensure_started():
+    global _listener
+    if _listener is not None:
+        return
+    with _start_lock:
+        if _listener is not None:
+            return
+        q = queue.SimpleQueue()
+        file_handler = CompressingRotatingFileHandler(
+            LLM_LOG_PATH, LLM_LOG_MAX_BYTES, LLM_LOG_BACKUPS, LLM_LOG_ROTATE_SECONDS
+        )
+        file_handler.setFormatter(JsonLineFormatter())
+        _logger.addHandler(QueueHandler(q))
+        _listener = QueueListener(q, file_handler)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """刷新队列并停止后台线程（进程退出时自动调用）"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _emit(event, fields):
+    _ensure_started()
+    _logger.info(event, extra={"trace": fields})
+
+
+# ---------------------------
+# 对外接口
+# ---------------------------
+def log_llm_call(site, system_prompt, user_prompt, output, latency,
+                 usage=None, error=None, cached=False, stream=False):
+    """记录一次 GPT 调用（usage 为 OpenAI 返回的 usage 对象或 None）"""
+    if not enabled("basic"):
+        return
+
+    fields = {
+        "site": site or "unknown",
+        "latency_ms": round(latency * 1000, 1),
+        "prompt_hash": prompt_hash(system_prompt, user_prompt),
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "output_chars": len(output or ""),
+        "cached": cached,
+        "stream": stream,
+    }
+    if error is not None:
+        fields["error"] = getattr(error, "kind", "unknown")
+        fields["error_message"] = str(error)
+    if enabled("full"):
+        fields["system_prompt"] = system_prompt
+        fields["user_prompt"] = user_prompt
+        fields["output"] = output
+
+    _emit("llm_call", fields)
+
+
+def log_debug(event, **fields):
+    """调试转储，只在 debug 级别记录"""
+    if not enabled("debug"):
+        return
+    _emit(event, fields)
@@ -0,0 +1,274 @@
+# llm_metrics.py
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ---------------------------
+# 配置（环境变量可覆盖）
+# ---------------------------
+# 设置端口后在后台线程提供 /metrics（Prometheus 文本）与 /metrics.json
+LLM_METRICS_PORT = os.getenv("LLM_METRICS_PORT")
+LLM_METRICS_HOST = os.getenv("LLM_METRICS_HOST", "127.0.0.1")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)           # 秒
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+class Histogram:
+    """累计直方图（与 Prometheus histogram 相同语义：le 桶 + sum + count）"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # 最后一个是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def quantile(self, q):
+        """按桶上界估算分位数（落在 +Inf 桶时返回最大桶上界）"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+        return self.buckets[-1]
+
+    def cumulative(self):
+        out, total = [], 0
+        for c in self.counts:
+            total += c
+            out.append(total)
+        return out
+
+    def to_dict(self):
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "sum": round(self.sum, 4),
+            "count": self.count,
+        }
+
+
+class SiteMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.errors = {}                      # kind -> count
+        self.prompt_tokens_total = 0
+        self.completion_tokens_total = 0
+        # 缓存命中（≈0ms）单独统计，不拉低上游调用的分位数
+        self.latency = {"miss": Histogram(LATENCY_BUCKETS), "hit": Histogram(LATENCY_BUCKETS)}
+        self.prompt_tokens = Histogram(TOKEN_BUCKETS)
+        self.completion_tokens = Histogram(TOKEN_BUCKETS)
+
+
+class MetricsRegistry:
+    """按调用点（site）聚合的 LLM 指标，进程内、线程安全"""
+
+    def __init__(self):
+        self._sites = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def record(self, site, latency, usage=None, error=None, cached=False):
+        site = site or "unknown"
+        with self._lock:
+            m = self._sites.get(site)
+            if m is None:
+                m = self._sites[site] = SiteMetrics()
+
+            m.calls += 1
+            m.latency["hit" if cached else "miss"].observe(latency)
+            if cached:
+                m.cache_hits += 1
+            if error is not None:
+                kind = getattr(error, "kind", "unknown")
+                m.errors[kind] = m.errors.get(kind, 0) + 1
+
+            prompt_tokens = getattr(usage, "prompt_tokens", None)
+            completion_tokens = getattr(usage, "completion_tokens", None)
+            if prompt_tokens is not None:
+                m.prompt_tokens_total += prompt_tokens
+                m.prompt_tokens.observe(prompt_tokens)
+            if completion_tokens is not None:
+                m.completion_tokens_total += completion_tokens
+                m.completion_tokens.observe(completion_tokens)
+
+    def reset(self):
+        with self._lock:
+            self._sites.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            sites = {}
+            for site, m in sorted(self._sites.items()):
+                upstream = m.latency["miss"]
+                sites[site] = {
+                    "calls": m.calls,
+                    "cache_hits": m.cache_hits,
+                    "errors": dict(m.errors),
+                    "prompt_tokens_total": m.prompt_tokens_total,
+                    "completion_tokens_total": m.completion_tokens_total,
+                    # 分位数只看未命中缓存的调用（真实上游延迟）
+                    "latency_p50": upstream.quantile(0.5),
+                    "latency_p95": upstream.quantile(0.95),
+                    "latency_avg": round(upstream.sum / upstream.count, 4) if upstream.count else 0.0,
+                    "latency": {cache: h.to_dict() for cache, h in m.latency.items()},
+                    "prompt_tokens": m.prompt_tokens.to_dict(),
+                    "completion_tokens": m.completion_tokens.to_dict(),
+                }
+            return {"started_at": self.started_at, "exported_at": time.time(), "sites": sites}
+
+    def render_prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+
+        def histogram(name, help_text, attr):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for site, m in sorted(self._sites.items()):
+                value = getattr(m, attr)
+                # latency 按 cache="hit|miss" 分开，其余直方图只有 site 标签
+                series = [(f',cache="{c}"', h) for c, h in value.items()] if isinstance(value, dict) else [("", value)]
+                for extra, h in series:
+                    labels = f'site="{site}"{extra}'
+                    cumulative = h.cumulative()
+                    for upper, c in zip(h.buckets, cumulative):
+                        lines.append(f'{name}_bucket{{{labels},le="{upper}"}} {c}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative[-1]}')
+                    lines.append(f'{name}_sum{{{labels}}} {h.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {h.count}')
+
+        def counter(name, help_text, getter):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for site, m in sorted(self._sites.items()):
+                lines.append(f'{name}{{site="{site}"}} {getter(m)}')
+
+        with self._lock:
+            counter("worldweaver_llm_calls_total", "LLM calls per call site.", lambda m: m.calls)
+            counter("worldweaver_llm_cache_hits_total", "LLM calls served from the response cache.",
+                    lambda m: m.cache_hits)
+            counter("worldweaver_llm_prompt_tokens_total", "Prompt tokens reported by the API.",
+                    lambda m: m.prompt_tokens_total)
+            counter("worldweaver_llm_completion_tokens_total", "Completion tokens reported by the API.",
+                    lambda m: m.completion_tokens_total)
+
+            lines.append("# HELP worldweaver_llm_errors_total Failed LLM calls by error kind.")
+            lines.append("# TYPE worldweaver_llm_errors_total counter")
+            for site, m in sorted(self._sites.items()):
+                for kind, c in sorted(m.errors.items()):
+                    lines.append(f'worldweaver_llm_errors_total{{site="{site}",kind="{kind}"}} {c}')
+
+            histogram("worldweaver_llm_latency_seconds", "LLM call wall time, split by response cache hit/miss.",
+                      "latency")
+            histogram("worldweaver_llm_prompt_tokens", "Prompt tokens per call.", "prompt_tokens")
+            histogram("worldweaver_llm_completion_tokens", "Completion tokens per call.", "completion_tokens")
+
+        return "\n".join(lines) + "\n"
+
+
+# 进程级单例
+metrics = MetricsRegistry()
+
+
+def record_llm_call(site, latency, usage=None, error=None, cached=False):
+    metrics.record(site, latency, usage=usage, error=error, cached=cached)
+
+
+# ---------------------------
+# HTTP 端点
+# ---------------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+            ctype = "application/json; charset=utf-8"
+        elif self.path.startswith("/metrics"):
+            body = metrics.render_prometheus().encode("utf-8")
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host=LLM_METRICS_HOST):
+    """
+    启动 /metrics 端点（幂等）。port 为空时读取 LLM_METRICS_PORT，未配置则不启动。
+    端口被占用（例如同机多个 worker）时静默跳过，返回 None
+    """
+    global _server
+    port = port or LLM_METRICS_PORT
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            except OSError:
+                return None
+            threading.Thread(target=_server.serve_forever, name="llm-metrics", daemon=True).start()
+    return _server
+
+
+def format_table(snapshot):
+    rows = [("site", "calls", "cache", "errors", "p50 s", "p95 s", "avg s", "prompt tok", "compl tok")]
+    for site, m in snapshot["sites"].items():
+        rows.append((
+            site, m["calls"], m["cache_hits"], sum(m["errors"].values()),
+            m["latency_p50"], m["latency_p95"], m["latency_avg"],
+            m["prompt_tokens_total"], m["completion_tokens_total"],
+        ))
+    widths = [max(len(str(r[i])) for r in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(str(v).ljust(w) for v, w in zip(r, widths)) for r in rows)
+
+
+if __name__ == "__main__":
+    # python llm_metrics.py dump   [--url http://127.0.0.1:9464]  → 打印各调用点汇总表
+    # python llm_metrics.py export PATH [--url ...]                → 保存 JSON 快照
+    import sys
+    import urllib.request
+
+    args = sys.argv[1:]
+    url = f"http://{LLM_METRICS_HOST}:{LLM_METRICS_PORT or 9464}"
+    if "--url" in args:
+        i = args.index("--url")
+        url = args[i + 1]
+        del args[i:i + 2]
+
+    with urllib.request.urlopen(url.rstrip("/") + "/metrics.json") as resp:
+        snap = json.loads(resp.read().decode("utf-8"))
+
+    if args and args[0] == "export":
+        path = args[1] if len(args) > 1 else "llm_metrics.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(snap, f, ensure_ascii=False, indent=2)
+        print(f"saved {path}")
+    else:
+        print(format_table(snap))
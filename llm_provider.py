@@ -0,0 +1,525 @@
+# llm_provider.py
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+
+try:
+    from openai import AsyncOpenAI
+except ImportError:
+    AsyncOpenAI = None
+
+# ---------------------------
+# 配置（环境变量可覆盖）
+# ---------------------------
+# live   : 直接调用 OpenAI（默认）
+# record : 调用 OpenAI，同时把请求 / 响应写进回放库
+# replay : 不联网，按 prompt hash 从回放库取响应；取不到时走 LLM_REPLAY_FALLBACK
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "live").lower()
+LLM_REPLAY_PATH = os.getenv("LLM_REPLAY_PATH", "llm_replay.db")
+# 回放延迟（毫秒）："0" / "300" / "200-800"（均匀分布）/ "recorded"（用录制时的耗时）
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0")
+# 回放时 "recorded" 延迟的缩放系数（0.1 = 快十倍）
+LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "1.0"))
+# 未命中时依次尝试：site（同调用点的其他录制结果）、fake（假数据生成器）；留空 = 直接返回错误
+LLM_REPLAY_FALLBACK = os.getenv("LLM_REPLAY_FALLBACK", "site,fake")
+# 流式回放每段的字符数
+LLM_REPLAY_CHUNK_CHARS = int(os.getenv("LLM_REPLAY_CHUNK_CHARS", "8"))
+
+PROVIDER_MODES = ("live", "record", "replay")
+
+
+def needs_api_key(mode=LLM_PROVIDER):
+    return mode != "replay"
+
+
+def replay_key(system_prompt, user_prompt):
+    """
+    回放库的 key：空白归一化后的 system + user 的 sha256。
+    不含 model / 采样参数，gpt_log.txt 里的旧记录也能对上
+    """
+    norm = lambda s: " ".join((s or "").split())
+    raw = (norm(system_prompt) + "\x00" + norm(user_prompt)).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _usage_of(obj):
+    """OpenAI usage 对象 / dict → 可 JSON 序列化的 dict"""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj
+    return {k: getattr(obj, k, None) for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+
+# ---------------------------
+# 回放库（SQLite，按 key / site 建索引）
+# ---------------------------
+class ReplayStore:
+    """
+    一条记录 = 一次成功的调用。同一个 key 可以有多条（同一 prompt 录了多次），
+    回放时取最新的一条。线程安全；第一次用到时才建库
+    """
+
+    def __init__(self, path=LLM_REPLAY_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_records (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    site TEXT,
+                    model TEXT,
+                    system_prompt TEXT NOT NULL,
+                    user_prompt TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    latency REAL,
+                    usage TEXT,
+                    source TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_records_key ON llm_records (key)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_records_site ON llm_records (site)")
+            self._conn.commit()
+        return self._conn
+
+    def put(self, system_prompt, user_prompt, output, site=None, model=None,
+            latency=None, usage=None, source="record"):
+        return self.put_many([(system_prompt, user_prompt, output, site, model, latency, usage, source)])
+
+    def put_many(self, rows):
+        """rows: (system, user, output, site, model, latency, usage, source)；返回写入条数"""
+        now = time.time()
+        values = [
+            (replay_key(s, u), site, model, s, u, out, latency,
+             json.dumps(_usage_of(usage)) if usage is not None else None, source, now)
+            for s, u, out, site, model, latency, usage, source in rows
+        ]
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                "INSERT INTO llm_records (key, site, model, system_prompt, user_prompt, output, "
+                "latency, usage, source, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                values
+            )
+            db.commit()
+        return len(values)
+
+    def get(self, key):
+        """按 prompt hash 精确取最新一条：(output, latency, usage) 或 None"""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT output, latency, usage FROM llm_records WHERE key = ? ORDER BY id DESC LIMIT 1",
+                (key,)
+            ).fetchone()
+        return self._row(row)
+
+    def pick_by_site(self, site, key):
+        """
+        精确未命中时：同一调用点的录制结果里按 key 稳定地挑一条
+        （同一 prompt 每次回放拿到同一条，输出长度 / 结构与真实调用一致）
+        """
+        if not site:
+            return None
+        with self._lock:
+            db = self._db()
+            count = db.execute("SELECT COUNT(*) FROM llm_records WHERE site = ?", (site,)).fetchone()[0]
+            if not count:
+                return None
+            row = db.execute(
+                "SELECT output, latency, usage FROM llm_records WHERE site = ? ORDER BY id LIMIT 1 OFFSET ?",
+                (site, int(key[:8], 16) % count)
+            ).fetchone()
+        return self._row(row)
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        output, latency, usage = row
+        return output, latency, json.loads(usage) if usage else None
+
+    def stats(self):
+        with self._lock:
+            db = self._db()
+            total = db.execute("SELECT COUNT(*) FROM llm_records").fetchone()[0]
+            keys = db.execute("SELECT COUNT(DISTINCT key) FROM llm_records").fetchone()[0]
+            by_site = dict(db.execute(
+                "SELECT COALESCE(site, '?'), COUNT(*) FROM llm_records GROUP BY site ORDER BY COUNT(*) DESC"
+            ).fetchall())
+            by_source = dict(db.execute(
+                "SELECT source, COUNT(*) FROM llm_records GROUP BY source"
+            ).fetchall())
+        return {"records": total, "distinct_prompts": keys, "by_site": by_site, "by_source": by_source}
+
+
+# ---------------------------
+# gpt_log.txt 导入
+# ---------------------------
+_CALL_HEADER = "==================== NEW CALL ===================="
+_SECTIONS = {
+    "=== SYSTEM PROMPT ===": "system",
+    "=== USER PROMPT ===": "user",
+    "=== GPT RAW OUTPUT ===": "output",
+}
+_BLOCK_END = re.compile(r"^={20,}$")
+
+
+def parse_gpt_log(lines):
+    """
+    逐行解析旧的 gpt_log.txt，产出 {"system", "user", "output"}。
+    其他类型的块（HEALTH CHANGE 等）和没有输出的残缺块直接跳过
+    """
+    call, section, buf = None, None, []
+
+    def flush():
+        if call is not None and section is not None:
+            call[section] = "".join(buf).strip("\n")
+
+    for line in lines:
+        stripped = line.rstrip("\r\n")
+        if stripped == _CALL_HEADER or (_BLOCK_END.match(stripped) and section is not None):
+            flush()
+            if call and "output" in call and "user" in call:
+                yield call
+            call = {} if stripped == _CALL_HEADER else None
+            section, buf = None, []
+        elif call is not None and stripped in _SECTIONS:
+            flush()
+            section, buf = _SECTIONS[stripped], []
+        elif section is not None:
+            buf.append(line)
+    flush()
+    if call and "output" in call and "user" in call:
+        yield call
+
+
+def infer_site(system_prompt, user_prompt):
+    """旧日志没有调用点标签：按 prompt 特征猜（与 call_gpt 的 site 命名一致）"""
+    s, u = system_prompt or "", user_prompt or ""
+    if "TTRPG world designer" in s:
+        if "剧情节点" in u:
+            return "world.nodes"
+        if "主线任务" in u:
+            return "world.quest"
+        if "玩家角色" in u:
+            return "world.player"
+        return "world.base"
+    if "动作意图分析器" in s:
+        return "parse_action"
+    if "chronicler" in s:
+        return "summary.rolling"
+    if "state machine" in s:
+        return "event"
+    if "Dungeon Master" in s:
+        return "opening_scene" if "开场" in s + u else "node_round"
+    return None
+
+
+def import_gpt_log(path="gpt_log.txt", store=None):
+    """把 gpt_log.txt 里的调用写进回放库，返回导入条数"""
+    store = store or replay_store
+    with open(path, encoding="utf-8") as f:
+        rows = [
+            (c.get("system", ""), c["user"], c["output"], infer_site(c.get("system"), c["user"]),
+             None, None, None, "gpt_log")
+            for c in parse_gpt_log(f)
+            if c["output"].strip()
+        ]
+    return store.put_many(rows) if rows else 0
+
+
+# ---------------------------
+# 假数据生成器（回放未命中时使用）
+# ---------------------------
+def _fake_world(rng, zh):
+    names = ["灰烬镇", "月影森林", "旧王陵"] if zh else ["Ashford", "Moonshade Wood", "Old Barrow"]
+    chars = (["艾琳", "城门守卫"], ["卡洛", "流浪商人"], ["莫尔", "黑塔法师"]) if zh else \
+        (["Elin", "Gate guard"], ["Carlo", "Travelling merchant"], ["Mor", "Tower wizard"])
+    return {
+        "title": ("回放世界 #%d" if zh else "Replay World #%d") % rng.randint(1, 999),
+        "summary": "一个用于离线测试的世界。" if zh else "A world generated for offline testing.",
+        "initial_hook": "镇上有人失踪了。" if zh else "Someone in town has gone missing.",
+        "locations": [{"name": n, "description": n, "tags": ["test"], "danger": rng.randint(0, 5)}
+                      for n in names],
+        "characters": [{"name": n, "role": r, "short_desc": r,
+                        "stats": {"trust": 0, "fear": 0, "health": 100, "custom": {}}}
+                       for n, r in chars],
+        "world_logic": {"allow_magic": True, "tech_level": "medieval", "energy_system": "",
+                        "physics_rules": "", "culture": "", "world_type": "forest"},
+        "initial_state": {"tension": 10, "magic_density": 5, "corruption": 2, "radiation": 0},
+    }
+
+
+def _fake_nodes(zh):
+    chain = ["setup", "first_clue", "twist", "crisis", "pre_finale", "finale"]
+    return {
+        node: {
+            "summary": (f"节点 {node} 的剧情。" if zh else f"Story beat for {node}."),
+            "options": [] if node == "finale" else
+            [{"text": "继续" if zh else "Continue", "goto": chain[i + 1]}],
+        }
+        for i, node in enumerate(chain)
+    }
+
+
+def _fake_player(zh):
+    return {
+        "player_profile": {"name": "测试旅人" if zh else "Test Wanderer", "background": "",
+                           "profession": "wanderer", "role_in_world": "outsider",
+                           "traits": ["curious"], "weakness": ["naive"]},
+        "player_stats": {"health": 100, "sanity": 80, "mana": 0, "custom": {"力量": 5, "敏捷": 5, "智力": 5}},
+    }
+
+
+def _fake_scene(zh, options=True):
+    if zh:
+        text = "雾气笼罩着小镇，远处传来钟声。一个身影在巷口停下，似乎在等你开口。"
+        opts = ["1. 调查巷口的痕迹", "2. 上前与那人交谈", "3. 前往钟楼"]
+    else:
+        text = ("Fog hangs over the town and a bell tolls in the distance. "
+                "A figure pauses at the mouth of the alley, waiting for you to speak.")
+        opts = ["1. Examine the tracks in the alley", "2. Talk to the stranger", "3. Head to the bell tower"]
+    return text + ("\n\n" + "\n".join(opts) if options else "")
+
+
+def fake_response(site, system_prompt, user_prompt, seed=None):
+    """
+    按调用点给出结构合法的假输出（JSON 能被 extract_json 解析、选项能被 extract_options 提取），
+    同一 prompt 总是得到同一结果
+    """
+    rng = random.Random(seed if seed is not None else replay_key(system_prompt, user_prompt))
+    zh = "English" not in (user_prompt or "")
+    site = site or infer_site(system_prompt, user_prompt)
+    dump = lambda obj: json.dumps(obj, ensure_ascii=False)
+
+    if site == "world.base":
+        return dump(_fake_world(rng, zh))
+    if site == "world.quest":
+        return "找到失踪者并查明真相。" if zh else "Find the missing and uncover the truth."
+    if site == "world.nodes":
+        return dump(_fake_nodes(zh))
+    if site == "world.player":
+        return dump(_fake_player(zh))
+    if site == "parse_action":
+        return dump({"action_type": rng.choice(["exploration", "social", "move"]),
+                     "target": "", "intent": "调查" if zh else "investigate", "topic": "", "risk": "low"})
+    if site in ("summary", "summary.rolling"):
+        return "到目前为止，玩家在小镇里追查失踪案。" if zh else "So far the player has been chasing a disappearance."
+    if site == "node_round":
+        return _fake_scene(zh, options=False)
+    return _fake_scene(zh)
+
+
+# ---------------------------
+# Provider：同一接口，三种实现
+# ---------------------------
+class ReplayMiss(LookupError):
+    """回放库里没有该 prompt，且 LLM_REPLAY_FALLBACK 不允许兜底"""
+    status_code = 404     # llm_resilience 归为 client 错误，不重试、不计入熔断
+
+
+class LiveProvider:
+    """
+    complete() → (文本, usage)；stream() 逐段 yield 文本，usage 写进 meta。
+    只在 LLM 事件循环线程里创建（AsyncOpenAI 绑定所在的事件循环）
+    """
+    mode = "live"
+
+    def __init__(self, api_key, model):
+        if AsyncOpenAI is None:
+            raise RuntimeError("live / record 模式需要 openai：pip install openai")
+        self.model = model
+        # 重试交给 llm_resilience，客户端自身不再重试
+        self.client = AsyncOpenAI(api_key=api_key, max_retries=0)
+
+    def _messages(self, system_prompt, user_prompt):
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    async def complete(self, system_prompt, user_prompt, temperature, max_tokens, site=None):
+        completion = await self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(system_prompt, user_prompt),
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return completion.choices[0].message.content.strip(), getattr(completion, "usage", None)
+
+    async def open_stream(self, system_prompt, user_prompt, temperature, max_tokens, site=None):
+        """建立流（可重试的部分），返回 chunk 的异步迭代器"""
+        return await self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(system_prompt, user_prompt),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+    async def iter_stream(self, stream, meta=None, **context):
+        async for chunk in stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None and meta is not None:
+                meta["usage"] = usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+
+class RecordProvider(LiveProvider):
+    """在线调用，成功的结果同时写进回放库（写库放到线程池，不阻塞事件循环）"""
+    mode = "record"
+
+    def __init__(self, api_key, model, store=None):
+        super().__init__(api_key, model)
+        self.store = store or replay_store
+
+    async def _save(self, system_prompt, user_prompt, output, site, latency, usage):
+        await asyncio.to_thread(self.store.put, system_prompt, user_prompt, output,
+                                site, self.model, latency, usage, "record")
+
+    async def complete(self, system_prompt, user_prompt, temperature, max_tokens, site=None):
+        t0 = time.perf_counter()
+        text, usage = await super().complete(system_prompt, user_prompt, temperature, max_tokens, site)
+        await self._save(system_prompt, user_prompt, text, site, time.perf_counter() - t0, usage)
+        return text, usage
+
+    async def iter_stream(self, stream, meta=None, system_prompt="", user_prompt="", site=None, **context):
+        t0 = time.perf_counter()
+        meta = {} if meta is None else meta
+        parts = []
+        async for delta in super().iter_stream(stream, meta):
+            parts.append(delta)
+            yield delta
+        text = "".join(parts).strip()
+        if text:
+            await self._save(system_prompt, user_prompt, text, site, time.perf_counter() - t0,
+                             meta.get("usage"))
+
+
+def _parse_latency(spec):
+    spec = (spec or "0").strip().lower()
+    if spec == "recorded":
+        return "recorded"
+    if "-" in spec:
+        lo, hi = spec.split("-", 1)
+        return float(lo) / 1000, float(hi) / 1000
+    return float(spec) / 1000, float(spec) / 1000
+
+
+class ReplayProvider:
+    """离线：按 prompt hash 取录制结果，按配置模拟延迟；不需要 API key"""
+    mode = "replay"
+
+    def __init__(self, store=None, latency=LLM_REPLAY_LATENCY, fallback=LLM_REPLAY_FALLBACK,
+                 speed=LLM_REPLAY_SPEED, chunk_chars=LLM_REPLAY_CHUNK_CHARS, model=None):
+        self.store = store or replay_store
+        self.latency = _parse_latency(latency)
+        self.fallback = [f.strip() for f in fallback.split(",") if f.strip()]
+        self.speed = speed
+        self.chunk_chars = max(1, chunk_chars)
+        self.model = model
+        self.counters = {"hits": 0, "site_hits": 0, "fake": 0, "misses": 0}
+
+    def lookup(self, system_prompt, user_prompt, site=None):
+        """(文本, 录制耗时, usage)；精确命中 → 同调用点 → 假数据"""
+        key = replay_key(system_prompt, user_prompt)
+        found = self.store.get(key)
+        if found is not None:
+            self.counters["hits"] += 1
+            return found
+        for fallback in self.fallback:
+            if fallback == "site":
+                found = self.store.pick_by_site(site or infer_site(system_prompt, user_prompt), key)
+                if found is not None:
+                    self.counters["site_hits"] += 1
+                    return found
+            elif fallback == "fake":
+                self.counters["fake"] += 1
+                return fake_response(site, system_prompt, user_prompt), None, None
+        self.counters["misses"] += 1
+        raise ReplayMiss(f"no recorded response for prompt {key[:16]}")
+
+    def _delay(self, recorded):
+        if self.latency == "recorded":
+            return (recorded or 0.0) * self.speed
+        lo, hi = self.latency
+        return random.uniform(lo, hi)
+
+    @staticmethod
+    def _usage(usage, system_prompt, user_prompt, text):
+        if usage:
+            return SimpleNamespace(**usage)
+        # 没有录到 usage 时按 ~4 字符 / token 粗估，保证指标里有数
+        return SimpleNamespace(prompt_tokens=(len(system_prompt) + len(user_prompt)) // 4,
+                               completion_tokens=len(text) // 4, total_tokens=None)
+
+    async def complete(self, system_prompt, user_prompt, temperature, max_tokens, site=None):
+        text, recorded, usage = await asyncio.to_thread(self.lookup, system_prompt, user_prompt, site)
+        delay = self._delay(recorded)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return text, self._usage(usage, system_prompt, user_prompt, text)
+
+    async def open_stream(self, system_prompt, user_prompt, temperature, max_tokens, site=None):
+        return await asyncio.to_thread(self.lookup, system_prompt, user_prompt, site)
+
+    async def iter_stream(self, stream, meta=None, system_prompt="", user_prompt="", **context):
+        text, recorded, usage = stream
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or [""]
+        # 总延迟的 30% 当作首 token 时间，其余平均摊到每一段
+        delay = self._delay(recorded)
+        if delay > 0:
+            await asyncio.sleep(delay * 0.3)
+        step = delay * 0.7 / len(chunks)
+        for chunk in chunks:
+            if step > 0:
+                await asyncio.sleep(step)
+            if chunk:
+                yield chunk
+        if meta is not None:
+            meta["usage"] = self._usage(usage, system_prompt, user_prompt, text)
+
+
+def make_provider(mode=LLM_PROVIDER, api_key=None, model=None, store=None):
+    if mode == "live":
+        return LiveProvider(api_key, model)
+    if mode == "record":
+        return RecordProvider(api_key, model, store)
+    if mode == "replay":
+        return ReplayProvider(store, model=model)
+    raise ValueError(f"LLM_PROVIDER 必须是 {' / '.join(PROVIDER_MODES)}，收到 {mode!r}")
+
+
+# 进程级单例（record / replay 共用）
+replay_store = ReplayStore()
+
+
+if __name__ == "__main__":
+    # python llm_provider.py import [gpt_log.txt] | stats
+    import sys
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if cmd == "import":
+        path = sys.argv[2] if len(sys.argv) > 2 else "gpt_log.txt"
+        print(f"imported {import_gpt_log(path)} calls from {path} into {replay_store.path}")
+    print(json.dumps(replay_store.stats(), ensure_ascii=False, indent=2))
@@ -0,0 +1,232 @@
+# llm_resilience.py
+import os
+import time
+import random
+import asyncio
+import threading
+
+# ---------------------------
+# 配置（环境变量可覆盖）
+# ---------------------------
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "60"))               # 单次 call_gpt 总时限（秒，含排队与重试）
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "30"))  # 单次尝试时限（秒）
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))  # 连续失败多少次后熔断
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))       # 熔断多久后放一个试探请求
+
+
+# ---------------------------
+# 类型化的错误结果
+# ---------------------------
+class GPTError(str):
+    """
+    GPT 调用失败时的返回值。
+    仍然是 str（内容为 "(Error calling GPT: ...)"），旧代码照常当文本处理；
+    新代码用 is_gpt_error() 分支，并可读取 kind / retryable。
+    kind: timeout | queue_timeout | rate_limit | server | connection | circuit_open | client | unknown
+    """
+
+    def __new__(cls, message, kind="unknown", retryable=False):
+        obj = super().__new__(cls, f"(Error calling GPT: {message})")
+        obj.kind = kind
+        obj.retryable = retryable
+        return obj
+
+
+def is_gpt_error(value):
+    return isinstance(value, GPTError)
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求未发出"""
+
+
+class QueueTimeoutError(Exception):
+    """在本地并发槽位上排队超过总时限，请求未发出（不计入熔断）"""
+
+
+def classify_error(exc):
+    """异常 → (kind, retryable)。429 / 5xx / 超时 / 连接错误可以重试"""
+    if isinstance(exc, CircuitOpenError):
+        return "circuit_open", False
+    if isinstance(exc, QueueTimeoutError):
+        return "queue_timeout", False
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return "timeout", True
+
+    name = type(exc).__name__
+    status = getattr(exc, "status_code", None)
+    if status == 429 or name == "RateLimitError":
+        return "rate_limit", True
+    if (status is not None and status >= 500) or name == "InternalServerError":
+        return "server", True
+    if name == "APITimeoutError":
+        return "timeout", True
+    if name == "APIConnectionError":
+        return "connection", True
+    if status is not None:
+        return "client", False
+    return "unknown", False
+
+
+def gpt_error(exc):
+    kind, retryable = classify_error(exc)
+    message = str(exc) or kind
+    if kind == "timeout" and not str(exc):
+        message = "timeout"
+    return GPTError(message, kind=kind, retryable=retryable)
+
+
+# ---------------------------
+# 熔断器
+# ---------------------------
+class CircuitBreaker:
+    """
+    closed → 连续失败达到阈值 → open（直接失败，不再请求上游）
+    open → 超过 reset 时间 → half_open（只放行一个试探请求）
+    试探成功 → closed；失败 → 重新 open
+    """
+
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, reset_after=LLM_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """放行返回 True 表示本次是 half_open 的试探请求（调用方被取消时要 release_probe）"""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_after:
+                    raise CircuitOpenError("upstream degraded, circuit open")
+                self.state = "half_open"
+                self._probe_in_flight = False
+
+            if self.state == "half_open":
+                if self._probe_in_flight:
+                    raise CircuitOpenError("upstream degraded, probe in flight")
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def release_probe(self):
+        """试探请求被取消、没有结果：放弃这次试探，保持 half_open，下一个请求重新试探"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+# ---------------------------
+# 重试策略
+# ---------------------------
+class RetryPolicy:
+    def __init__(self, max_attempts=LLM_MAX_ATTEMPTS, deadline=LLM_DEADLINE,
+                 attempt_timeout=LLM_ATTEMPT_TIMEOUT,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX):
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def backoff(self, attempt):
+        # 指数退避 + full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+async def _acquire_slot(limiter, end):
+    """在总时限内等待一个并发槽位"""
+    remaining = end - time.monotonic()
+    try:
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        await asyncio.wait_for(limiter.acquire(), timeout=remaining)
+    except asyncio.TimeoutError:
+        raise QueueTimeoutError("timed out waiting for a local request slot") from None
+
+
+async def call_with_policy(attempt_fn, policy, breaker, deadline=None, limiter=None, hold=False):
+    """
+    执行 attempt_fn()（返回协程），按 policy 重试，按 breaker 熔断。
+    deadline：本次调用总时限（秒），None 使用 policy.deadline。
+    limiter：可选的 asyncio.Semaphore（进程级并发上限）。每次尝试前获取、尝试结束即释放，
+      退避等待期间不占用；排队时间只受总时限约束，不算进单次尝试的超时，
+      排队超时抛 QueueTimeoutError，不计入熔断。
+    hold=True：成功时不释放槽位，由调用方在用完结果（例如读完流）后 limiter.release()。
+    全部失败时抛出最后一个异常。
+    """
+    deadline = policy.deadline if deadline is None else deadline
+    end = time.monotonic() + deadline
+    attempt = 0
+
+    while True:
+        if limiter is not None:
+            await _acquire_slot(limiter, end)
+            if end - time.monotonic() <= 0:
+                limiter.release()
+                raise QueueTimeoutError("timed out waiting for a local request slot")
+        try:
+            probe = breaker.before_call()
+        except CircuitOpenError:
+            if limiter is not None:
+                limiter.release()
+            raise
+        remaining = end - time.monotonic()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            result = await asyncio.wait_for(attempt_fn(), timeout=min(policy.attempt_timeout, remaining))
+        except BaseException as e:
+            if limiter is not None:
+                limiter.release()
+            if not isinstance(e, Exception):
+                # CancelledError 等：不计成败，但试探名额必须归还，否则熔断器永远卡在 "probe in flight"
+                if probe:
+                    breaker.release_probe()
+                raise
+            _, retryable = classify_error(e)
+            if retryable:
+                breaker.record_failure()
+            else:
+                # 4xx 之类说明上游可达，不计入熔断
+                breaker.record_success()
+            attempt += 1
+            if not retryable or attempt >= policy.max_attempts:
+                raise
+            delay = policy.backoff(attempt - 1)
+            if time.monotonic() + delay >= end:
+                raise
+            await asyncio.sleep(delay)
+            continue
+
+        breaker.record_success()
+        if limiter is not None and not hold:
+            limiter.release()
+        return result
+
+
+# 进程级默认实例（llm.py 使用）
+retry_policy = RetryPolicy()
+circuit_breaker = CircuitBreaker()
@@ -0,0 +1,217 @@
+# pacing_sim.py
+"""
+离线节奏模拟器：用 NumPy 一次跑几十万局“合成冒险”，逐回合复现 AdventureManager 的推进规则，不调用 LLM：
+第 1 回合是开场；之后每回合先处理节点跳转，再按 NODE_ROUND_LIMIT 给普通回合 / 跳转选项，
+回合结束时 tick（主线 3~8%、章节阈值、世界状态 -2~+3 波动）；走到 finale 节点的那一回合结束。
+规则常量都来自 world_tick（与游戏共用）。
+
+    python pacing_sim.py --runs 200000
+    python pacing_sim.py --progress 2 6 --thresholds 10 30 60 80 100 --json out.json
+    python pacing_sim.py --jump-p 0.6     # 玩家只有 60% 的概率选择剧情跳转选项
+"""
+import json
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import world_tick
+
+# 剧情节点链（与 world.py 生成的 6 个节点一致）
+NODE_CHAIN = ("setup", "first_clue", "twist", "crisis", "pre_finale", "finale")
+DEFAULT_WORLD_STATE = {"tension": 10, "magic_density": 5, "corruption": 0, "radiation": 0}
+PERCENTILES = (5, 25, 50, 75, 95)
+MAX_ROUNDS = 500                          # 玩家一直不选跳转时的截断回合数
+
+
+def simulate(runs=100_000, seed=0,
+             progress=(world_tick.PROGRESS_MIN, world_tick.PROGRESS_MAX),
+             thresholds=world_tick.CHAPTER_THRESHOLDS,
+             drift=(world_tick.DRIFT_MIN, world_tick.DRIFT_MAX),
+             world_state=None, node_round_limit=world_tick.NODE_ROUND_LIMIT,
+             jump_p=1.0, nodes=len(NODE_CHAIN), max_rounds=MAX_ROUNDS):
+    """
+    节点推进与主线进度一起逐回合模拟。返回原始数组：
+    rounds[runs]                  到达 finale（游戏结束）的回合号，截断的局为 0
+    progress_final[runs]          结束时的主线进度
+    progress_full_at[runs]        主线进度到 100 的回合号，没到为 0
+    dwell[runs, chapters]         每章停留回合数（只算节点回合）
+    state_max / state_min / state_final[runs, keys]
+    """
+    if np is None:
+        raise RuntimeError("pacing_sim 需要 numpy：pip install numpy")
+    p_min, p_max = progress
+    if p_min <= 0 or p_max < p_min:
+        raise ValueError(f"progress range must satisfy 0 < min <= max, got {progress}")
+
+    rng = np.random.default_rng(seed)
+    d_min, d_max = drift
+    thresholds = np.asarray(thresholds)
+    chapters = len(thresholds) + 1
+    world_state = dict(world_state or DEFAULT_WORLD_STATE)
+    keys = [k for k in world_tick.DRIFT_KEYS if k in world_state]
+    finale = nodes - 1
+
+    prog = np.zeros(runs, dtype=np.int32)
+    full_at = np.zeros(runs, dtype=np.int32)
+    ended_at = np.zeros(runs, dtype=np.int32)           # 0 = 还没到 finale
+    node = np.zeros(runs, dtype=np.int32)               # adventure_state["current_node"] 在链上的下标
+    node_round = np.zeros(runs, dtype=np.int32)         # adventure_state["node_round_count"]
+    ready = np.zeros(runs, dtype=bool)                  # adventure_state["ready_for_node_jump"]
+    dwell = np.zeros((runs, chapters), dtype=np.int32)
+    ws = np.tile(np.array([world_state[k] for k in keys], dtype=np.int32), (runs, 1))
+    ws_max = ws.copy()
+    ws_min = ws.copy()
+
+    rows = np.arange(runs)
+    # 第 1 回合是开场（不 tick），节点回合从第 2 回合开始，回合号 = len(history)
+    for round_no in range(2, max_rounds + 1):
+        active = ended_at == 0
+        if not active.any():
+            break
+
+        # _enter_node：上回合给了跳转选项，且玩家选了其中之一 → 进入下一个节点
+        jump = active & ready & (rng.random(runs) < jump_p)
+        node = np.where(jump, np.minimum(node + 1, finale), node)
+        node_round = np.where(jump, 0, node_round)
+        ready &= ~jump
+
+        # 本回合所在章节计入停留时间（按推进前的进度）
+        chapter = np.searchsorted(thresholds, prog, side="right")
+        np.add.at(dwell, (rows[active], chapter[active]), 1)
+
+        # _close_round：finale 节点这一回合结束游戏；其余节点先走普通回合，用完后给跳转选项
+        at_finale = active & (node == finale)
+        normal = active & ~at_finale & (node_round < node_round_limit)
+        node_round = np.where(normal, node_round + 1, node_round)
+        ready |= active & ~at_finale & ~normal
+
+        # tick_world：每个成功的节点回合结束后（含 finale 回合）
+        step = rng.integers(d_min, d_max + 1, size=ws.shape, dtype=np.int32)
+        ws = np.where(active[:, None], np.clip(ws + step, world_tick.STAT_MIN, world_tick.STAT_MAX), ws)
+        np.maximum(ws_max, ws, out=ws_max)
+        np.minimum(ws_min, ws, out=ws_min)
+
+        inc = rng.integers(p_min, p_max + 1, size=runs, dtype=np.int32)
+        prog = np.where(active, np.minimum(100, prog + inc), prog)
+        full_at[active & (prog >= 100) & (full_at == 0)] = round_no
+        ended_at[at_finale] = round_no
+
+    return {
+        "rounds": ended_at,
+        "progress_final": prog,
+        "progress_full_at": full_at,
+        "dwell": dwell,
+        "keys": keys,
+        "state_max": ws_max,
+        "state_min": ws_min,
+        "state_final": ws,
+        "thresholds": [int(t) for t in thresholds],
+    }
+
+
+def _dist(values):
+    values = np.asarray(values)
+    out = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+    out["mean"] = round(float(values.mean()), 2)
+    out["min"] = int(values.min())
+    out["max"] = int(values.max())
+    return out
+
+
+def summarize(result):
+    rounds = result["rounds"]
+    finished = rounds > 0
+    full_at = result["progress_full_at"]
+    final_chapter = np.searchsorted(np.asarray(result["thresholds"]), result["progress_final"], side="right")
+    report = {
+        "runs": int(rounds.size),
+        "unfinished": round(float((~finished).mean()), 4),
+        "rounds_to_finale": _dist(rounds[finished]) if finished.any() else None,
+        "progress_at_finale": _dist(result["progress_final"][finished]) if finished.any() else None,
+        # 主线进度先到 100（章节已是最终章，但节点还没到 finale）/ 节点先到 finale（进度还没满）
+        "progress_before_nodes": round(float((finished & (full_at > 0) & (full_at < rounds)).mean()), 4),
+        "nodes_before_progress": round(float((finished & (full_at == 0)).mean()), 4),
+        "chapter_at_finale": {f"chapter_{c}": round(float((final_chapter[finished] == c).mean()), 4)
+                              for c in range(result["dwell"].shape[1])} if finished.any() else {},
+        "chapter_dwell": {f"chapter_{c}": _dist(result["dwell"][:, c])
+                          for c in range(result["dwell"].shape[1] - 1)},
+        "world_state": {},
+    }
+    for i, key in enumerate(result["keys"]):
+        report["world_state"][key] = {
+            "max": _dist(result["state_max"][:, i]),
+            "min": _dist(result["state_min"][:, i]),
+            "final": _dist(result["state_final"][:, i]),
+            "hit_cap": round(float((result["state_max"][:, i] >= world_tick.STAT_MAX).mean()), 4),
+        }
+    return report
+
+
+def format_report(report):
+    lines = [f"runs: {report['runs']}  (unfinished after {MAX_ROUNDS} rounds: {report['unfinished']:.1%})"]
+
+    def row(label, d):
+        return (f"  {label:<22} " + " ".join(f"p{p}={d[f'p{p}']:<6g}" for p in PERCENTILES)
+                + f" mean={d['mean']:<6g} max={d['max']}")
+
+    if report["rounds_to_finale"]:
+        lines.append("finale (node chain):")
+        lines.append(row("rounds", report["rounds_to_finale"]))
+        lines.append(row("progress %", report["progress_at_finale"]))
+        lines.append(f"  progress hits 100 first in {report['progress_before_nodes']:.1%}, "
+                     f"finale with progress < 100 in {report['nodes_before_progress']:.1%}")
+        lines.append("  chapter at finale: " + " ".join(f"{k}={v:.1%}" for k, v in report["chapter_at_finale"].items()))
+    lines.append("chapter dwell (rounds):")
+    for name, d in report["chapter_dwell"].items():
+        lines.append(row(name, d))
+    lines.append("world state:")
+    for key, d in report["world_state"].items():
+        lines.append(row(f"{key} max", d["max"]))
+        lines.append(row(f"{key} final", d["final"]))
+        lines.append(f"  {'':<22} reached {world_tick.STAT_MAX}: {d['hit_cap']:.2%}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--progress", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        default=(world_tick.PROGRESS_MIN, world_tick.PROGRESS_MAX))
+    parser.add_argument("--thresholds", type=int, nargs="+", default=list(world_tick.CHAPTER_THRESHOLDS))
+    parser.add_argument("--drift", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        default=(world_tick.DRIFT_MIN, world_tick.DRIFT_MAX))
+    parser.add_argument("--node-rounds", type=int, default=world_tick.NODE_ROUND_LIMIT)
+    parser.add_argument("--jump-p", type=float, default=1.0, help="给出跳转选项时玩家选择跳转的概率")
+    parser.add_argument("--world", help="从世界 JSON 文件读取初始 world_state")
+    parser.add_argument("--json", help="把汇总结果另存为 JSON")
+    args = parser.parse_args()
+
+    if args.progress[0] <= 0 or args.progress[1] < args.progress[0]:
+        parser.error("--progress needs 0 < MIN <= MAX")
+    if args.drift[1] < args.drift[0]:
+        parser.error("--drift needs MIN <= MAX")
+    if args.node_rounds < 0:
+        parser.error("--node-rounds must be >= 0")
+    if not 0 < args.jump_p <= 1:
+        parser.error("--jump-p must be in (0, 1]")
+
+    world_state = None
+    if args.world:
+        with open(args.world, encoding="utf-8") as f:
+            world_state = json.load(f).get("world_state")
+
+    result = simulate(args.runs, args.seed, tuple(args.progress), tuple(args.thresholds),
+                      tuple(args.drift), world_state, args.node_rounds, args.jump_p)
+    report = summarize(result)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# pattern_match.py
+from collections import deque
+
+
+def _is_word_char(ch):
+    return ch.isascii() and (ch.isalnum() or ch == "_")
+
+
+# 词尾允许的英文复数后缀：“king” 命中 “kings”，但不命中 “kingdom”
+_PLURAL_SUFFIXES = ("s", "es")
+
+
+def _word_end(text, end):
+    if end >= len(text) or not _is_word_char(text[end]):
+        return True
+    for suffix in _PLURAL_SUFFIXES:
+        stop = end + len(suffix)
+        if text.startswith(suffix, end) and (stop >= len(text) or not _is_word_char(text[stop])):
+            return True
+    return False
+
+
+class PatternMatcher:
+    """
+    Aho-Corasick 多模式匹配：所有关键词编译成一个自动机，扫描一遍文本
+    就能找出全部命中，耗时与文本长度 + 命中数成正比，与关键词数量无关。
+
+    - 忽略大小写（关键词与文本都转小写）
+    - ASCII 关键词要求两端都是词边界（词尾允许 s / es 复数）：“king” 命中 “kings”，
+      不命中 “kingdom”；“mage” 不命中 “image”
+    - 以 * 结尾的关键词是词干，只要求词首边界：“sorcer*” 命中 “sorcerer” / “sorceress”
+    - 中文关键词不受影响，按子串匹配
+    """
+
+    def __init__(self, patterns=()):
+        self._goto = [{}]          # 状态 → {字符: 下一状态}
+        self._fail = [0]
+        self._out = [[]]           # 状态 → [(关键词长度, payload, 是否要求词首边界, 是否要求词尾边界)]
+        self._compiled = True
+        self.size = 0
+        for pattern, payload in patterns:
+            self.add(pattern, payload)
+
+    def add(self, pattern, payload):
+        pattern = pattern.lower()
+        stem = pattern.endswith("*")
+        if stem:
+            pattern = pattern[:-1]
+        if not pattern:
+            return self
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        word_end = not stem and _is_word_char(pattern[-1])
+        self._out[state].append((len(pattern), payload, _is_word_char(pattern[0]), word_end))
+        self._compiled = False
+        self.size += 1
+        return self
+
+    def compile(self):
+        """BFS 建立失败指针，并把失败链上的输出合并进来"""
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._compiled = True
+        return self
+
+    def iter_matches(self, text):
+        """逐个产出 (start, end, payload)；同一位置可能命中多个关键词"""
+        if not self._compiled:
+            self.compile()
+        if not text:
+            return
+        lowered = text.lower()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(lowered):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, payload, word_start, word_end in out[state]:
+                start = i - length + 1
+                if word_start and start > 0 and _is_word_char(lowered[start - 1]):
+                    continue
+                if word_end and not _word_end(lowered, i + 1):
+                    continue
+                yield start, i + 1, payload
+
+    def find(self, text):
+        """命中的 payload（去重，按首次出现顺序）"""
+        return list(dict.fromkeys(payload for _, _, payload in self.iter_matches(text)))
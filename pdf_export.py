@@ -1,14 +1,41 @@
 # pdf_export.py
+import os
 from io import BytesIO
 import json
+import tempfile
+import threading
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.pdfbase.cidfonts import UnicodeCIDFont
 from reportlab.pdfbase import pdfmetrics
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 import re
 
+PDF_FONT = "STSong-Light"
+
+# ---------------------------
+# 字体与样式：每个进程只初始化一次
+# ---------------------------
+_styles = None
+_styles_lock = threading.Lock()
+
+
+def get_styles():
+    """注册中文字体并构建段落样式（进程内缓存；不修改 reportlab 的样式表）"""
+    global _styles
+    if _styles is None:
+        with _styles_lock:
+            if _styles is None:
+                pdfmetrics.registerFont(UnicodeCIDFont(PDF_FONT))
+                base = getSampleStyleSheet()
+                _styles = {
+                    "normal": ParagraphStyle("ww_normal", parent=base["Normal"], fontName=PDF_FONT),
+                    "title": ParagraphStyle("ww_title", parent=base["Title"], fontName=PDF_FONT),
+                }
+    return _styles
+
+
 # 根据空行和 1./2./3. 分段。
 def split_into_paragraphs(text: str):
     lines = text.split("\n")
@@ -40,18 +67,64 @@ def split_into_paragraphs(text: str):
     return paragraphs
 
 
-# 生成 PDF，返回 BytesIO。
-# world_obj: 世界 JSON dict
-# adventure_history: 冒险记录列表
-# labels: PDF 内部标签（来自 PDF_LABELS）
-def generate_pdf(world_obj, adventure_history, labels, lang_ui):
-    buffer = BytesIO()
+# ---------------------------
+# flowable 生成器：整本书 = 开头部分 + 每回合一段
+# ---------------------------
+def _front_flowables(world_obj, labels, lang_ui, recap, styles):
+    normal = styles["normal"]
+
+    # 标题
+    yield Paragraph(world_obj.get("title", "Untitled World"), styles["title"])
+    yield Spacer(1, 10)
+
+    # 世界简介
+    yield Paragraph(f"<b>{labels['summary'][lang_ui]}</b>", normal)
+    yield Paragraph(world_obj.get("summary", ""), normal)
+    yield Spacer(1, 12)
+
+    # 前情提要
+    if recap:
+        yield Paragraph(f"<b>{labels['recap'][lang_ui]}</b>", normal)
+        for p in split_into_paragraphs(recap):
+            yield Paragraph(p, normal)
+            yield Spacer(1, 4)
+        yield Spacer(1, 8)
+
+    # 冒险记录
+    yield Paragraph(f"<b>{labels['log'][lang_ui]}</b>", normal)
+    yield Spacer(1, 8)
+
 
-    # 注册中文字体
-    pdfmetrics.registerFont(UnicodeCIDFont("STSong-Light"))
+def _round_flowables(it, labels, lang_ui, styles):
+    normal = styles["normal"]
 
-    doc = SimpleDocTemplate(
-        buffer,
+    # Player
+    yield Paragraph(f"<b>{labels['player'][lang_ui]}:</b>", normal)
+    for p in split_into_paragraphs(str(it["player"])):
+        yield Paragraph(p, normal)
+        yield Spacer(1, 4)
+
+    # DM
+    yield Paragraph(f"<b>{labels['dm'][lang_ui]}:</b>", normal)
+    for p in split_into_paragraphs(str(it["dm"])):
+        yield Paragraph(p, normal)
+        yield Spacer(1, 4)
+
+    yield Spacer(1, 8)
+
+
+def _story(world_obj, history, labels, lang_ui, recap, styles, progress=None, total=None):
+    """整本书的 flowable 序列；progress 按已排版的回合数回报（需要知道 total）"""
+    yield from _front_flowables(world_obj, labels, lang_ui, recap, styles)
+    for i, it in enumerate(history, 1):
+        yield from _round_flowables(it, labels, lang_ui, styles)
+        if progress is not None and total:
+            progress(min(1.0, i / total))
+
+
+def _new_doc(out):
+    return SimpleDocTemplate(
+        out,
         pagesize=A4,
         leftMargin=20 * mm,
         rightMargin=20 * mm,
@@ -59,45 +132,109 @@ def generate_pdf(world_obj, adventure_history, labels, lang_ui):
         bottomMargin=20 * mm
     )
 
-    styles = getSampleStyleSheet()
-    normal = styles["Normal"]
-    normal.fontName = "STSong-Light"
-    title_style = styles["Title"]
-    title_style.fontName = "STSong-Light"
 
-    story = []
-
-    # 标题
-    story.append(Paragraph(world_obj.get("title", "Untitled World"), title_style))
-    story.append(Spacer(1, 10))
+# 生成 PDF，返回 BytesIO。
+# world_obj: 世界 JSON dict
+# adventure_history: 冒险记录列表
+# labels: PDF 内部标签（来自 PDF_LABELS）
+# recap: 可选的滚动摘要（前情提要），放在冒险记录之前
+# progress: 可选回调 progress(已完成比例 0~1)，排版过程中调用
+def generate_pdf(world_obj, adventure_history, labels, lang_ui, recap=None, progress=None):
+    buffer = BytesIO()
+    doc = _new_doc(buffer)
+    story = list(_story(world_obj, adventure_history, labels, lang_ui, recap, get_styles()))
 
-    # 世界简介
-    story.append(Paragraph(f"<b>{labels['summary'][lang_ui]}</b>", normal))
-    story.append(Paragraph(world_obj.get("summary", ""), normal))
-    story.append(Spacer(1, 12))
+    if progress is not None:
+        total = max(1, len(story))
 
-    # 冒险记录
-    story.append(Paragraph(f"<b>{labels['log'][lang_ui]}</b>", normal))
-    story.append(Spacer(1, 8))
-
-    for it in adventure_history:
-        # Player
-        story.append(Paragraph(f"<b>{labels['player'][lang_ui]}:</b>", normal))
-        player_paras = split_into_paragraphs(str(it["player"]))
-        for p in player_paras:
-            story.append(Paragraph(p, normal))
-            story.append(Spacer(1, 4))
-
-        # DM
-        story.append(Paragraph(f"<b>{labels['dm'][lang_ui]}:</b>", normal))
-        dm_paras = split_into_paragraphs(str(it["dm"]))
-        for p in dm_paras:
-            story.append(Paragraph(p, normal))
-            story.append(Spacer(1, 4))
-
-        story.append(Spacer(1, 8))
+        def on_progress(kind, value):
+            if kind == "PROGRESS":
+                progress(min(1.0, value / total))
+        doc.setProgressCallBack(on_progress)
 
     doc.build(story)
     buffer.seek(0)
     return buffer
 
+
+# ---------------------------
+# 流式导出：flowable 按需生成，输出写进临时文件
+# ---------------------------
+# 输出超过这个大小就从内存落到磁盘
+PDF_SPOOL_MAX_BYTES = int(os.getenv("PDF_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+# 预读的 flowable 个数（reportlab 只看最前面几个：keepWithNext、分页拆分）
+PDF_LOOKAHEAD = int(os.getenv("PDF_LOOKAHEAD", "64"))
+
+
+class LazyStory:
+    """
+    给 doc.build() 用的「列表」：背后是一个 flowable 迭代器，只缓存最前面的一小段。
+    实现了 reportlab 排版循环用到的操作：len / [i] / [:i] / del [0] / del [:i] / insert / [0:0] = S。
+    len() 返回的是已缓存的个数（迭代器没取完时至少为 1），排完才会变成 0
+    """
+
+    def __init__(self, flowables, lookahead=PDF_LOOKAHEAD):
+        self._source = iter(flowables)
+        self._buffer = []
+        self._lookahead = max(1, lookahead)
+        self._exhausted = False
+
+    def _fill(self, size):
+        while not self._exhausted and len(self._buffer) < size:
+            try:
+                self._buffer.append(next(self._source))
+            except StopIteration:
+                self._exhausted = True
+
+    def _fill_for(self, index):
+        if isinstance(index, slice):
+            if index.stop is None or index.stop < 0 or (index.start or 0) < 0:
+                self._fill(float("inf"))
+            else:
+                self._fill(index.stop)
+        elif index < 0:
+            self._fill(float("inf"))
+        else:
+            self._fill(index + 1)
+
+    def __len__(self):
+        self._fill(self._lookahead)
+        return len(self._buffer)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, index):
+        self._fill_for(index)
+        return self._buffer[index]
+
+    def __setitem__(self, index, value):
+        self._fill_for(index)
+        self._buffer[index] = value
+
+    def __delitem__(self, index):
+        self._fill_for(index)
+        del self._buffer[index]
+
+    def insert(self, index, value):
+        self._fill_for(index)
+        self._buffer.insert(index, value)
+
+
+def stream_pdf(world_obj, history, labels, lang_ui, recap=None, progress=None, total=None, out=None):
+    """
+    generate_pdf 的有界内存版本：history 可以是任意迭代器（例如按回合读库），
+    flowable 边生成边排版，排完即丢。
+    out：可写的二进制文件对象；默认 SpooledTemporaryFile（小的留在内存，大的落盘）。
+    返回 out（已 seek(0)）。total：回合总数，用于进度（history 有 len 时可省略）
+    """
+    if out is None:
+        out = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES, mode="w+b")
+    if total is None and hasattr(history, "__len__"):
+        total = len(history)
+
+    doc = _new_doc(out)
+    doc.build(LazyStory(_story(world_obj, history, labels, lang_ui, recap, get_styles(),
+                               progress=progress, total=total)))
+    out.seek(0)
+    return out
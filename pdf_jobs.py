@@ -0,0 +1,223 @@
+# pdf_jobs.py
+import os
+import json
+import atexit
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pdf_export import stream_pdf, get_styles
+
+# ---------------------------
+# 配置（环境变量可覆盖）
+# ---------------------------
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+# 生成好的 PDF 放在这个目录（文件名即 job_key），下载时按文件流读取
+PDF_OUTPUT_DIR = os.getenv("PDF_OUTPUT_DIR", os.path.join(tempfile.gettempdir(), "worldweaver_pdf"))
+# 已生成 PDF 的磁盘占用上限（同一会话重复导出直接复用，超过后淘汰最久未用的）
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# 进度至少变化这么多才回报一次，避免频繁跨进程通信
+PDF_PROGRESS_STEP = 0.02
+
+
+# 画册只用到世界的这几个字段；只把它们参与哈希、传给子进程
+PDF_WORLD_KEYS = ("title", "summary")
+
+
+def _pdf_world(world_obj):
+    return {k: world_obj.get(k) for k in PDF_WORLD_KEYS}
+
+
+def job_key(world_obj, history, lang_ui, recap=None, session_id=None):
+    """
+    (世界标题 / 简介, 冒险记录, 语言, 前情提要) → 稳定的 sha256。
+    有 session_id 时冒险记录只取 (会话, 回合数, 最后一回合)：同一会话的记录只会追加，
+    每次点击的开销与世界大小、回合数无关；没有会话 id 时才哈希整段记录
+    """
+    if session_id is not None:
+        story = [session_id, len(history), history[-1] if history else None]
+    else:
+        story = list(history)
+    raw = json.dumps([_pdf_world(world_obj), story, lang_ui, recap], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ---------------------------
+# 子进程里执行
+# ---------------------------
+def _init_worker():
+    # 每个工作进程启动时注册一次字体 / 样式
+    get_styles()
+
+
+def _output_path(key):
+    return os.path.join(PDF_OUTPUT_DIR, f"{key}.pdf")
+
+
+def _render(key, world_obj, history, labels, lang_ui, recap, progress_map):
+    """流式排版到临时文件，完成后原子改名为 {key}.pdf；返回 (路径, 字节数)"""
+    last = [0.0]
+
+    def report(fraction):
+        if fraction - last[0] >= PDF_PROGRESS_STEP:
+            last[0] = fraction
+            progress_map[key] = fraction
+
+    os.makedirs(PDF_OUTPUT_DIR, exist_ok=True)
+    path = _output_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as out:
+            stream_pdf(world_obj, history, labels, lang_ui, recap=recap,
+                       progress=report if progress_map is not None else None, out=out)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path, os.path.getsize(path)
+
+
+# ---------------------------
+# 主进程：提交 / 查询
+# ---------------------------
+class PdfJobManager:
+    """
+    PDF 在进程池里后台排版，Streamlit 的点击回调只提交任务、随后轮询进度。
+    排版是流式的（pdf_export.stream_pdf），结果写到 PDF_OUTPUT_DIR 下的文件，
+    按 job_key 做 LRU（按磁盘字节数淘汰并删除文件），重复导出直接命中，下载时以文件流读取。
+    进程池用 spawn 启动（Streamlit 进程里有很多线程，fork 不安全），第一次提交时才创建
+    """
+
+    def __init__(self, workers=PDF_WORKERS, max_bytes=PDF_CACHE_MAX_BYTES):
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pool = None
+        self._manager = None
+        self._progress = None
+        self._jobs = {}                 # key -> Future（进行中或失败）
+        self._results = OrderedDict()   # key -> (PDF 路径, 字节数)
+        self._bytes = 0
+
+    def _ensure_pool(self):
+        if self._pool is None:
+            ctx = multiprocessing.get_context("spawn")
+            if self._manager is None:
+                self._manager = ctx.Manager()
+                self._progress = self._manager.dict()
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx,
+                                             initializer=_init_worker)
+        return self._pool
+
+    def submit(self, world_obj, history, labels, lang_ui, recap=None, session_id=None):
+        """提交导出任务，返回 key；同一份内容已完成或正在生成时不会重复提交"""
+        key = job_key(world_obj, history, lang_ui, recap, session_id)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return key
+            path = _output_path(key)
+            if key not in self._jobs and os.path.exists(path):
+                # 之前的进程生成过（文件名带内容哈希，可直接复用）
+                self._add_result(key, path, os.path.getsize(path))
+                return key
+            fut = self._jobs.get(key)
+            if fut is not None and not (fut.done() and fut.exception() is not None):
+                return key
+
+            for attempt in range(2):
+                pool = self._ensure_pool()
+                try:
+                    self._progress[key] = 0.0
+                    self._jobs[key] = pool.submit(_render, key, _pdf_world(world_obj), list(history), labels,
+                                                  lang_ui, recap, self._progress)
+                    break
+                except BrokenProcessPool:
+                    # 工作进程异常退出过：重建进程池再试一次
+                    self._pool = None
+                    if attempt:
+                        raise
+        return key
+
+    def _collect(self, key):
+        # 调用方持有锁：完成的任务转入结果缓存
+        fut = self._jobs.get(key)
+        if fut is None or not fut.done() or fut.exception() is not None:
+            return
+        path, size = fut.result()
+        del self._jobs[key]
+        self._progress.pop(key, None)
+        self._add_result(key, path, size)
+
+    def _add_result(self, key, path, size):
+        # 调用方持有锁
+        self._results[key] = (path, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._results) > 1:
+            _, (old_path, old_size) = self._results.popitem(last=False)
+            self._bytes -= old_size
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def status(self, key):
+        """{"state": done / running / error / unknown, "progress": 0~1, "error": 文本}"""
+        with self._lock:
+            self._collect(key)
+            if key in self._results:
+                return {"state": "done", "progress": 1.0}
+            fut = self._jobs.get(key)
+            if fut is None:
+                return {"state": "unknown", "progress": 0.0}
+            if fut.done():
+                return {"state": "error", "progress": 0.0, "error": repr(fut.exception())}
+            return {"state": "running", "progress": float(self._progress.get(key, 0.0))}
+
+    def result_path(self, key):
+        """完成的 PDF 文件路径；未完成 / 已被淘汰返回 None"""
+        with self._lock:
+            self._collect(key)
+            entry = self._results.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                return None
+            self._results.move_to_end(key)
+            return entry[0]
+
+    def open_result(self, key):
+        """以二进制只读文件对象返回 PDF（调用方负责关闭）；没有则返回 None"""
+        path = self.result_path(key)
+        if path is None:
+            return None
+        try:
+            return open(path, "rb")
+        except OSError:
+            return None
+
+    def result(self, key):
+        """完成的 PDF bytes；未完成 / 已被淘汰返回 None"""
+        f = self.open_result(key)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
+                self._progress = None
+
+
+# 进程级单例（所有 Streamlit 会话共用一个进程池）
+pdf_jobs = PdfJobManager()
+atexit.register(pdf_jobs.shutdown)
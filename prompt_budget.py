@@ -0,0 +1,132 @@
+# prompt_budget.py
+import os
+import re
+import json
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 动态部分（user prompt）默认 token 预算
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_encoder = None
+
+
+def estimate_tokens(text):
+    """
+    估算 token 数：装了 tiktoken 就精确计算，
+    否则按 中日韩字符≈1 token、其余≈4 字符 1 token 粗估
+    """
+    global _encoder
+    if not text:
+        return 0
+    if tiktoken is not None:
+        if _encoder is None:
+            _encoder = tiktoken.get_encoding("o200k_base")
+        return len(_encoder.encode(text))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _dump(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def fit_to_budget(value, budget):
+    """
+    把一个 section 的内容裁剪到 budget token 以内，返回字符串（放不下返回 None）
+    - list：按顺序保留前面的元素（调用方负责把重要的放前面）
+    - dict：按 key 顺序保留
+    - str：截断并加省略号
+    """
+    text = _dump(value)
+    if estimate_tokens(text) <= budget:
+        return text
+
+    if isinstance(value, list):
+        kept = []
+        for item in value:
+            if estimate_tokens(_dump(kept + [item])) > budget:
+                break
+            kept.append(item)
+        return _dump(kept) if kept else None
+
+    if isinstance(value, dict):
+        kept = {}
+        for k, v in value.items():
+            trial = dict(kept)
+            trial[k] = v
+            if estimate_tokens(_dump(trial)) > budget:
+                continue
+            kept = trial
+        return _dump(kept) if kept else None
+
+    # 纯文本：按比例截断，再逐步收紧
+    if budget <= 0:
+        return None
+    cut = max(1, int(len(text) * budget / max(1, estimate_tokens(text))))
+    while cut > 0 and estimate_tokens(text[:cut] + "…") > budget:
+        cut = int(cut * 0.9)
+    return text[:cut] + "…" if cut > 0 else None
+
+
+class PromptAssembler:
+    """
+    两段式 prompt：
+    - system：静态规则文本，按加入顺序拼接，不参与裁剪（跨回合保持稳定前缀）
+    - user：动态 section，按 priority（数字越小越重要）分配 token 预算，
+      输出时仍保持加入顺序
+    """
+
+    def __init__(self, budget=None):
+        self.budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+        self._static = []
+        self._sections = []
+
+    def static(self, text):
+        self._static.append(text.strip("\n"))
+        return self
+
+    def section(self, title, value, priority=1, required=False):
+        """required=True 的 section 永远完整保留（例如玩家输入）"""
+        self._sections.append({
+            "title": title,
+            "value": value,
+            "priority": priority,
+            "required": required,
+        })
+        return self
+
+    def build(self):
+        """返回 (system_prompt, user_prompt, report)；report 记录各 section 的取舍"""
+        rendered = {}
+        remaining = self.budget
+        report = {"budget": self.budget, "sections": {}}
+
+        order = sorted(range(len(self._sections)),
+                       key=lambda i: (not self._sections[i]["required"], self._sections[i]["priority"], i))
+        for i in order:
+            sec = self._sections[i]
+            header = f"==================== {sec['title']} ===================="
+            header_cost = estimate_tokens(header) + 2
+            if sec["required"]:
+                body = _dump(sec["value"])
+            else:
+                body = fit_to_budget(sec["value"], remaining - header_cost)
+            if body is None:
+                report["sections"][sec["title"]] = "dropped"
+                continue
+            cost = header_cost + estimate_tokens(body)
+            remaining -= cost
+            rendered[i] = f"{header}\n{body}"
+            full = body == _dump(sec["value"])
+            report["sections"][sec["title"]] = cost if full else f"{cost} (trimmed)"
+
+        system_prompt = "\n\n".join(self._static)
+        user_prompt = "\n\n".join(rendered[i] for i in sorted(rendered))
+        report["used"] = self.budget - remaining
+        return system_prompt, user_prompt, report
@@ -0,0 +1,20 @@
+# tests/conftest.py
+# 测试全程离线：LLM 走回放 provider（没有回放库时用假数据），
+# 数据库 / 缓存 / 日志都放进临时目录。环境变量必须在导入项目模块之前设置
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_TMP = tempfile.mkdtemp(prefix="worldweaver-test-")
+os.environ.pop("OPENAI_API_KEY", None)
+os.environ["LLM_PROVIDER"] = "replay"
+os.environ["LLM_REPLAY_PATH"] = os.path.join(_TMP, "llm_replay.db")
+os.environ["LLM_REPLAY_LATENCY"] = "0"
+os.environ["WORLDWEAVER_DB_URL"] = f"sqlite:///{os.path.join(_TMP, 'worlds.db')}"
+os.environ["LLM_CACHE_PATH"] = os.path.join(_TMP, "llm_cache.db")
+os.environ["LLM_LOG_PATH"] = os.path.join(_TMP, "logs", "llm_trace.jsonl")
+os.environ["PDF_OUTPUT_DIR"] = os.path.join(_TMP, "pdf")
+os.environ.pop("LLM_METRICS_PORT", None)
@@ -0,0 +1,115 @@
+# tests/test_adventure_store.py
+import json
+
+import pytest
+
+from adventure_store import record_round, resume, iter_rounds, list_sessions, get_session
+from db import init_db, unit_of_work, SessionLocal
+from world_repo import WorldRepository
+
+
+@pytest.fixture
+def world_id():
+    init_db()
+    with unit_of_work() as session:
+        wid, _ = WorldRepository(session).save("adventure-store", _world())
+    return wid
+
+
+def _world():
+    return {
+        "title": "T",
+        "world_state": {"day": 1, "tension": 0},
+        "player_stats": {"hp": 10},
+        "characters": [{"name": "Ann", "stats": {"trust": 0}}],
+        "inventory": {"resources": {}, "items": [], "lore": []},
+        "adventure_state": {"progress": 0},
+    }
+
+
+def _play(state, world, player, dm):
+    state["history"].append({"player": player, "dm": dm})
+    state["round"] = len(state["history"])
+    return record_round(state, world, "English")
+
+
+def test_rounds_store_only_changed_keys_and_resume(world_id):
+    world = _world()
+    state = {"world_id": world_id, "history": [], "rng_seed": 7}
+    session_id = _play(state, world, "look", "You see a gate.")
+
+    world["world_state"]["day"] = 2
+    world["characters"][0]["stats"]["trust"] = 3
+    _play(state, world, "wait", "Night falls.")
+
+    with unit_of_work() as session:
+        rounds = [payload for _, payload in iter_rounds(session, session_id)]
+    assert rounds[0]["rng_seed"] == 7
+    assert "world" not in rounds[0]
+    assert set(rounds[1]["world"]) == {"world_state", "characters"}
+    assert "rng_seed" not in rounds[1]
+
+    restored = _world()
+    with unit_of_work() as session:
+        new_state = resume(session, session_id, restored)
+    assert restored == world
+    assert new_state["round"] == 2
+    assert new_state["_persisted"] == state["_persisted"]
+
+
+def test_persisted_state_holds_digests_not_world_copies(world_id):
+    world = _world()
+    world["memory"] = ["x" * 10_000]
+    state = {"world_id": world_id, "history": []}
+    _play(state, world, "look", "ok")
+    assert all(len(v) <= 32 for v in state["_persisted"].values())
+    assert sum(len(v) for v in state["_persisted"].values()) < len(json.dumps(world)) // 10
+
+
+def test_failed_write_carries_changes_into_next_round(world_id, monkeypatch):
+    world = _world()
+    state = {"world_id": world_id, "history": []}
+    session_id = _play(state, world, "look", "ok")
+
+    import adventure_store
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("db down")
+
+    world["world_state"]["tension"] = 5
+    monkeypatch.setattr(adventure_store, "unit_of_work", broken)
+    with pytest.raises(RuntimeError):
+        _play(state, world, "push", "ok")
+    monkeypatch.undo()
+    state["history"].pop()
+    _play(state, world, "push", "ok")
+
+    session = SessionLocal()
+    try:
+        last = list(iter_rounds(session, session_id))[-1][1]
+    finally:
+        session.close()
+    assert last["world"] == {"world_state": {"day": 1, "tension": 5}}
+
+
+def test_regenerating_a_world_drops_its_old_sessions(world_id):
+    state = {"world_id": world_id, "history": [], "rng_seed": 7}
+    session_id = _play(state, _world(), "look", "You see a gate.")
+
+    with unit_of_work() as session:
+        WorldRepository(session).save("adventure-store", _world(), touch=False)   # 补算写回不算覆盖
+    with unit_of_work() as session:
+        assert [s.id for s in list_sessions(session, world_id)] == [session_id]
+
+    with unit_of_work() as session:
+        wid, _ = WorldRepository(session).save("adventure-store", _world())        # 重新生成同名世界
+    assert wid == world_id
+    with unit_of_work() as session:
+        assert list_sessions(session, world_id) == []
+        assert get_session(session, session_id) is None
+        assert list(iter_rounds(session, session_id)) == []
+
+    # 旧世界上还开着的冒险继续玩：不再写入已删除的会话
+    assert _play(state, _world(), "wait", "Night falls.") is None
+    with unit_of_work() as session:
+        assert list(iter_rounds(session, session_id)) == []
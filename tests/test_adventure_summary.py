@@ -0,0 +1,111 @@
+# tests/test_adventure_summary.py
+from concurrent.futures import Future
+
+import pytest
+
+import adventure
+from adventure import AdventureManager, history_with_summary
+from llm import build_recap_prompt
+from llm_resilience import GPTError
+
+
+def _manager(history=(), **state):
+    adv = {"history": [{"player": p, "dm": d} for p, d in history], "round": len(history),
+           "options": [], **state}
+    return AdventureManager({"rng_seed": 1}, "English", {"adventure": adv})
+
+
+def _rounds(n, start=0):
+    return [(f"act {i}", f"scene {i}") for i in range(start, start + n)]
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    """拦截后台提交：记录折叠了哪些回合，返回一个由测试控制的 Future"""
+    jobs = []
+
+    def fake_submit(args):
+        previous, entries = args
+        job = Future()
+        jobs.append({"previous": previous, "entries": entries, "job": job})
+        return job
+
+    monkeypatch.setattr(adventure, "SUMMARY_EVERY", 3)
+    monkeypatch.setattr(adventure, "_fold_summary", lambda previous, entries, lang_ui: (previous, entries))
+    monkeypatch.setattr(adventure, "submit", fake_submit)
+    return jobs
+
+
+def test_refresh_triggers_only_after_summary_every_unfolded_rounds(submitted):
+    adv = _manager(_rounds(2))
+    adv._maybe_refresh_summary()
+    assert submitted == []
+
+    adv.state["history"].append({"player": "act 2", "dm": "scene 2"})
+    adv._maybe_refresh_summary()
+    assert len(submitted) == 1
+    assert [e["player"] for e in submitted[0]["entries"]] == ["act 0", "act 1", "act 2"]
+    assert adv.state["_summary_job_upto"] == 3
+
+    # 上一个任务还没完成：不重复提交
+    adv.state["history"].append({"player": "act 3", "dm": "scene 3"})
+    adv._maybe_refresh_summary()
+    assert len(submitted) == 1
+
+
+def test_finished_job_is_folded_into_state(submitted):
+    adv = _manager(_rounds(3), summary="old recap", summary_upto=0)
+    adv._maybe_refresh_summary()
+    assert submitted[0]["previous"] == "old recap"
+
+    adv.state["history"].extend({"player": p, "dm": d} for p, d in _rounds(1, start=3))
+    submitted[0]["job"].set_result("  new recap \n")
+    adv._collect_summary()
+    assert adv.state["summary"] == "new recap"
+    assert adv.state["summary_upto"] == 3       # 任务提交时的长度，之后的回合留待下次
+    assert "_summary_job" not in adv.state and "_summary_job_upto" not in adv.state
+
+
+def test_background_fold_runs_through_the_llm_loop(monkeypatch):
+    # 不拦截 submit：真的在 LLM 事件循环上跑，回放 provider 用假数据回答
+    monkeypatch.setattr(adventure, "SUMMARY_EVERY", 2)
+    adv = _manager(_rounds(2))
+    adv._maybe_refresh_summary()
+    adv.state["_summary_job"].result(timeout=10)
+
+    AdventureManager(adv.world_obj, "English", {"adventure": adv.state})   # 新一轮 rerun 时收取结果
+    assert adv.state["summary"]
+    assert adv.state["summary_upto"] == 2
+
+
+@pytest.mark.parametrize("outcome", [GPTError("boom", kind="server", retryable=True), "",
+                                     RuntimeError("loop died")])
+def test_failed_fold_keeps_old_summary_and_retries(submitted, outcome):
+    adv = _manager(_rounds(3), summary="old recap", summary_upto=0)
+    adv._maybe_refresh_summary()
+    if isinstance(outcome, Exception):
+        submitted[0]["job"].set_exception(outcome)
+    else:
+        submitted[0]["job"].set_result(outcome)
+
+    adv._maybe_refresh_summary()                # 收取失败结果后立即重新提交
+    assert adv.state["summary"] == "old recap"
+    assert adv.state["summary_upto"] == 0
+    assert len(submitted) == 2
+    assert submitted[1]["previous"] == "old recap"
+    assert len(submitted[1]["entries"]) == 3
+
+
+def test_history_with_summary_uses_recap_plus_unfolded_rounds():
+    state = {"history": [{"player": p, "dm": d} for p, d in _rounds(7)],
+             "summary": "The hero found a map.", "summary_upto": 5}
+    text = history_with_summary(state)
+    assert text.startswith("Story so far: The hero found a map.")
+    assert "act 4" not in text and "scene 0" not in text
+    assert "Player: act 5\nDM: scene 5" in text and "Player: act 6\nDM: scene 6" in text
+
+    _, user_prompt = build_recap_prompt(text, "English")
+    assert "The hero found a map." in user_prompt and "act 6" in user_prompt and "act 4" not in user_prompt
+
+    assert history_with_summary({"history": state["history"][:2]}) == \
+        "Player: act 0\nDM: scene 0\n\nPlayer: act 1\nDM: scene 1\n\n"
@@ -0,0 +1,44 @@
+# tests/test_clue_index.py
+import json
+
+from clue_index import build_clue_index, record_clues, already_told, find_topics
+
+
+def _world():
+    world = {
+        "characters": [{"name": "Ravenhold"}, {"name": "Mira Vell"}],
+        "locations": [{"name": "Ravenhold"}, {"name": "Salt Gate"}],
+        "story_nodes": {},
+        "inventory": {"lore": []},
+    }
+    world["clue_index"] = build_clue_index(world)
+    return world
+
+
+def test_same_label_under_different_kinds_is_given_once():
+    world = _world()
+    new = record_clues(world, "You reach Ravenhold.")
+    assert set(new) == {"character:Ravenhold", "location:Ravenhold"}
+    assert world["memory"]["info_given"] == ["Ravenhold"]
+
+    record_clues(world, "Ravenhold again, and Salt Gate.")
+    assert world["memory"]["info_given"] == ["Ravenhold", "Salt Gate"]
+    assert world["memory"]["clue_depth"]["location:Ravenhold"] == 2
+
+
+def test_aliases_and_already_told():
+    world = _world()
+    assert find_topics(world, "Vell waits") == ["character:Mira Vell"]
+    record_clues(world, "Mira Vell waits by the well")
+    assert already_told(world, "vell")
+    assert not already_told(world, "Salt Gate")
+
+
+def test_event_prompt_dedupes_legacy_duplicates():
+    from llm import build_event_prompt
+
+    world = _world()
+    world["memory"] = {"info_given": ["Ravenhold", "Salt Gate", "Ravenhold"]}
+    _, user = build_event_prompt(world, "look", json.dumps({"action_type": "explore"}), "English", 1, 0)
+    section = user.split("已知信息（禁止重复）", 1)[1].split("====================", 2)[1]
+    assert json.loads(section) == ["Ravenhold", "Salt Gate"]
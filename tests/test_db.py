@@ -0,0 +1,134 @@
+# tests/test_db.py
+import os
+import sys
+import random
+import string
+import subprocess
+import threading
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from db import (
+    Base, World, make_engine, unit_of_work,
+    CODEC_RAW, CODEC_ZLIB, DB_CODEC_MIN_BYTES, encode_blob, decode_blob, codec_stats, compress_existing,
+)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'db.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+def test_write_unit_of_work_begins_immediate(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cur, stmt, *a: statements.append(stmt))
+    factory = sessionmaker(bind=engine)
+    with unit_of_work(factory, write=True) as session:
+        session.query(World).count()
+    with unit_of_work(factory) as session:
+        session.query(World).count()
+    assert [s for s in statements if s.startswith("BEGIN")] == ["BEGIN IMMEDIATE", "BEGIN DEFERRED"]
+
+
+def test_concurrent_read_then_write_does_not_hit_lock_errors(engine):
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+    errors = []
+
+    def worker(idx):
+        for n in range(25):
+            try:
+                with unit_of_work(factory, write=True) as session:
+                    session.query(World).count()
+                    session.add(World(name=f"{idx}-{n}", created_at=0))
+            except OperationalError as e:
+                errors.append(str(e.orig))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    with unit_of_work(factory) as session:
+        assert session.query(World).count() == 150
+
+
+# ---------------------------
+# CompressedText
+# ---------------------------
+def test_codec_round_trip_raw_and_zlib():
+    short = "短文本"
+    long = "世界 " * 200
+    assert encode_blob(short)[0] == CODEC_RAW
+    assert encode_blob(long)[0] == CODEC_ZLIB
+    assert len(encode_blob(long)) < len(long.encode("utf-8"))
+    for value in (short, long, "", None):
+        assert decode_blob(encode_blob(value)) == value
+
+
+def test_codec_keeps_incompressible_text_raw():
+    rng = random.Random(0)
+    noise = "".join(rng.choice(string.printable[:94]) for _ in range(DB_CODEC_MIN_BYTES + 2))
+    assert encode_blob(noise)[0] == CODEC_RAW
+    assert decode_blob(encode_blob(noise)) == noise
+
+
+def test_codec_rejects_unknown_version():
+    with pytest.raises(ValueError):
+        decode_blob(b"\x07abc")
+
+
+def test_legacy_text_rows_read_and_migrate(engine):
+    legacy = '{"title": "old"}' + " " * 300
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO worlds (id, name, data, created_at, schema_version) "
+                          "VALUES (1, 'old', :d, 0, 0)"), {"d": legacy})
+    factory = sessionmaker(bind=engine)
+    with unit_of_work(factory) as session:
+        assert session.get(World, 1).data == legacy
+
+    stats = {s["column"]: s for s in codec_stats(engine)}
+    assert stats["worlds.data"]["legacy_rows"] == 1
+
+    assert compress_existing(engine) == 1
+    assert compress_existing(engine) == 0
+    with engine.connect() as conn:
+        stored = conn.execute(text("SELECT data FROM worlds WHERE id = 1")).scalar()
+    assert isinstance(stored, bytes) and stored[0] == CODEC_ZLIB
+    with unit_of_work(factory) as session:
+        assert session.get(World, 1).data == legacy
+    stats = {s["column"]: s for s in codec_stats(engine)}
+    assert stats["worlds.data"]["legacy_rows"] == 0
+    assert stats["worlds.data"]["ratio"] > 1
+
+
+def test_compress_cli_rewrites_and_vacuums(tmp_path):
+    # 端到端跑 python db.py compress（VACUUM 必须在事务之外执行）
+    url = f"sqlite:///{tmp_path / 'cli.db'}"
+    engine = make_engine(url)
+    Base.metadata.create_all(bind=engine)
+    legacy = '{"title": "old"}' + " " * 300
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO worlds (id, name, data, created_at, schema_version) "
+                          "VALUES (1, 'old', :d, 0, 0)"), {"d": legacy})
+    engine.dispose()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, "WORLDWEAVER_DB_URL": url}
+    proc = subprocess.run([sys.executable, "db.py", "compress"], cwd=root, env=env,
+                          capture_output=True, text=True, timeout=60)
+    assert proc.returncode == 0, proc.stderr
+    assert "rewrote 1 value(s)" in proc.stdout
+
+    engine = make_engine(url)
+    with engine.connect() as conn:
+        stored = conn.execute(text("SELECT data FROM worlds WHERE id = 1")).scalar()
+    engine.dispose()
+    assert stored[0] == CODEC_ZLIB and decode_blob(stored) == legacy
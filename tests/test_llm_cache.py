@@ -0,0 +1,57 @@
+# tests/test_llm_cache.py
+import threading
+
+import llm
+from llm_cache import ResponseCache, make_cache_key
+
+
+def test_make_cache_key_is_stable_and_parameter_sensitive():
+    k = make_cache_key("m", "sys", "user", 0.8, 100)
+    assert k == make_cache_key("m", "sys", "user", 0.8, 100)
+    assert k != make_cache_key("m", "sys", "user", 0.2, 100)
+    assert k != make_cache_key("m", "sys", "user", 0.8, 200)
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    path = str(tmp_path / "c.db")
+    ResponseCache(path=path, enabled=True).put("k", "v")
+    cache = ResponseCache(path=path, enabled=True)
+    assert cache.get("k") == "v"
+    assert cache.counters["disk_hits"] == 1
+    assert cache.get("k") == "v"
+    assert cache.counters["memory_hits"] == 1
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "c.db"), enabled=True)
+    cache.put("k", "v", ttl=-1)
+    assert cache.get("k") is None
+    assert cache.counters["misses"] == 1
+
+
+def test_memory_tier_is_bounded(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "c.db"), memory_items=2, enabled=True)
+    for i in range(5):
+        cache.put(f"k{i}", str(i))
+    assert len(cache._memory) == 2
+
+
+def test_cache_io_does_not_run_on_the_llm_loop(tmp_path, monkeypatch):
+    cache = ResponseCache(path=str(tmp_path / "c.db"), enabled=True)
+    threads = []
+
+    def spy(fn):
+        def wrapper(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return fn(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(cache, "get", spy(cache.get))
+    monkeypatch.setattr(cache, "put", spy(cache.put))
+    monkeypatch.setattr(llm, "response_cache", cache)
+
+    first = llm.call_gpt("sys", "cache io thread test", cache=True, site="test")
+    second = llm.call_gpt("sys", "cache io thread test", cache=True, site="test")
+    assert first == second
+    assert len(threads) == 3       # get（未命中）/ put / get（命中）
+    assert "llm-loop" not in threads
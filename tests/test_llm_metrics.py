@@ -0,0 +1,44 @@
+# tests/test_llm_metrics.py
+from llm_metrics import Histogram, MetricsRegistry, LATENCY_BUCKETS
+from llm_resilience import GPTError
+
+
+class Usage:
+    prompt_tokens = 120
+    completion_tokens = 40
+
+
+def test_histogram_quantiles_use_bucket_upper_bounds():
+    h = Histogram(LATENCY_BUCKETS)
+    for v in (0.2, 0.2, 0.8, 3.0):
+        h.observe(v)
+    assert h.count == 4
+    assert h.quantile(0.5) == 0.25
+    assert h.quantile(0.95) == 5
+    assert h.cumulative()[-1] == 4
+
+
+def test_cache_hits_do_not_skew_upstream_latency():
+    registry = MetricsRegistry()
+    for _ in range(2):
+        registry.record("node_round", 1.5, usage=Usage())
+    for _ in range(20):
+        registry.record("node_round", 0.0001, cached=True)
+
+    site = registry.snapshot()["sites"]["node_round"]
+    assert site["calls"] == 22 and site["cache_hits"] == 20
+    assert site["latency_p50"] == 2 and site["latency_p95"] == 2
+    assert site["latency_avg"] == 1.5
+    assert site["latency"]["hit"]["count"] == 20
+    assert site["prompt_tokens_total"] == 240
+
+
+def test_prometheus_labels_latency_by_cache_state():
+    registry = MetricsRegistry()
+    registry.record("world.base", 0.3, error=GPTError("boom", kind="server"))
+    registry.record("world.base", 0.0, cached=True)
+    text = registry.render_prometheus()
+    assert 'worldweaver_llm_latency_seconds_count{site="world.base",cache="miss"} 1' in text
+    assert 'worldweaver_llm_latency_seconds_count{site="world.base",cache="hit"} 1' in text
+    assert 'worldweaver_llm_errors_total{site="world.base",kind="server"} 1' in text
+    assert 'worldweaver_llm_prompt_tokens_count{site="world.base"} 0' in text
@@ -0,0 +1,240 @@
+# tests/test_llm_resilience.py
+import time
+import asyncio
+
+import pytest
+
+import llm
+from llm_resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    QueueTimeoutError,
+    RetryPolicy,
+    call_with_policy,
+    classify_error,
+    gpt_error,
+    is_gpt_error,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def fast_policy(**kwargs):
+    kwargs.setdefault("backoff_base", 0.01)
+    kwargs.setdefault("backoff_max", 0.01)
+    return RetryPolicy(**kwargs)
+
+
+def test_classify_error():
+    assert classify_error(asyncio.TimeoutError()) == ("timeout", True)
+    assert classify_error(StatusError(429)) == ("rate_limit", True)
+    assert classify_error(StatusError(503)) == ("server", True)
+    assert classify_error(StatusError(400)) == ("client", False)
+    assert classify_error(CircuitOpenError()) == ("circuit_open", False)
+    assert classify_error(QueueTimeoutError()) == ("queue_timeout", False)
+
+    err = gpt_error(asyncio.TimeoutError())
+    assert is_gpt_error(err) and err.kind == "timeout" and err.retryable
+    assert err.startswith("(Error calling GPT:")
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=2, reset_after=0.05)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()                 # 试探请求
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()             # 试探进行中，其他请求仍被拒绝
+    breaker.record_success()
+    assert breaker.snapshot() == {"state": "closed", "failures": 0}
+
+
+def test_cancelled_probe_is_released():
+    breaker = CircuitBreaker(threshold=1, reset_after=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    started = asyncio.Event()
+
+    async def hang():
+        started.set()
+        await asyncio.sleep(10)
+
+    async def ok():
+        return "ok"
+
+    async def main():
+        probe = asyncio.create_task(call_with_policy(hang, fast_policy(), breaker))
+        await started.wait()
+        probe.cancel()                    # 例如 stream_gpt 的 fut.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert breaker.snapshot()["state"] == "half_open"
+        return await call_with_policy(ok, fast_policy(), breaker)
+
+    assert asyncio.run(main()) == "ok"    # 不会一直报 "probe in flight"
+    assert breaker.snapshot() == {"state": "closed", "failures": 0}
+
+
+def test_retries_retryable_errors_until_success():
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        if len(calls) < 3:
+            raise StatusError(503)
+        return "ok"
+
+    breaker = CircuitBreaker(threshold=10)
+    assert asyncio.run(call_with_policy(attempt, fast_policy(max_attempts=3), breaker)) == "ok"
+    assert len(calls) == 3
+    assert breaker.snapshot()["state"] == "closed"
+
+
+def test_client_errors_are_not_retried_or_counted():
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        raise StatusError(400)
+
+    breaker = CircuitBreaker(threshold=1)
+    with pytest.raises(StatusError):
+        asyncio.run(call_with_policy(attempt, fast_policy(), breaker))
+    assert len(calls) == 1
+    assert breaker.snapshot()["state"] == "closed"
+
+
+def test_queueing_for_the_limiter_does_not_count_against_attempt_timeout():
+    # 上游 0.2s、单次尝试时限 0.3s、并发上限 1：排队的请求不能被判超时，熔断器保持关闭
+    breaker = CircuitBreaker(threshold=3)
+    policy = fast_policy(attempt_timeout=0.3, deadline=10, max_attempts=1)
+
+    async def main():
+        limiter = asyncio.Semaphore(1)
+
+        async def attempt():
+            await asyncio.sleep(0.2)
+            return "ok"
+
+        return await asyncio.gather(*(
+            call_with_policy(attempt, policy, breaker, limiter=limiter) for _ in range(6)
+        ))
+
+    assert asyncio.run(main()) == ["ok"] * 6
+    assert breaker.snapshot() == {"state": "closed", "failures": 0}
+
+
+def test_queue_timeout_is_not_an_upstream_failure():
+    breaker = CircuitBreaker(threshold=1)
+    policy = fast_policy(deadline=0.1)
+
+    async def main():
+        limiter = asyncio.Semaphore(1)
+        await limiter.acquire()           # 槽位被别人占着
+
+        async def attempt():
+            return "never"
+
+        return await call_with_policy(attempt, policy, breaker, limiter=limiter)
+
+    with pytest.raises(QueueTimeoutError):
+        asyncio.run(main())
+    assert breaker.snapshot()["state"] == "closed"
+
+
+def test_limiter_is_released_during_backoff():
+    policy = fast_policy(backoff_base=0.2, backoff_max=0.2, max_attempts=2, deadline=5)
+    breaker = CircuitBreaker(threshold=10)
+    policy.backoff = lambda attempt: 0.2
+
+    async def main():
+        limiter = asyncio.Semaphore(1)
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise StatusError(503)
+            return "retried"
+
+        task = asyncio.ensure_future(call_with_policy(flaky, policy, breaker, limiter=limiter))
+        await asyncio.sleep(0.05)         # 第一次尝试已失败，正在退避
+        got_slot = await asyncio.wait_for(limiter.acquire(), timeout=0.1)
+        limiter.release()
+        return got_slot, await task, limiter._value
+
+    got_slot, result, value = asyncio.run(main())
+    assert got_slot and result == "retried" and value == 1
+
+
+def test_hold_keeps_the_slot_until_the_caller_releases_it():
+    async def main():
+        limiter = asyncio.Semaphore(1)
+
+        async def attempt():
+            return "stream"
+
+        await call_with_policy(attempt, fast_policy(), CircuitBreaker(), limiter=limiter, hold=True)
+        held = limiter.locked()
+        limiter.release()
+        return held
+
+    assert asyncio.run(main())
+
+
+# ---------------------------
+# 流式：上游卡住时按时限返回 GPTError，不阻塞调用线程
+# ---------------------------
+class StallingProvider:
+    async def open_stream(self, *args, **kwargs):
+        return None
+
+    async def iter_stream(self, stream, meta=None, **context):
+        yield "first"
+        await asyncio.sleep(3600)
+        yield "never"
+
+
+@pytest.fixture
+def stalling_llm(monkeypatch):
+    async def make_limiter():
+        return asyncio.Semaphore(2)
+
+    limiter = llm.run_sync(make_limiter())
+    monkeypatch.setattr(llm, "_provider", StallingProvider())
+    monkeypatch.setattr(llm, "_limiter", limiter)
+    monkeypatch.setattr(llm, "retry_policy", fast_policy(attempt_timeout=0.2, deadline=5))
+    monkeypatch.setattr(llm, "circuit_breaker", CircuitBreaker(threshold=100))
+    return limiter
+
+
+def test_stalled_stream_times_out_per_chunk_and_releases_the_slot(stalling_llm):
+    t0 = time.monotonic()
+    parts = list(llm.stream_gpt("sys", "user", site="test.stall"))
+    assert parts[0] == "first"
+    assert is_gpt_error(parts[-1]) and parts[-1].kind == "timeout"
+    assert time.monotonic() - t0 < 2
+    assert stalling_llm._value == 2
+    assert llm.circuit_breaker.snapshot()["failures"] == 1
+
+
+def test_stream_consumer_gives_up_when_the_loop_never_answers(stalling_llm, monkeypatch):
+    async def hung(*args, **kwargs):
+        await asyncio.sleep(3600)
+        yield "never"
+
+    monkeypatch.setattr(llm, "_astream_gpt", hung)
+    monkeypatch.setattr(llm, "STREAM_CONSUMER_GRACE", 0.1)
+    t0 = time.monotonic()
+    parts = list(llm.stream_gpt("sys", "user", timeout=0.2, site="test.hung"))
+    assert len(parts) == 1 and is_gpt_error(parts[0]) and parts[0].kind == "timeout"
+    assert time.monotonic() - t0 < 2
@@ -0,0 +1,57 @@
+# tests/test_pacing_sim.py
+import sys
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import adventure
+import pacing_sim
+import world_tick
+from adventure import AdventureManager
+
+
+def _live_rounds_to_finale(node_round_limit, monkeypatch):
+    """用真实的 AdventureManager（离线回放 provider）一直选第一个选项，直到 finale"""
+    monkeypatch.setattr(adventure, "NODE_ROUND_LIMIT", node_round_limit)
+    monkeypatch.setattr(adventure, "SUMMARY_EVERY", 1000)
+    nodes = {}
+    for key, nxt in zip(pacing_sim.NODE_CHAIN, pacing_sim.NODE_CHAIN[1:] + (None,)):
+        nodes[key] = {"summary": key, "options": [{"text": f"go {nxt}", "goto": nxt}] if nxt else []}
+    world = {"story_nodes": nodes, "characters": [], "world_state": {},
+             "adventure_state": {"story_progress": 0}, "memory": {}}
+    state = {"history": [], "round": 0, "options": []}
+    manager = AdventureManager(world, "English", {"adventure": state})
+    manager.start_adventure()
+    while state["options"]:
+        manager.next_round(state["options"][0])
+    return len(state["history"]), world["adventure_state"]["story_progress"]
+
+
+@pytest.mark.parametrize("limit", [world_tick.NODE_ROUND_LIMIT, 0, 3])
+def test_simulated_node_pacing_matches_live_manager(limit, monkeypatch):
+    live_rounds, live_progress = _live_rounds_to_finale(limit, monkeypatch)
+    result = pacing_sim.simulate(runs=200, seed=1, node_round_limit=limit)
+    assert set(result["rounds"].tolist()) == {live_rounds}
+    # 每个节点回合 tick 一次：进度落在模拟结果的可达范围内
+    ticks = live_rounds - 1
+    assert min(100, ticks * world_tick.PROGRESS_MIN) <= live_progress <= min(100, ticks * world_tick.PROGRESS_MAX)
+    assert result["progress_final"].min() >= min(100, ticks * world_tick.PROGRESS_MIN)
+
+
+def test_reluctant_players_take_longer():
+    eager = pacing_sim.simulate(runs=2000, seed=2)
+    reluctant = pacing_sim.simulate(runs=2000, seed=2, jump_p=0.5)
+    assert reluctant["rounds"].mean() > eager["rounds"].mean()
+    report = pacing_sim.summarize(reluctant)
+    assert report["unfinished"] == 0
+    assert abs(sum(report["chapter_at_finale"].values()) - 1) < 1e-6
+
+
+def test_zero_progress_is_rejected(monkeypatch, capsys):
+    with pytest.raises(ValueError):
+        pacing_sim.simulate(runs=10, progress=(0, 5))
+    monkeypatch.setattr(sys, "argv", ["pacing_sim.py", "--progress", "0", "5"])
+    with pytest.raises(SystemExit):
+        pacing_sim.main()
+    assert "--progress" in capsys.readouterr().err
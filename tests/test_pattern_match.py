@@ -0,0 +1,63 @@
+# tests/test_pattern_match.py
+import pytest
+
+from archetypes import ArchetypeEngine
+from pattern_match import PatternMatcher
+
+
+def _matcher(*words):
+    return PatternMatcher([(w, w) for w in words]).compile()
+
+
+@pytest.mark.parametrize("word, text", [
+    ("king", "the kingdom falls"),
+    ("dark", "darkness spreads"),
+    ("general", "he generally agrees"),
+    ("mage", "a mirror image"),
+    ("kind", "mankind"),
+])
+def test_latin_keywords_need_both_word_boundaries(word, text):
+    assert _matcher(word).find(text) == []
+
+
+@pytest.mark.parametrize("word, text", [
+    ("king", "The King returns"),
+    ("king", "two kings"),
+    ("witch", "the witches' coven"),
+    ("dark", "dark, cold"),
+    ("general", "General Li"),
+    ("hot-tempered", "a hot-tempered smith"),
+])
+def test_latin_keywords_match_whole_words_and_plurals(word, text):
+    assert _matcher(word).find(text) == [word]
+
+
+def test_stem_keywords_only_need_a_word_start():
+    m = _matcher("sorcer*")
+    assert m.find("a sorceress and a sorcerer") == ["sorcer*"]
+    assert m.find("the resorcerer") == []
+
+
+def test_cjk_keywords_match_as_substrings():
+    m = _matcher("国王", "影")
+    assert m.find("老国王的影子") == ["国王", "影"]
+
+
+def test_overlapping_matches_and_positions():
+    m = PatternMatcher([("he", 1), ("she", 2), ("hers", 3)]).compile()
+    assert list(m.iter_matches("she hers he")) == [(0, 3, 2), (4, 8, 3), (9, 11, 1)]
+    cjk = PatternMatcher([("王", 1), ("国王", 2)]).compile()
+    assert list(cjk.iter_matches("国王")) == [(0, 2, 2), (1, 2, 1)]
+
+
+def test_find_dedupes_in_first_seen_order():
+    m = PatternMatcher([("guard", "g"), ("knight", "k")])
+    assert m.find("Knight, guard and knight") == ["k", "g"]
+
+
+def test_archetypes_ignore_word_fragments():
+    engine = ArchetypeEngine()
+    kingdom = engine.score("kingdom archivist", "")
+    king = engine.score("king", "")
+    assert kingdom == {}
+    assert king
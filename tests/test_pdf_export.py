@@ -0,0 +1,72 @@
+# tests/test_pdf_export.py
+import os
+
+import pytest
+
+pytest.importorskip("reportlab")
+
+import pdf_jobs
+from text import PDF_LABELS
+from pdf_export import LazyStory, generate_pdf, stream_pdf
+from pdf_jobs import PdfJobManager
+
+
+def _counting(n, pulled):
+    for i in range(n):
+        pulled.append(i)
+        yield i
+
+
+def test_lazy_story_buffers_only_the_lookahead():
+    pulled = []
+    story = LazyStory(_counting(100, pulled), lookahead=4)
+    assert len(story) == 4 and len(pulled) == 4
+    assert story[0] == 0 and story[:2] == [0, 1]
+    del story[0]
+    assert story[0] == 1
+    story.insert(0, "split")
+    story[0:0] = ["a", "b"]
+    assert story[:4] == ["a", "b", "split", 1]
+    del story[:4]
+    assert story[0] == 2
+    assert len(pulled) <= 8
+
+
+def test_lazy_story_negative_index_and_drain():
+    story = LazyStory(iter(range(5)), lookahead=2)
+    assert story[-1] == 4
+    while story:
+        del story[0]
+    assert len(story) == 0 and not story
+
+
+def _history(n):
+    return [{"player": f"action {i}", "dm": f"The DM answers round {i}.\n\n" + "Lorem ipsum. " * 40}
+            for i in range(n)]
+
+
+def test_stream_pdf_matches_generate_pdf_pages():
+    world = {"title": "Book", "summary": "A world."}
+    history = _history(30)
+    progress = []
+    streamed = stream_pdf(world, iter(history), PDF_LABELS, "English", recap="So far.",
+                          progress=progress.append, total=len(history)).read()
+    whole = generate_pdf(world, history, PDF_LABELS, "English", recap="So far.").read()
+    assert streamed.startswith(b"%PDF")
+    assert streamed.count(b"/Type /Page\n") == whole.count(b"/Type /Page\n") > 1
+    assert progress and progress[-1] == 1.0
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_result_reads_bytes_and_closes_the_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdf_jobs, "PDF_OUTPUT_DIR", str(tmp_path))
+    manager = PdfJobManager()
+    path = tmp_path / "k.pdf"
+    path.write_bytes(b"%PDF-1.4 test")
+    manager._add_result("k", str(path), path.stat().st_size)
+
+    before = len(os.listdir("/proc/self/fd"))
+    for _ in range(20):
+        assert manager.result("k") == b"%PDF-1.4 test"
+    assert len(os.listdir("/proc/self/fd")) <= before
+    assert manager.result("missing") is None
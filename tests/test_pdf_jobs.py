@@ -0,0 +1,62 @@
+# tests/test_pdf_jobs.py
+from concurrent.futures import Future
+
+import pdf_jobs
+from pdf_jobs import PdfJobManager, job_key
+
+
+def _world(**extra):
+    return {"title": "Book", "summary": "A world.", "inventory": {"items": ["x"] * 1000}, **extra}
+
+
+def _history(n):
+    return [{"player": f"p{i}", "dm": f"d{i}"} for i in range(n)]
+
+
+def test_job_key_ignores_world_fields_the_book_does_not_use():
+    base = job_key(_world(), _history(3), "English", session_id="s")
+    assert job_key(_world(inventory={}), _history(3), "English", session_id="s") == base
+    assert job_key(_world(title="Other"), _history(3), "English", session_id="s") != base
+
+
+def test_job_key_with_session_tracks_round_count_not_full_history():
+    history = _history(3)
+    base = job_key(_world(), history, "English", session_id="s")
+    # 同一会话的记录只会追加：只看回合数和最后一回合
+    assert job_key(_world(), [{"player": "?", "dm": "?"}] + history[1:], "English", session_id="s") == base
+    assert job_key(_world(), history + _history(1), "English", session_id="s") != base
+    assert job_key(_world(), history, "English", session_id="t") != base
+    assert job_key(_world(), history, "English", recap="r", session_id="s") != base
+    assert job_key(_world(), history, "中文", session_id="s") != base
+
+
+def test_job_key_without_session_hashes_the_whole_history():
+    history = _history(3)
+    changed = [{"player": "?", "dm": "?"}] + history[1:]
+    assert job_key(_world(), history, "English") != job_key(_world(), changed, "English")
+
+
+class _FakePool:
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args):
+        self.calls.append(args)
+        return Future()
+
+
+def test_submit_sends_only_book_fields_and_dedupes(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdf_jobs, "PDF_OUTPUT_DIR", str(tmp_path))
+    manager = PdfJobManager()
+    pool = _FakePool()
+    manager._progress = {}
+    monkeypatch.setattr(manager, "_ensure_pool", lambda: pool)
+
+    key = manager.submit(_world(), _history(2), {}, "English", session_id="s")
+    again = manager.submit(_world(), _history(2), {}, "English", session_id="s")
+    assert key == again
+    assert len(pool.calls) == 1
+    _, world_arg, history_arg, *_ = pool.calls[0]
+    assert world_arg == {"title": "Book", "summary": "A world."}
+    assert history_arg == _history(2)
+    assert manager.status(key)["state"] == "running"
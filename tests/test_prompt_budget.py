@@ -0,0 +1,68 @@
+# tests/test_prompt_budget.py
+import llm
+from prompt_budget import PromptAssembler, estimate_tokens, fit_to_budget
+
+WORLD = {
+    "main_quest": "找回失落的月光石",
+    "characters": [
+        {"name": "艾琳", "role": "猎人", "short_desc": "沉默的猎人", "base_traits": ["冷静"], "speech_style": "短句"},
+        {"name": "老墨", "role": "酒馆老板", "short_desc": "消息灵通", "base_traits": ["圆滑"], "speech_style": "絮叨"},
+    ],
+}
+
+
+def test_fit_to_budget_keeps_list_prefix():
+    items = [f"线索{i}" * 5 for i in range(50)]
+    out = fit_to_budget(items, 40)
+    assert out.startswith('["线索0')
+    assert estimate_tokens(out) <= 40
+    assert fit_to_budget(items, 0) is None
+
+
+def test_required_sections_survive_and_order_is_preserved():
+    pa = PromptAssembler(budget=140)
+    pa.static("RULES")
+    pa.section("a", "短", priority=0)
+    pa.section("big", "长" * 500, priority=5)
+    pa.section("must", "玩家输入" * 20, required=True)
+    system, user, report = pa.build()
+    assert system == "RULES"
+    assert "玩家输入" * 20 in user
+    assert user.index("= a =") < user.index("= must =")
+    assert str(report["sections"]["big"]).endswith("(trimmed)")
+    assert report["used"] <= 140
+
+
+def test_node_round_prompt_has_a_stable_system_prefix():
+    history = [{"player": f"动作{i}", "dm": f"叙述{i}"} for i in range(5)]
+    s1, u1 = llm.build_node_round_prompt(WORLD, "雾中出现线索", "调查", "中文", recent=history[-3:])
+    s2, u2 = llm.build_node_round_prompt(WORLD, "危机加深", "逃跑", "中文", recent=history[-2:])
+    assert s1 == s2 and s1.startswith(llm.DM_SYSTEM.strip("\n"))
+    assert "雾中出现线索" in u1 and "调查" in u1 and "找回失落的月光石" in u1
+    # 最近回合最新在前
+    assert u1.index("动作4") < u1.index("动作2")
+
+
+def test_node_round_prompt_trims_context_not_the_action():
+    history = [{"player": "长动作" * 200, "dm": "长叙述" * 400} for _ in range(3)]
+    _, user = llm.build_node_round_prompt(WORLD, "节点", "玩家的关键动作", "中文", recent=history,
+                                          token_budget=200)
+    assert "玩家的关键动作" in user and "节点" in user
+    assert estimate_tokens(user) < 400
+
+
+def test_adventure_uses_the_assembled_node_round_prompt(monkeypatch):
+    import adventure
+
+    seen = {}
+
+    def fake_call(system_prompt, user_prompt, **kwargs):
+        seen["system"], seen["user"] = system_prompt, user_prompt
+        return "叙述"
+
+    monkeypatch.setattr(adventure, "call_gpt", fake_call)
+    state = {"adventure": {"history": [{"player": "(start)", "dm": "开场"}], "round": 1, "options": []}}
+    mgr = adventure.AdventureManager(dict(WORLD), "中文", state)
+    assert mgr.render_node_round("节点摘要", "四处看看") == "叙述"
+    assert "NODE_ROUND" not in seen["system"] and "【本回合发生的事件】" in seen["system"]
+    assert "开场" in seen["user"] and "四处看看" in seen["user"]
@@ -0,0 +1,117 @@
+# tests/test_world_cache.py
+import copy
+
+from db import init_db, unit_of_work
+from world_cache import WorldTemplateCache, approx_size, open_world, session_view, world_cache
+from world_repo import WorldRepository
+
+
+def _template(tag, pad=0):
+    return {"title": tag, "blob": "x" * pad, "story_nodes": {"setup": {"summary": tag}}}
+
+
+def _loader(template, calls):
+    def load():
+        calls.append(template["title"])
+        return template
+    return load
+
+
+def test_hits_misses_and_missing_worlds_are_not_cached():
+    cache = WorldTemplateCache()
+    calls = []
+    a = _template("a")
+    assert cache.get(("a", 1), _loader(a, calls)) is a
+    assert cache.get(("a", 1), _loader(a, calls)) is a
+    assert calls == ["a"]
+
+    assert cache.get(("gone", 1), lambda: None) is None
+    assert cache.get(("gone", 1), lambda: None) is None
+    assert cache.stats() == {"entries": 1, "bytes": approx_size(a), "hits": 1, "misses": 3, "evictions": 0}
+
+
+def test_lru_eviction_by_entry_count():
+    cache = WorldTemplateCache(max_entries=2)
+    calls = []
+    for tag in ("a", "b"):
+        cache.get((tag, 1), _loader(_template(tag), calls))
+    cache.get(("a", 1), _loader(_template("a"), calls))      # a 变成最近使用
+    cache.get(("c", 1), _loader(_template("c"), calls))      # 淘汰最久未用的 b
+
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+    cache.get(("a", 1), _loader(_template("a"), calls))
+    cache.get(("b", 1), _loader(_template("b"), calls))
+    assert calls == ["a", "b", "c", "b"]
+
+
+def test_lru_eviction_by_bytes():
+    size = approx_size(_template("a", pad=1000))
+    cache = WorldTemplateCache(max_bytes=int(size * 2.5), max_entries=100)
+    calls = []
+    for tag in ("a", "b", "c"):
+        cache.get((tag, 1), _loader(_template(tag, pad=1000), calls))
+
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+    assert stats["bytes"] <= cache.max_bytes
+    cache.get(("a", 1), _loader(_template("a", pad=1000), calls))
+    assert calls == ["a", "b", "c", "a"]
+
+    # 单个模板比整个缓存还大：照常返回，但不缓存
+    huge = _template("huge", pad=size * 3)
+    assert cache.get(("huge", 1), _loader(huge, calls)) is huge
+    assert cache.stats()["bytes"] <= cache.max_bytes
+    cache.get(("huge", 1), _loader(huge, calls))
+    assert calls[-2:] == ["huge", "huge"]
+
+
+def test_invalidate_by_name_and_all():
+    cache = WorldTemplateCache()
+    calls = []
+    for key in (("a", 1), ("a", 2), ("b", 1)):
+        cache.get(key, _loader(_template(key[0]), calls))
+
+    cache.invalidate("a")
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == approx_size(_template("b"))
+    cache.get(("a", 2), _loader(_template("a"), calls))
+    assert calls.count("a") == 3
+
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+
+
+def test_session_view_copies_mutable_parts_and_shares_the_rest():
+    template = {"title": "T", "story_nodes": {"setup": {"summary": "s"}},
+                "world_state": {"day": 1}, "characters": [{"name": "Ann", "stats": {"trust": 0}}]}
+    before = copy.deepcopy(template)
+
+    view = session_view(template)
+    view["world_state"]["day"] = 9
+    view["characters"][0]["stats"]["trust"] = 5
+    view["title"] = "changed"
+
+    assert template == before
+    assert view["story_nodes"] is template["story_nodes"]
+
+
+def test_open_world_views_do_not_leak_into_the_cached_template():
+    init_db()
+    world = {"title": "Cached", "world_state": {"day": 1}, "player_stats": {"hp": 10},
+             "characters": [{"name": "Ann", "personality": "calm", "stats": {"trust": 0}}],
+             "inventory": {"resources": {}, "items": [], "lore": []},
+             "adventure_state": {"progress": 0}}
+    with unit_of_work(write=True) as session:
+        wid, _ = WorldRepository(session).save("world-cache", world)
+    world_cache.invalidate("world-cache")
+
+    first = open_world(wid, "world-cache", 1.0)
+    first["world_state"]["day"] = 42
+    first["characters"][0]["stats"]["trust"] = 7
+    first["inventory"]["items"].append("key")
+
+    second = open_world(wid, "world-cache", 1.0)
+    assert second["world_state"]["day"] == 1
+    assert second["characters"][0]["stats"]["trust"] == 0
+    assert second["inventory"]["items"] == []
+    assert world_cache.stats()["hits"] >= 1
@@ -0,0 +1,59 @@
+# tests/test_world_generation.py
+import asyncio
+import threading
+
+import pytest
+
+import world
+
+
+def test_stage_graph_runs_independent_stages_concurrently():
+    order = []
+
+    def stage(name, delay):
+        async def fn(results):
+            order.append(f"{name}:start")
+            await asyncio.sleep(delay)
+            order.append(f"{name}:end")
+            return name
+        return fn
+
+    timings = {}
+    results = asyncio.run(world.run_stage_graph({
+        "a": ((), stage("a", 0.01)),
+        "b": (("a",), stage("b", 0.05)),
+        "c": (("a",), stage("c", 0.05)),
+    }, timings))
+    assert results == {"a": "a", "b": "b", "c": "c"}
+    assert order.index("a:end") < order.index("b:start")
+    # b、c 都在对方结束前开始
+    assert order.index("c:start") < order.index("b:end")
+    assert set(timings) == {"a", "b", "c"}
+
+
+def test_stage_graph_rejects_unknown_dependencies():
+    async def fn(results):
+        return None
+
+    with pytest.raises(ValueError):
+        asyncio.run(world.run_stage_graph({"a": (("missing",), fn)}))
+
+
+def test_generate_world_keeps_cpu_work_off_the_llm_loop(monkeypatch):
+    threads = []
+    real = world.build_clue_index
+
+    def spy(world_obj):
+        threads.append(threading.current_thread().name)
+        return real(world_obj)
+
+    monkeypatch.setattr(world, "build_clue_index", spy)
+    timings = {}
+    world_obj = world.generate_world("猫猫世界", "test_world", "中文", timings)
+
+    assert world_obj is not None
+    assert set(world_obj["story_nodes"]) >= {"setup", "finale"}
+    assert "clue_index" in world_obj and "rng_seed" in world_obj
+    assert all("personality" in ch for ch in world_obj["characters"])
+    assert {"base", "base_json", "quest", "nodes", "player", "total"} <= set(timings)
+    assert threads and "llm-loop" not in threads
@@ -0,0 +1,104 @@
+# tests/test_world_repo.py
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from db import Base, WorldStateEntry, make_engine, unit_of_work
+from world import coerce_story_nodes
+from world_repo import WorldRepository
+
+
+@pytest.fixture
+def factory(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'repo.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine, expire_on_commit=False)
+    engine.dispose()
+
+
+def _round_trip(factory, world_obj, name="w"):
+    with unit_of_work(factory) as session:
+        world_id, _ = WorldRepository(session).save(name, world_obj)
+    with unit_of_work(factory) as session:
+        return WorldRepository(session).load(world_id)
+
+
+def _world(**overrides):
+    world = {
+        "title": "T",
+        "locations": [{"name": "Gate", "description": "d"}],
+        "characters": [{"name": "Ann", "role": "guard", "stats": {"mood": "calm", "trust": 3, "fear": 0}}],
+        "story_nodes": {
+            "setup": {"summary": "s", "options": [{"text": "go", "goto": "twist"}], "mood": "dark"},
+            "twist": {"summary": "t", "options": []},
+        },
+        "world_state": {"tension": 1, "day": 2, "alarm": False},
+        "inventory": {"resources": {"gold": 10}, "items": ["rope"], "lore": []},
+    }
+    world.update(overrides)
+    return world
+
+
+def test_round_trip_keeps_world_and_key_order(factory):
+    world = _world()
+    loaded = _round_trip(factory, world)
+    assert loaded == world
+    assert list(loaded["world_state"]) == ["tension", "day", "alarm"]
+    assert list(loaded["characters"][0]["stats"]) == ["mood", "trust", "fear"]
+
+
+def test_resave_without_changes_touches_nothing(factory):
+    world = _world()
+    _round_trip(factory, world)
+    with unit_of_work(factory) as session:
+        _, changed = WorldRepository(session).save("w", world, touch=False)
+    assert changed == 0
+
+
+def test_malformed_nodes_and_options_do_not_crash(factory):
+    nodes = {
+        "setup": "just a string",
+        "twist": {"summary": {"text": "nested"}, "options": ["go left", {"text": "x", "goto": 3}]},
+        "crisis": {"summary": "c", "options": "none"},
+        "finale": {"summary": "f", "options": [{"text": "end"}]},
+    }
+    world = _world(story_nodes=nodes)
+    assert _round_trip(factory, world) == world
+
+
+def test_malformed_top_level_shapes_are_kept(factory):
+    world = _world(story_nodes=["setup"], characters={"Ann": {}}, world_state="calm", inventory=None)
+    assert _round_trip(factory, world) == world
+
+
+def test_non_dict_characters_and_non_int_stats(factory):
+    world = _world(characters=["Ann", {"name": "Bo", "stats": {"trust": "high", "health": True}}])
+    assert _round_trip(factory, world) == world
+
+
+def test_empty_and_scalar_inventory_containers(factory):
+    inventory = {"resources": {}, "items": [], "lore": [], "flags": {}, "gold": 5, "notes": "x"}
+    loaded = _round_trip(factory, _world(inventory=inventory))
+    assert loaded["inventory"] == inventory
+
+
+def test_rows_without_position_load_in_key_order(factory):
+    # 旧库补列后 position 为空
+    with unit_of_work(factory) as session:
+        world_id, _ = WorldRepository(session).save("w", _world())
+        session.query(WorldStateEntry).update({"position": None})
+    with unit_of_work(factory) as session:
+        loaded = WorldRepository(session).load(world_id)
+    assert list(loaded["world_state"]) == ["alarm", "day", "tension"]
+
+
+def test_coerce_story_nodes():
+    raw = {
+        "setup": "start here",
+        "twist": {"summary": None, "options": ["go", {"text": 1, "goto": 2}, 5]},
+        "bad": 42,
+    }
+    assert coerce_story_nodes(raw) == {
+        "setup": {"summary": "start here", "options": []},
+        "twist": {"summary": "", "options": [{"text": "go", "goto": None}, {"text": "1", "goto": None}]},
+    }
+    assert coerce_story_nodes(["setup"]) == {}
@@ -0,0 +1,108 @@
+# tests/test_world_tick.py
+import copy
+
+import pytest
+
+import adventure
+import world_tick
+from adventure import AdventureManager
+from db import init_db, unit_of_work, SessionLocal
+from world_repo import WorldRepository
+
+
+def _state():
+    return {
+        "world_state": {"tension": 50, "corruption": 10, "time_of_day": 0, "weather": "clear", "day": 1},
+        "adventure_state": {"story_progress": 0, "current_node": "setup"},
+    }
+
+
+def test_tick_is_pure_and_deterministic():
+    state = _state()
+    before = copy.deepcopy(state)
+    a = world_tick.tick(state, 42, 3)
+    b = world_tick.tick(state, 42, 3)
+    assert a == b
+    assert state == before
+    assert a["world_state"]["time_of_day"] == 1
+    assert a["world_state"]["day"] == 1
+    assert world_tick.PROGRESS_MIN <= a["adventure_state"]["story_progress"] <= world_tick.PROGRESS_MAX
+    assert a["adventure_state"]["chapter"] == world_tick.chapter_for(a["adventure_state"]["story_progress"])
+
+
+def test_replay_matches_sequential_ticks():
+    state = _state()
+    for round_no in range(1, 11):
+        state = world_tick.tick(state, 7, round_no)
+    assert world_tick.replay(_state(), 7, 10) == state
+    rounds = [r for _, (r, _) in zip(range(3), world_tick.iter_replay(_state(), 7, start_round=5))]
+    assert rounds == [5, 6, 7]
+
+
+def test_session_seed_is_derived_from_world_seed_and_session():
+    assert world_tick.session_seed(1, "a") == world_tick.session_seed(1, "a")
+    assert world_tick.session_seed(1, "a") != world_tick.session_seed(1, "b")
+    assert world_tick.session_seed(1, "a") != world_tick.session_seed(2, "a")
+    assert 0 <= world_tick.session_seed(1, "a") < 2 ** 63
+
+
+def _world():
+    nodes = {}
+    chain = ["setup", "first_clue", "twist", "crisis", "pre_finale", "finale"]
+    for key, nxt in zip(chain, chain[1:] + [None]):
+        nodes[key] = {"summary": f"{key} summary", "options": [{"text": f"go {nxt}", "goto": nxt}] if nxt else []}
+    return {
+        "title": "Tick",
+        "rng_seed": 1234,
+        "characters": [],
+        "locations": [],
+        "story_nodes": nodes,
+        "world_state": _state()["world_state"],
+        "adventure_state": {"story_progress": 0, "chapter": 0, "final_triggered": False},
+        "memory": {"info_given": []},
+    }
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    init_db()
+    with unit_of_work() as session:
+        world_id, _ = WorldRepository(session).save("tick-world", _world())
+    with unit_of_work() as session:
+        world_obj = WorldRepository(session).load(world_id)
+    session_state = {"adventure": {"history": [], "round": 0, "options": [], "world_id": world_id}}
+    monkeypatch.setattr(adventure, "SUMMARY_EVERY", 100)
+    return AdventureManager(world_obj, "English", session_state)
+
+
+def test_rounds_drive_ticks_and_log_replays(manager):
+    state = manager.state
+    assert state["rng_seed"] == world_tick.session_seed(1234, state["session_id"])
+
+    manager.start_adventure()
+    progress = [0]
+    for _ in range(4):
+        manager.next_round(state["options"][0] if state["options"] else "wait")
+        progress.append(manager.world_obj["adventure_state"]["story_progress"])
+    assert progress == sorted(progress) and progress[-1] > 0
+
+    session = SessionLocal()
+    try:
+        replayed = list(world_tick.replay_session(session, state["session_id"]))
+    finally:
+        session.close()
+    assert [seq for seq, _, _ in replayed] == [2, 3, 4, 5]
+    for _, ticked, logged in replayed:
+        assert ticked["world_state"] == logged["world_state"]
+        assert ticked["adventure_state"]["story_progress"] == logged["adventure_state"]["story_progress"]
+    assert replayed[-1][1]["world_state"] == manager.world_obj["world_state"]
+
+
+def test_node_round_limit_drives_jump_options(manager, monkeypatch):
+    monkeypatch.setattr(adventure, "NODE_ROUND_LIMIT", 1)
+    manager.start_adventure()
+    manager.next_round("look")
+    event = manager.next_round("look again")
+    assert event["options"] == ["go first_clue"]
+    manager.next_round("go first_clue")
+    assert manager.world_obj["adventure_state"]["current_node"] == "first_clue"
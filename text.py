@@ -37,6 +37,10 @@ TEXT = {
         "中文": "先写一句话创意。",
         "English": "Please enter a one-line idea first."
     },
+    "generate_world_failed": {
+        "中文": "世界生成失败：AI 服务暂时不可用，请稍后再试。",
+        "English": "World generation failed: the AI service is temporarily unavailable. Please try again."
+    },
     "section_world": {
         "中文": "2) 你的世界",
         "English": "2) Your Worlds"
@@ -45,6 +49,26 @@ TEXT = {
         "中文": "选择已有世界",
         "English": "Select an existing world"
     },
+    "search_world": {
+        "中文": "按名字前缀搜索世界",
+        "English": "Search worlds by name prefix"
+    },
+    "world_page": {
+        "中文": "页码",
+        "English": "Page"
+    },
+    "resume_session": {
+        "中文": "继续之前的冒险",
+        "English": "Resume a previous adventure"
+    },
+    "resume_button": {
+        "中文": "继续这次冒险",
+        "English": "Resume this adventure"
+    },
+    "session_rounds": {
+        "中文": "回合",
+        "English": "rounds"
+    },
     "new_world_label": {
         "中文": "-- 新建 --",
         "English": "-- New --"
@@ -121,6 +145,14 @@ TEXT = {
         "中文": "下载画册 (PDF)",
         "English": "Download Artbook (PDF)"
     },
+    "pdf_rendering": {
+        "中文": "画册排版中……",
+        "English": "Typesetting the artbook…"
+    },
+    "pdf_failed": {
+        "中文": "画册生成失败：",
+        "English": "Artbook export failed:"
+    },
     "no_world_for_export": {
         "中文": "请先选择一个已生成的世界，然后再导出画册。",
         "English": "Please select a generated world before exporting the artbook."
@@ -133,6 +165,7 @@ TEXT = {
 
 PDF_LABELS = {
     "summary": {"中文": "世界简介", "English": "Summary"},
+    "recap": {"中文": "前情提要", "English": "Story So Far"},
     "log": {"中文": "冒险记录", "English": "Adventure Log"},
     "player": {"中文": "玩家", "English": "Player"},
     "dm": {"中文": "DM", "English": "DM"},
@@ -1,11 +1,18 @@
 # world.py
 import json
+import hashlib
 import re
 import time
 import random
-from db import SessionLocal, World
-from llm import call_gpt, WORLD_GEN_SYSTEM
+import asyncio
+from db import unit_of_work
+from world_repo import WorldRepository
+from llm import acall_gpt, run_sync, is_gpt_error, WORLD_GEN_SYSTEM
 from utils import extract_json
+from llm_log import log_debug
+from archetypes import engine as archetype_engine
+from clue_index import build_clue_index
+from world_tick import new_seed
 
 def safe_get(d, key, default):
     """安全取值，避免 None、空字符串、缺失 key 的问题"""
@@ -17,14 +24,85 @@ def safe_get(d, key, default):
     return val
 
 
-def generate_world(idea, world_name, lang_ui):
+def coerce_story_nodes(raw):
     """
-    优化后的世界生成流程：
-    1) GPT 生成世界结构（世界 + 角色 + 地点 + initial_state）
-    2) GPT 生成 main_quest
-    3) GPT 生成玩家角色（player_profile + player_stats）
-    4) 合并成 world_template 并初始化系统字段
+    把 GPT 返回的 story_nodes 整理成 {key: {"summary": str, "options": [{"text", "goto"}]}}。
+    字符串节点当作 summary，字符串选项当作 text；其他无法识别的节点 / 选项丢弃
     """
+    if not isinstance(raw, dict):
+        return {}
+    out = {}
+    for key, node in raw.items():
+        if isinstance(node, str):
+            node = {"summary": node}
+        if not isinstance(node, dict):
+            continue
+        options = []
+        for opt in node.get("options") if isinstance(node.get("options"), list) else []:
+            if isinstance(opt, str):
+                opt = {"text": opt}
+            if not isinstance(opt, dict):
+                continue
+            goto = opt.get("goto")
+            options.append({"text": str(opt.get("text") or ""), "goto": goto if isinstance(goto, str) else None})
+        summary = node.get("summary")
+        out[str(key)] = {**node, "summary": "" if summary is None else str(summary), "options": options}
+    return out
+
+
+async def run_stage_graph(stages, timings=None):
+    """
+    按依赖图执行生成阶段：依赖都完成的阶段并发运行。
+    stages: {name: (deps, async fn(results))}，results 为已完成阶段的输出
+    timings: 可选 dict，写入每个阶段自身耗时（秒）
+    """
+    for name, (deps, _) in stages.items():
+        missing = [d for d in deps if d not in stages]
+        if missing:
+            raise ValueError(f"stage {name} depends on unknown stages: {missing}")
+
+    results = {}
+    tasks = {}
+
+    async def run(name):
+        deps, fn = stages[name]
+        if deps:
+            await asyncio.gather(*(tasks[d] for d in deps))
+        t0 = time.perf_counter()
+        results[name] = await fn(results)
+        if timings is not None:
+            timings[name] = round(time.perf_counter() - t0, 3)
+
+    # 先把所有 task 建好再让出控制权，run() 里才能找到依赖的 task
+    for name in stages:
+        tasks[name] = asyncio.ensure_future(run(name))
+    await asyncio.gather(*tasks.values())
+    return results
+
+
+def generate_world(idea, world_name, lang_ui, timings=None):
+    """
+    同步入口（app.py 使用），实际在 LLM 事件循环上执行 agenerate_world。
+    timings: 可选 dict，返回各阶段耗时与总耗时
+    GPT 不可用（超时 / 熔断等）导致基础世界生成失败时返回 None
+    """
+    return run_sync(agenerate_world(idea, world_name, lang_ui, timings))
+
+
+async def agenerate_world(idea, world_name, lang_ui, timings=None):
+    """
+    优化后的世界生成流程（阶段依赖图）：
+    1) base：GPT 生成世界结构（世界 + 角色 + 地点 + initial_state）
+    2) 以下三个阶段只依赖 base，并发执行：
+       - quest：GPT 生成 main_quest
+       - nodes：GPT 生成六段 story_nodes
+       - player：GPT 生成玩家角色（player_profile + player_stats）
+    3) 合并成 world_template 并初始化系统字段
+    总耗时 ≈ 两次 GPT 延迟，而不是四次
+    本协程跑在所有会话共享的 LLM 事件循环上：JSON 解析 / 序列化、性格扩展、
+    线索词典这些 CPU 工作都用 asyncio.to_thread 放到线程里，不阻塞其他会话的请求
+    """
+    t_start = time.perf_counter()
 
     # ------------------------------
     # 1. GPT：生成世界基础结构
@@ -87,38 +165,57 @@ def generate_world(idea, world_name, lang_ui):
         }}
     """
 
-    out = call_gpt(WORLD_GEN_SYSTEM, world_prompt, max_tokens=1600)
-    data = extract_json(out)
-
-    # 兜底（极少情况）
-    if not data:
-        data = {
-            "title": world_name,
-            "summary": out,
-            "initial_hook": "",
-            "locations": [],
-            "characters": [],
-            "world_logic": {},
-            "initial_state": {}
-        }
+    async def base_stage(results):
+        out = await acall_gpt(WORLD_GEN_SYSTEM, world_prompt, max_tokens=1600, site="world.base")
+        if is_gpt_error(out):
+            return None
+        data = await asyncio.to_thread(extract_json, out)
+
+        # 兜底（极少情况）
+        if not data:
+            data = {
+                "title": world_name,
+                "summary": out,
+                "initial_hook": "",
+                "locations": [],
+                "characters": [],
+                "world_logic": {},
+                "initial_state": {}
+            }
+        return data
+
+    # 后面三个阶段的 prompt 都要嵌入 base 的 JSON 文本：只序列化一次
+    async def base_json_stage(results):
+        if results["base"] is None:
+            return None
+        return await asyncio.to_thread(json.dumps, results["base"], ensure_ascii=False)
 
     # ------------------------------
     # 2. GPT：一句话主线
     # ------------------------------
-    quest_prompt = f"""
+    async def quest_stage(results):
+        if results["base"] is None:
+            return ""
+        quest_prompt = f"""
         根据以下世界内容写一句话主线任务，不要剧情，只要任务目标：
 
-        {json.dumps(data, ensure_ascii=False)}
+        {results["base_json"]}
 
         只输出一句话。
     """
-    main_quest = call_gpt(WORLD_GEN_SYSTEM, quest_prompt, max_tokens=60).strip()
-    data["main_quest"] = main_quest
+        main_quest = await acall_gpt(WORLD_GEN_SYSTEM, quest_prompt, max_tokens=60, cache=True,
+                                      site="world.quest")
+        if is_gpt_error(main_quest):
+            return ""
+        return main_quest.strip()
 
     # ------------------------------
     # 2.5 GPT：生成六段剧情节点 story_nodes
     # ------------------------------
-    node_prompt = f"""
+    async def nodes_stage(results):
+        if results["base"] is None:
+            return None
+        node_prompt = f"""
         你需要为一个短篇冒险生成 6 个固定剧情节点，用于推动完整故事。
         必须输出严格 JSON，不得换行于 summary 内，不得包含任何回车符或多行文本。
         每个 summary 必须是单行句子。
@@ -135,7 +232,7 @@ def generate_world(idea, world_name, lang_ui):
         finale → options = []
 
         世界信息如下：
-        {json.dumps(data, ensure_ascii=False)}
+        {results["base_json"]}
 
         输出严格 JSON：
 
@@ -167,29 +264,31 @@ def generate_world(idea, world_name, lang_ui):
         }}
         """
 
-    node_raw = call_gpt(WORLD_GEN_SYSTEM, node_prompt, max_tokens=800)
-    story_nodes = extract_json(node_raw) or {}
-
-    if not story_nodes or "setup" not in story_nodes:
-        story_nodes = {
-            "setup": {"summary": "故事开始于玩家进入此世界。", "options": [{"text": "继续前进", "goto": "first_clue"}]},
-            "first_clue": {"summary": "玩家发现一个神秘的线索。", "options": [{"text": "继续调查", "goto": "twist"}]},
-            "twist": {"summary": "玩家发现一个隐藏的真相。", "options": [{"text": "面对真相", "goto": "crisis"}]},
-            "crisis": {"summary": "危机加深，风险上升。", "options": [{"text": "寻找突破口", "goto": "pre_finale"}]},
-            "pre_finale": {"summary": "最终决战前的准备。", "options": [{"text": "进入最终地点", "goto": "finale"}]},
-            "finale": {"summary": "故事的结局揭晓。", "options": []}
-        }
-
-    data["story_nodes"] = story_nodes
+        node_raw = await acall_gpt(WORLD_GEN_SYSTEM, node_prompt, max_tokens=800, site="world.nodes")
+        story_nodes = coerce_story_nodes(await asyncio.to_thread(extract_json, node_raw))
+
+        if not story_nodes or "setup" not in story_nodes:
+            story_nodes = {
+                "setup": {"summary": "故事开始于玩家进入此世界。", "options": [{"text": "继续前进", "goto": "first_clue"}]},
+                "first_clue": {"summary": "玩家发现一个神秘的线索。", "options": [{"text": "继续调查", "goto": "twist"}]},
+                "twist": {"summary": "玩家发现一个隐藏的真相。", "options": [{"text": "面对真相", "goto": "crisis"}]},
+                "crisis": {"summary": "危机加深，风险上升。", "options": [{"text": "寻找突破口", "goto": "pre_finale"}]},
+                "pre_finale": {"summary": "最终决战前的准备。", "options": [{"text": "进入最终地点", "goto": "finale"}]},
+                "finale": {"summary": "故事的结局揭晓。", "options": []}
+            }
+        return story_nodes
 
     # ------------------------------
     # 3. GPT：生成玩家角色
     # ------------------------------
-    player_prompt = f"""
+    async def player_stage(results):
+        if results["base"] is None:
+            return None
+        player_prompt = f"""
         根据以下世界内容，为这个世界生成一个玩家角色。
 
         世界信息：
-        {json.dumps(data, ensure_ascii=False)}
+        {results["base_json"]}
 
         输出严格 JSON：
 
@@ -215,28 +314,55 @@ def generate_world(idea, world_name, lang_ui):
         }}
     """
 
-    player_out = call_gpt(WORLD_GEN_SYSTEM, player_prompt, max_tokens=800)
-    player_data = extract_json(player_out)
-
-    # 玩家角色兜底
-    if not player_data:
-        player_data = {
-            "player_profile": {
-                "name": "无名旅人" if lang_ui == "中文" else "Nameless Wanderer",
-                "background": "一个没有明确过去的旅人。",
-                "profession": "wanderer",
-                "role_in_world": "outsider",
-                "traits": ["curious"],
-                "weakness": ["naive"]
-            },
-            "player_stats": {
-                "health": 100,
-                "sanity": 100,
-                "mana": 0,
-                "custom": {"力量": 5, "敏捷": 5, "智力": 5}
+        player_out = await acall_gpt(WORLD_GEN_SYSTEM, player_prompt, max_tokens=800, site="world.player")
+        player_data = await asyncio.to_thread(extract_json, player_out)
+
+        # 玩家角色兜底
+        if not player_data:
+            player_data = {
+                "player_profile": {
+                    "name": "无名旅人" if lang_ui == "中文" else "Nameless Wanderer",
+                    "background": "一个没有明确过去的旅人。",
+                    "profession": "wanderer",
+                    "role_in_world": "outsider",
+                    "traits": ["curious"],
+                    "weakness": ["naive"]
+                },
+                "player_stats": {
+                    "health": 100,
+                    "sanity": 100,
+                    "mana": 0,
+                    "custom": {"力量": 5, "敏捷": 5, "智力": 5}
+                }
             }
-        }
+        return player_data
+
+    results = await run_stage_graph({
+        "base": ((), base_stage),
+        "base_json": (("base",), base_json_stage),
+        "quest": (("base", "base_json"), quest_stage),
+        "nodes": (("base", "base_json"), nodes_stage),
+        "player": (("base", "base_json"), player_stage),
+    }, timings)
 
+    data = results["base"]
+    if data is None:
+        return None
+    data["main_quest"] = results["quest"]
+    data["story_nodes"] = results["nodes"]
+
+    world_template = await asyncio.to_thread(build_world_template, data, results["player"], world_name, lang_ui)
+
+    if timings is not None:
+        timings["total"] = round(time.perf_counter() - t_start, 3)
+
+    return world_template
+
+
+def build_world_template(data, player_data, world_name, lang_ui):
+    """
+    合并各阶段输出，初始化系统字段，扩展 NPC 性格、建线索词典（纯 CPU，不调 GPT）
+    """
     # ------------------------------
     # 4. 构造最终 world_template（无重复字段）
     # ------------------------------
@@ -295,90 +421,63 @@ def generate_world(idea, world_name, lang_ui):
         },
 
         # 系统字段：同伴
-        "companions": []
+        "companions": [],
+
+        # 世界随机种子：会话种子由它派生，世界演化可重放
+        "rng_seed": new_seed()
     }
 
     # 如果世界没有魔法，强制 mana = 0
     if not world_template["world_logic"].get("allow_magic", False):
         world_template["player_stats"]["mana"] = 0
 
-    with open("gpt_log.txt", "a", encoding="utf-8") as f:
-        f.write("\n\n==================== FIRST CHECK ====================\n")
-        f.write(json.dumps(data["story_nodes"], ensure_ascii=False, indent=2))
-        f.write("\n==================================================\n")
-        f.write(json.dumps(world_template["story_nodes"], ensure_ascii=False, indent=2))
-        f.write("\n==================================================\n")
+    # NPC 性格扩展只在生成时做一次，结果随世界一起保存
+    ensure_npc_personalities(world_template)
+    # 线索词典：地点 / 角色 / 传说 / 剧情节点里的专有名词
+    world_template["clue_index"] = build_clue_index(world_template)
+
+    log_debug("world_story_nodes", title=world_template["title"], story_nodes=world_template["story_nodes"])
 
     return world_template
 
 
 
 def enrich_npc_personality(npc):
-    """根据角色 role 和 desc 自动扩展 NPC 性格（智能补全层）"""
-
-    role = npc.get("role", "")
-    desc = npc.get("desc", "")
-    traits = npc.get("base_traits", [])[:]    # 复制 GPT 的基础性格
-    speech_style = npc.get("speech_style", "")
-
-    # ---- 职业原型扩展（极少规则，但覆盖99%的情况） ----
-    if any(key in role for key in ["战士", "斗士", "护卫", "勇士"]):
-        traits += ["勇猛", "直接"]
-        speech_style = speech_style or "声音洪亮，直截了当"
-
-    if any(key in role for key in ["刺客", "影", "潜行", "追踪"]):
-        traits += ["冷静", "隐秘"]
-        speech_style = speech_style or "低声、短句、不愿多说"
-
-    if any(key in role for key in ["法师", "巫师", "魔法"]):
-        traits += ["理性", "神秘"]
-        speech_style = speech_style or "语气平淡，带讲解性质"
-
-    if any(key in role for key in ["商人", "交易", "经纪"]):
-        traits += ["圆滑", "机敏"]
-        speech_style = speech_style or "客套、谨慎、观察对方反应"
+    """根据角色 role 和 desc 自动扩展 NPC 性格（智能补全层，规则表见 archetypes.py）"""
+    npc["personality"] = archetype_engine.personality(npc)
+    return npc
 
-    if any(key in role for key in ["领袖", "国王", "指挥", "将军"]):
-        traits += ["权威", "果断"]
-        speech_style = speech_style or "稳重、有命令感"
 
-    # ---- 根据描述自动填词 ----
-    if "阴影" in desc or "黑暗" in desc:
-        traits += ["神秘", "危险"]
+# 规则有改动时加一，已保存的性格会在下次打开世界时重新计算
+PERSONALITY_RULES_VERSION = 3
 
-    if "善良" in desc:
-        traits += ["温和"]
 
-    if "愤怒" in desc or "暴躁" in desc:
-        traits += ["冲动"]
+def personality_key(npc):
+    """性格扩展输入（role / desc / base_traits / speech_style 等 + 规则版本）的内容哈希"""
+    source = {k: npc.get(k) for k in ("role", "desc", "short_desc", "base_traits", "speech_style")}
+    source["rules"] = PERSONALITY_RULES_VERSION
+    raw = json.dumps(source, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
 
-    # ---- 安全兜底 ----
-    if len(traits) < 2:
-        traits.append("中性")
 
-    npc["personality"] = {
-        "traits": list(set(traits)),
-        "speech_style": speech_style or "正常语速、普通语气",
-    }
-    return npc
-
-
-# 保存世界到数据库（同名覆盖）
+def ensure_npc_personalities(world_obj):
+    """
+    只对输入有变化（或从未扩展过）的 NPC 做性格扩展，返回重新计算的个数。
+    没有变化时只做哈希比较，不跑规则
+    """
+    changed = 0
+    for npc in world_obj.get("characters", []):
+        key = personality_key(npc)
+        if npc.get("personality_key") == key and "personality" in npc:
+            continue
+        enrich_npc_personality(npc)
+        npc["personality_key"] = key
+        changed += 1
+    return changed
+
+
+# 保存世界到数据库（同名覆盖；只写有变化的行）
 def save_world_to_db(world_name, world_obj):
 
-    session = SessionLocal()
-    existing = session.query(World).filter_by(name=world_name).first()
-
-    if existing:
-        existing.data = json.dumps(world_obj, ensure_ascii=False)
-        existing.created_at = time.time()
-    else:
-        new_world = World(
-            name=world_name,
-            data=json.dumps(world_obj, ensure_ascii=False),
-            created_at=time.time()
-        )
-        session.add(new_world)
-
-    session.commit()
-    session.close()
+    with unit_of_work(write=True) as session:
+        WorldRepository(session).save(world_name, world_obj)
@@ -0,0 +1,145 @@
+# world_cache.py
+import os
+import sys
+import copy
+import threading
+from collections import OrderedDict
+
+from db import unit_of_work
+from world import ensure_npc_personalities
+from clue_index import ensure_clue_index
+from world_repo import WorldRepository, load_world_data
+from adventure_store import MUTABLE_WORLD_KEYS
+
+# ---------------------------
+# 配置（环境变量可覆盖）
+# ---------------------------
+WORLD_CACHE_MAX_BYTES = int(os.getenv("WORLD_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+WORLD_CACHE_MAX_ENTRIES = int(os.getenv("WORLD_CACHE_MAX_ENTRIES", "128"))
+
+
+def approx_size(obj):
+    """解析后对象的大致内存占用（递归 sys.getsizeof，共享对象只算一次）"""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        cur = stack.pop()
+        if id(cur) in seen:
+            continue
+        seen.add(id(cur))
+        total += sys.getsizeof(cur)
+        if isinstance(cur, dict):
+            stack.extend(cur.keys())
+            stack.extend(cur.values())
+        elif isinstance(cur, (list, tuple, set)):
+            stack.extend(cur)
+    return total
+
+
+class WorldTemplateCache:
+    """
+    进程级 LRU：缓存解析好的世界模板，所有浏览器会话共享同一份。
+    key = (name, created_at)，重新生成同名世界会得到新 key，旧模板自然被淘汰。
+    模板只读：会话通过 session_view() 拿到自己的可变部分。
+    """
+
+    def __init__(self, max_bytes=WORLD_CACHE_MAX_BYTES, max_entries=WORLD_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._items = OrderedDict()       # key -> (template, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading = {}                # key -> Lock，同一个世界并发未命中只加载一次
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader):
+        """命中直接返回模板；未命中调用 loader() 加载（返回 None 表示不存在，不缓存）"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                item = self._items.get(key)
+                if item is not None:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return item[0]
+                self.misses += 1
+            try:
+                template = loader()
+                if template is not None:
+                    self._put(key, template)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return template
+
+    def _put(self, key, template):
+        size = approx_size(template)
+        with self._lock:
+            if size > self.max_bytes:
+                return      # 单个世界比整个缓存还大：不缓存
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (template, size)
+            self._bytes += size
+            while self._items and (self._bytes > self.max_bytes or len(self._items) > self.max_entries):
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, name=None):
+        """name 为空时清空；否则丢弃该名字的所有版本"""
+        with self._lock:
+            for key in [k for k in self._items if name is None or k[0] == name]:
+                self._bytes -= self._items.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+# 进程级单例（Streamlit 的所有会话共用一个进程）
+world_cache = WorldTemplateCache()
+
+
+def session_view(template):
+    """
+    会话自己的世界视图：冒险中会被修改的部分（MUTABLE_WORLD_KEYS）深拷贝，
+    story_nodes / locations / 文本等只读部分与模板共享同一个对象
+    """
+    view = dict(template)
+    for key in MUTABLE_WORLD_KEYS:
+        if key in view:
+            view[key] = copy.deepcopy(view[key])
+    return view
+
+
+def open_world(world_id, name, created_at):
+    """按 (name, created_at) 取模板（未命中按主键读库），返回会话视图；不存在返回 None"""
+    def load():
+        with unit_of_work() as session:
+            template = load_world_data(session, world_id)
+        if template is None:
+            return None
+        # 旧世界或规则更新后：补算性格 / 线索词典并写回（只更新变化的行，不改 created_at）
+        # 写回单独开 IMMEDIATE 事务：读事务里升级成写锁，遇到并发写者会直接 "database is locked"
+        changed = ensure_npc_personalities(template)
+        changed = ensure_clue_index(template) or changed
+        if changed:
+            with unit_of_work(write=True) as session:
+                WorldRepository(session).save(name, template, touch=False)
+        return template
+
+    template = world_cache.get((name, created_at), load)
+    return session_view(template) if template is not None else None
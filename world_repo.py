@@ -0,0 +1,387 @@
+# world_repo.py
+import json
+import time
+
+from db import (
+    SessionLocal, World, WorldLocation, WorldCharacter, StoryNode, StoryNodeOption,
+    WorldStateEntry, InventoryEntry, AdventureSession, AdventureRound, WORLD_SCHEMA_VERSION,
+)
+
+# 这些字段拆到独立的表里，其余字段仍留在 World.data
+NORMALIZED_KEYS = ("locations", "characters", "story_nodes", "world_state", "inventory")
+CHARACTER_STAT_COLUMNS = ("trust", "fear", "health")
+DEFAULT_INVENTORY = {"resources": {}, "items": [], "lore": []}
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _loads(raw, default=None):
+    return json.loads(raw) if raw else default
+
+
+# ---------------------------
+# world_obj → 各表行（纯函数，只产出列值）
+# ---------------------------
+# 规范化字段期望的形状；GPT 给出别的形状时整体留在 World.data 里原样保存
+_NORMALIZED_SHAPES = {"locations": list, "characters": list, "story_nodes": dict,
+                      "world_state": dict, "inventory": dict}
+_OPTION_KEYS = ("text", "goto")
+
+
+def _normalizable(world_obj, key):
+    return key in world_obj and isinstance(world_obj[key], _NORMALIZED_SHAPES[key])
+
+
+def _residual(world_obj):
+    return {k: v for k, v in world_obj.items() if k not in NORMALIZED_KEYS or not _normalizable(world_obj, k)}
+
+
+def _location_rows(world_obj):
+    rows = {}
+    for i, loc in enumerate(world_obj.get("locations") or []):
+        name = loc.get("name") if isinstance(loc, dict) else None
+        rows[i] = {"name": name, "data": _dumps(loc)}
+    return rows
+
+
+def _stat_column(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _character_rows(world_obj):
+    rows = {}
+    for i, ch in enumerate(world_obj.get("characters") or []):
+        columns = dict.fromkeys(CHARACTER_STAT_COLUMNS)
+        if not isinstance(ch, dict):
+            rows[i] = {"name": None, "role": None, "data": _dumps(ch), **columns}
+            continue
+        ch = dict(ch)
+        if isinstance(ch.get("stats"), dict):
+            # 整数值拆到列里，JSON 中留 None 占位以保持键顺序
+            stats = dict(ch["stats"])
+            for k in CHARACTER_STAT_COLUMNS:
+                if _stat_column(stats.get(k)):
+                    columns[k] = stats[k]
+                    stats[k] = None
+            ch["stats"] = stats
+        name, role = ch.get("name"), ch.get("role")
+        rows[i] = {"name": name if isinstance(name, str) else None,
+                   "role": role if isinstance(role, str) else None,
+                   "data": _dumps(ch), **columns}
+    return rows
+
+
+def _plain_options(options):
+    """只有 [{"text": str, "goto": str}] 这种标准形状才拆成选项行"""
+    return isinstance(options, list) and all(
+        isinstance(opt, dict) and set(opt) == set(_OPTION_KEYS)
+        and all(v is None or isinstance(v, str) for v in opt.values())
+        for opt in options
+    )
+
+
+def _node_rows(world_obj):
+    rows = {}
+    for i, (key, node) in enumerate((world_obj.get("story_nodes") or {}).items()):
+        if not isinstance(node, dict):
+            rows[key] = {"position": i, "summary": None, "data": _dumps({"__raw__": node})}
+            continue
+        extra = {k: v for k, v in node.items() if k not in ("summary", "options")}
+        summary = node.get("summary")
+        if summary is not None and not isinstance(summary, str):
+            extra["summary"] = summary
+            summary = None
+        if "options" in node and not _plain_options(node["options"]):
+            extra["options"] = node["options"]
+        rows[key] = {
+            "position": i,
+            "summary": summary,
+            "data": _dumps(extra) if extra else None,
+        }
+    return rows
+
+
+def _option_rows(node):
+    if not isinstance(node, dict) or not _plain_options(node.get("options") or []):
+        return {}
+    return {i: {k: opt.get(k) for k in _OPTION_KEYS} for i, opt in enumerate(node.get("options") or [])}
+
+
+def _state_rows(world_obj):
+    return {key: {"position": i, "value": _dumps(value)}
+            for i, (key, value) in enumerate((world_obj.get("world_state") or {}).items())}
+
+
+def _inventory_rows(world_obj):
+    rows = {}
+    for kind, container in (world_obj.get("inventory") or {}).items():
+        if isinstance(container, dict) and container:
+            for i, (key, value) in enumerate(container.items()):
+                rows[(kind, str(key))] = {"position": i, "shape": "dict", "data": _dumps(value)}
+        elif isinstance(container, list) and container:
+            for i, value in enumerate(container):
+                rows[(kind, str(i))] = {"position": i, "shape": "list", "data": _dumps(value)}
+        else:
+            # 空容器 / 标量：整体存一行，读回时原样还原
+            rows[(kind, "")] = {"position": 0, "shape": "value", "data": _dumps(container)}
+    return rows
+
+
+class WorldRepository:
+    """
+    规范化世界存储的读写入口。
+    save() 先读出已有行再逐行比较，只对变化的行发 INSERT / UPDATE / DELETE，
+    写入量与锁持有时间和“改了多少”成正比，而不是和世界大小成正比。
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    # ---------------------------
+    # 读
+    # ---------------------------
+    def get_id(self, name):
+        row = self.session.query(World.id).filter_by(name=name).first()
+        return row.id if row else None
+
+    def load(self, world_id):
+        """按主键组装完整的 world_obj；不存在返回 None"""
+        world = self.session.get(World, world_id)
+        if world is None:
+            return None
+        if world.schema_version < WORLD_SCHEMA_VERSION:
+            return _loads(world.data, {})
+
+        world_obj = _loads(world.data, {})
+        loaders = {
+            "locations": self._load_locations,
+            "characters": self._load_characters,
+            "story_nodes": self._load_nodes,
+            "world_state": self._load_world_state,
+            "inventory": self._load_inventory,
+        }
+        for key, loader in loaders.items():
+            # 形状不规范的字段保存在 World.data 里，优先使用
+            if key not in world_obj:
+                world_obj[key] = loader(world_id)
+        return world_obj
+
+    def _load_locations(self, world_id):
+        rows = (self.session.query(WorldLocation).filter_by(world_id=world_id)
+                .order_by(WorldLocation.position))
+        return [_loads(r.data) for r in rows]
+
+    def _load_characters(self, world_id):
+        out = []
+        rows = (self.session.query(WorldCharacter).filter_by(world_id=world_id)
+                .order_by(WorldCharacter.position))
+        for r in rows:
+            ch = _loads(r.data, {})
+            if not isinstance(ch, dict):
+                out.append(ch)
+                continue
+            columns = {k: getattr(r, k) for k in CHARACTER_STAT_COLUMNS if getattr(r, k) is not None}
+            stats = ch.get("stats")
+            if isinstance(stats, dict):
+                # 占位键按原位置回填；旧数据没有占位键时列值放在前面
+                filled = {k: columns[k] if v is None and k in columns else v for k, v in stats.items()}
+                ch["stats"] = {**{k: v for k, v in columns.items() if k not in stats}, **filled}
+            elif columns and "stats" not in ch:
+                ch["stats"] = columns
+            out.append(ch)
+        return out
+
+    def _load_nodes(self, world_id):
+        nodes = (self.session.query(StoryNode).filter_by(world_id=world_id)
+                 .order_by(StoryNode.position).all())
+        options = {}
+        if nodes:
+            rows = (self.session.query(StoryNodeOption)
+                    .filter(StoryNodeOption.node_id.in_([n.id for n in nodes]))
+                    .order_by(StoryNodeOption.node_id, StoryNodeOption.position))
+            for r in rows:
+                options.setdefault(r.node_id, []).append({"text": r.text, "goto": r.goto})
+
+        out = {}
+        for n in nodes:
+            extra = _loads(n.data, {})
+            if "__raw__" in extra:
+                out[n.node_key] = extra["__raw__"]
+                continue
+            node = {"summary": n.summary, "options": options.get(n.id, [])}
+            node.update(extra)
+            out[n.node_key] = node
+        return out
+
+    def _load_world_state(self, world_id):
+        rows = (self.session.query(WorldStateEntry).filter_by(world_id=world_id)
+                .order_by(WorldStateEntry.position, WorldStateEntry.key))
+        return {r.key: _loads(r.value) for r in rows}
+
+    def _load_inventory(self, world_id):
+        inv = {k: type(v)() for k, v in DEFAULT_INVENTORY.items()}
+        rows = (self.session.query(InventoryEntry).filter_by(world_id=world_id)
+                .order_by(InventoryEntry.kind, InventoryEntry.position))
+        for r in rows:
+            if r.shape == "value":
+                inv[r.kind] = _loads(r.data)
+            elif r.shape == "dict":
+                inv.setdefault(r.kind, {})[r.key] = _loads(r.data)
+            else:
+                inv.setdefault(r.kind, []).append(_loads(r.data))
+        return inv
+
+    # ---------------------------
+    # 写
+    # ---------------------------
+    def save(self, name, world_obj, touch=True):
+        """
+        新建或增量更新一个世界，返回 (world_id, 变更行数)。
+        touch=True 时刷新 created_at（重新生成同名世界 = 覆盖），
+        同时删除旧世界上的冒险存档（否则续玩会把旧进度套到新世界上）。
+        调用方负责 commit。
+        """
+        world = self.session.query(World).filter_by(name=name).first()
+        changed = 0
+        if world is None:
+            world = World(name=name, created_at=time.time())
+            self.session.add(world)
+            self.session.flush()
+            changed += 1
+        elif touch:
+            world.created_at = time.time()
+            changed += self._delete_sessions(world.id)
+
+        residual = _dumps(_residual(world_obj))
+        if world.schema_version != WORLD_SCHEMA_VERSION or world.data != residual:
+            world.data = residual
+            world.schema_version = WORLD_SCHEMA_VERSION
+            changed += 1
+
+        wid = world.id
+        normalized = {k: world_obj[k] for k in NORMALIZED_KEYS if _normalizable(world_obj, k)}
+        changed += self._sync(
+            {r.position: r for r in self.session.query(WorldLocation).filter_by(world_id=wid)},
+            _location_rows(normalized),
+            lambda pos, values: WorldLocation(world_id=wid, position=pos, **values),
+        )
+        changed += self._sync(
+            {r.position: r for r in self.session.query(WorldCharacter).filter_by(world_id=wid)},
+            _character_rows(normalized),
+            lambda pos, values: WorldCharacter(world_id=wid, position=pos, **values),
+        )
+        changed += self._sync_nodes(wid, normalized.get("story_nodes") or {})
+        changed += self._sync(
+            {r.key: r for r in self.session.query(WorldStateEntry).filter_by(world_id=wid)},
+            _state_rows(normalized),
+            lambda key, values: WorldStateEntry(world_id=wid, key=key, **values),
+        )
+        changed += self._sync(
+            {(r.kind, r.key): r for r in self.session.query(InventoryEntry).filter_by(world_id=wid)},
+            _inventory_rows(normalized),
+            lambda key, values: InventoryEntry(world_id=wid, kind=key[0], key=key[1], **values),
+        )
+        return wid, changed
+
+    def _sync(self, existing, desired, make):
+        """existing: {key: 行对象}；desired: {key: 列值}。只改有差异的行"""
+        changed = 0
+        for key, values in desired.items():
+            row = existing.pop(key, None)
+            if row is None:
+                self.session.add(make(key, values))
+                changed += 1
+                continue
+            diff = {f: v for f, v in values.items() if getattr(row, f) != v}
+            for f, v in diff.items():
+                setattr(row, f, v)
+            changed += bool(diff)
+        for row in existing.values():
+            self.session.delete(row)
+            changed += 1
+        return changed
+
+    def _sync_nodes(self, world_id, story_nodes):
+        existing = {r.node_key: r for r in self.session.query(StoryNode).filter_by(world_id=world_id)}
+        changed = self._sync(
+            existing, _node_rows({"story_nodes": story_nodes}),
+            lambda key, values: StoryNode(world_id=world_id, node_key=key, **values),
+        )
+        # 新节点需要先拿到主键才能写选项
+        self.session.flush()
+        nodes = {r.node_key: r.id for r in self.session.query(StoryNode.node_key, StoryNode.id)
+                 .filter_by(world_id=world_id)}
+        options = {}
+        if nodes:
+            for r in self.session.query(StoryNodeOption).filter(StoryNodeOption.node_id.in_(nodes.values())):
+                options.setdefault(r.node_id, {})[r.position] = r
+        for key, node in story_nodes.items():
+            node_id = nodes[key]
+            changed += self._sync(
+                options.get(node_id, {}), _option_rows(node),
+                lambda pos, values, node_id=node_id: StoryNodeOption(node_id=node_id, position=pos, **values),
+            )
+        return changed
+
+    def delete(self, world_id):
+        # 不依赖外键级联，显式删除子表
+        node_ids = [r.id for r in self.session.query(StoryNode.id).filter_by(world_id=world_id)]
+        if node_ids:
+            (self.session.query(StoryNodeOption).filter(StoryNodeOption.node_id.in_(node_ids))
+             .delete(synchronize_session=False))
+        self._delete_sessions(world_id)
+        for model in (StoryNode, WorldLocation, WorldCharacter, WorldStateEntry, InventoryEntry):
+            self.session.query(model).filter_by(world_id=world_id).delete(synchronize_session=False)
+        self.session.query(World).filter_by(id=world_id).delete(synchronize_session=False)
+
+    def _delete_sessions(self, world_id):
+        """删除一个世界的全部冒险存档（含回合），返回删除的会话数"""
+        session_ids = [r.id for r in self.session.query(AdventureSession.id).filter_by(world_id=world_id)]
+        if not session_ids:
+            return 0
+        (self.session.query(AdventureRound).filter(AdventureRound.session_id.in_(session_ids))
+         .delete(synchronize_session=False))
+        (self.session.query(AdventureSession).filter(AdventureSession.id.in_(session_ids))
+         .delete(synchronize_session=False))
+        return len(session_ids)
+
+    # ---------------------------
+    # 旧数据迁移
+    # ---------------------------
+    def migrate(self, world_id):
+        """把一个旧格式（整块 JSON）世界拆成规范化存储；已迁移的直接跳过"""
+        world = self.session.get(World, world_id)
+        if world is None or world.schema_version >= WORLD_SCHEMA_VERSION:
+            return False
+        self.save(world.name, _loads(world.data, {}), touch=False)
+        return True
+
+    def migrate_all(self):
+        ids = [r.id for r in self.session.query(World.id)
+               .filter(World.schema_version < WORLD_SCHEMA_VERSION)]
+        for world_id in ids:
+            self.migrate(world_id)
+            self.session.commit()
+        return len(ids)
+
+
+def load_world_data(session, world_id):
+    return WorldRepository(session).load(world_id)
+
+
+if __name__ == "__main__":
+    # python world_repo.py migrate  → 把 worlds.db 里的旧格式世界全部迁移
+    import sys
+    from db import init_db
+
+    if sys.argv[1:2] == ["migrate"]:
+        init_db()
+        session = SessionLocal()
+        try:
+            print(f"migrated {WorldRepository(session).migrate_all()} world(s)")
+        finally:
+            session.close()
+    else:
+        print("usage: python world_repo.py migrate")
@@ -0,0 +1,155 @@
+# world_tick.py
+import copy
+import random
+import hashlib
+import secrets
+
+# ---------------------------
+# 节奏常量（AdventureManager 与 pacing_sim 共用）
+# ---------------------------
+DRIFT_KEYS = ("tension", "corruption", "magic_density", "radiation")
+DRIFT_MIN, DRIFT_MAX = -2, 3               # 每回合世界状态波动（含两端）
+STAT_MIN, STAT_MAX = 0, 100
+TIME_OF_DAY_CYCLE = 3                      # 0=白天 1=黄昏 2=夜晚
+WEATHER_CHANGE_P = 0.2
+WEATHERS = ("clear", "cloudy", "fog", "rain", "storm", "snow")
+PROGRESS_MIN, PROGRESS_MAX = 3, 8          # 每回合主线推进（%，含两端）
+CHAPTER_THRESHOLDS = (10, 30, 60, 80, 100)  # progress 低于第 i 个阈值 → 第 i 章
+NODE_ROUND_LIMIT = 2                       # 每个剧情节点的普通回合数，之后给出跳转选项
+
+
+def new_seed():
+    """世界 / 会话的随机种子（生成世界时写入 world_obj["rng_seed"]）"""
+    return secrets.randbits(63)
+
+
+def session_seed(world_seed, session_id):
+    """
+    会话自己的种子 = hash(世界种子, 会话 id)：同一个世界的不同会话各走各的随机序列，
+    知道世界种子和会话 id 就能重算出来，整局可以重放
+    """
+    raw = f"{world_seed}:{session_id}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "big") >> 1
+
+
+def _rng(seed, round_no, stream):
+    # 每个 (种子, 回合, 子系统) 一条独立序列：与调用顺序、其他会话都无关
+    return random.Random(f"{seed}:{round_no}:{stream}")
+
+
+def chapter_for(progress):
+    for chapter, threshold in enumerate(CHAPTER_THRESHOLDS):
+        if progress < threshold:
+            return chapter
+    return len(CHAPTER_THRESHOLDS)
+
+
+# ---------------------------
+# 纯函数：旧状态 + 种子 + 回合号 → 新状态（不修改输入）
+# ---------------------------
+def tick_world_state(world_state, seed, round_no):
+    """世界“呼吸”：数值小幅波动、昼夜循环、低概率换天气"""
+    ws = dict(world_state)
+    rng = _rng(seed, round_no, "world")
+
+    for key in DRIFT_KEYS:
+        if key in ws and isinstance(ws[key], (int, float)):
+            ws[key] = max(STAT_MIN, min(STAT_MAX, ws[key] + rng.randint(DRIFT_MIN, DRIFT_MAX)))
+
+    if "time_of_day" in ws:
+        ws["time_of_day"] = (ws["time_of_day"] + 1) % TIME_OF_DAY_CYCLE
+
+    if "weather" in ws and rng.random() < WEATHER_CHANGE_P:
+        ws["weather"] = rng.choice(WEATHERS)
+    return ws
+
+
+def tick_story(adventure_state, seed, round_no):
+    """主线推进 3~8%，并按进度更新章节；终章触发后不再变化"""
+    adv = dict(adventure_state)
+    if adv.get("final_triggered"):
+        return adv
+    rng = _rng(seed, round_no, "story")
+    adv["story_progress"] = min(100, adv.get("story_progress", 0) + rng.randint(PROGRESS_MIN, PROGRESS_MAX))
+    adv["chapter"] = chapter_for(adv["story_progress"])
+    return adv
+
+
+def tick(state, seed, round_no):
+    """
+    state = {"world_state": {...}, "adventure_state": {...}}（其余键原样带过）
+    返回第 round_no 回合结束后的新 state
+    """
+    out = copy.deepcopy(state)
+    out["world_state"] = tick_world_state(state.get("world_state", {}), seed, round_no)
+    out["adventure_state"] = tick_story(state.get("adventure_state", {}), seed, round_no)
+    return out
+
+
+# ---------------------------
+# 重放：只需要初始状态 + 种子，不存快照
+# ---------------------------
+def iter_replay(initial, seed, start_round=1):
+    """从 initial 开始逐回合产出 (round_no, state)"""
+    state = initial
+    round_no = start_round
+    while True:
+        state = tick(state, seed, round_no)
+        yield round_no, state
+        round_no += 1
+
+
+def replay(initial, seed, upto_round, start_round=1):
+    """重建第 upto_round 回合结束时的状态（upto_round < start_round 时返回 initial 的拷贝）"""
+    if upto_round < start_round:
+        return copy.deepcopy(initial)
+    for round_no, state in iter_replay(initial, seed, start_round):
+        if round_no >= upto_round:
+            return state
+
+
+def replay_session(session, session_id):
+    """
+    按会话种子从世界模板重放 world_state / 主线进度，并与回合日志里记录的状态逐回合对比。
+    产出 (回合号, 重放的 state, 日志里的 state)；开场回合（第 1 回合）不 tick
+    """
+    from world_repo import load_world_data
+    from adventure_store import get_session, iter_rounds
+
+    meta = get_session(session, session_id)
+    template = load_world_data(session, meta.world_id) if meta else None
+    if template is None:
+        return
+    keys = ("world_state", "adventure_state")
+    logged = {k: copy.deepcopy(template.get(k, {})) for k in keys}
+    replayed, seed = None, None
+    for seq, payload in iter_rounds(session, session_id):
+        seed = payload.get("rng_seed", seed)
+        for key in keys:
+            if key in payload.get("world", {}):
+                logged[key] = payload["world"][key]
+        if seq == 1:
+            replayed = iter_replay(copy.deepcopy(logged), seed, start_round=2)
+            continue
+        _, state = next(replayed)
+        yield seq, state, copy.deepcopy(logged)
+
+
+if __name__ == "__main__":
+    # python world_tick.py replay SESSION_ID  → 逐回合重放世界演化，并与回合日志对比
+    import sys
+    from db import SessionLocal
+
+    if sys.argv[1:2] == ["replay"] and len(sys.argv) > 2:
+        session = SessionLocal()
+        try:
+            for seq, state, logged in replay_session(session, sys.argv[2]):
+                ok = (state["world_state"] == logged["world_state"]
+                      and state["adventure_state"].get("story_progress")
+                      == logged["adventure_state"].get("story_progress"))
+                print(f"round {seq:3d}  progress {state['adventure_state'].get('story_progress', 0):3d}%  "
+                      f"{'ok' if ok else 'MISMATCH'}  {state['world_state']}")
+        finally:
+            session.close()
+    else:
+        print("usage: python world_tick.py replay SESSION_ID")